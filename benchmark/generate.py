@@ -0,0 +1,213 @@
+"""
+生成用于基准测试的合成文件库: 存档目录(N个文件夹 × M个文件)、待整理的工作目录，以及与之对应的数据库，并写出一份指向它们的配置。
+文件名由config.yaml.example中的rename和save规则反向生成，因此与真实配置下的命名一致。
+数据库中complex来源的记录带有符合真实分布的tags、pools和parent，其他来源的记录为未解析状态。
+为了覆盖organize的各个分支，约1%的存档文件没有数据库记录(未保存)，约1%的数据库记录没有对应文件(已删除但未标记)。
+用法: python benchmark/generate.py DIR [records] [files_per_folder] [work_files]
+生成后，以HOME=DIR/home运行imm即使用生成的配置。
+"""
+import os
+import re
+import sys
+import json
+import random
+import datetime
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import yaml
+from module.database import Database
+from module.local import compile_save_rules, get_source_info
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+EXTENSIONS = ["jpg", "jpg", "jpg", "png", "png", "gif", "mp4"]
+
+# 各save规则的来源在存档中所占的比例，未列出的来源按1计
+SOURCE_WEIGHTS = {"complex": 80, "pixiv": 15}
+
+
+def sample_name(pattern: str, number: int, rnd: random.Random):
+    """
+    生成一个能被正则表达式匹配的字符串。只支持文件名规则中常见的结构: 字面量、\\d、字符集、分组和重复。
+    第一个重复的数字段使用number，之后的数字段使用较小的随机数。
+    :return: str or None 无法生成时为None
+    """
+    state = {"first": True}
+
+    def digits():
+        if state["first"]:
+            state["first"] = False
+            return str(number)
+        return str(rnd.randrange(4))
+
+    def emit(items):
+        out = []
+        for (op, av) in items:
+            name = str(op)
+            if name == "LITERAL":
+                out.append(chr(av))
+            elif name == "AT":
+                continue
+            elif name == "SUBPATTERN":
+                out.append(emit(av[-1]))
+            elif name in ("MAX_REPEAT", "MIN_REPEAT"):
+                low, _, body = av
+                if len(body) == 1 and str(body[0][0]) == "IN" and any(str(x[0]) == "CATEGORY" for x in body[0][1]):
+                    out.append(digits())
+                else:
+                    out.append(emit(body) * max(low, 1))
+            elif name == "IN":
+                first = av[0]
+                if str(first[0]) == "CATEGORY":
+                    out.append(digits())
+                elif str(first[0]) == "LITERAL":
+                    out.append(chr(first[1]))
+                elif str(first[0]) == "RANGE":
+                    out.append(chr(first[1][0]))
+                else:
+                    raise ValueError(pattern)
+            elif name == "BRANCH":
+                out.append(emit(av[1][0]))
+            else:
+                raise ValueError(pattern)
+        return "".join(out)
+
+    try:
+        result = emit(sre_parse.parse(pattern))
+    except ValueError:
+        return None
+    return result if re.match(pattern, result) else None
+
+
+def load_rules():
+    with open(os.path.join(ROOT, "config.yaml.example")) as f:
+        example = yaml.safe_load(f)
+    return example["rename"], example["save"]
+
+
+def write_config(directory: str, rename: dict, save: dict):
+    home = os.path.join(directory, "home")
+    os.makedirs(os.path.join(home, ".config", "imm"), exist_ok=True)
+    conf = {
+        "work_path": {
+            "default_work_dir": os.path.join(directory, "work"),
+            "archive_dir": os.path.join(directory, "archive"),
+            "db_path": os.path.join(directory, "data.db")
+        },
+        "supported_extensions": sorted(set(EXTENSIONS)),
+        "rename": rename,
+        "save": save,
+        "download": {"waiting_interval": 0}
+    }
+    with open(os.path.join(home, ".config", "imm", "config.yaml"), "w") as f:
+        yaml.safe_dump(conf, f)
+    return conf
+
+
+def random_tags(rnd: random.Random, general_weights: list[float]):
+    cp = rnd.randrange(300)
+    tags = [{"type": "copyright", "name": "copyright_%d" % (cp,), "title": "コピーライト%d" % (cp,), "count": str(rnd.randrange(100, 100000))}]
+    for _ in range(rnd.choice([1, 1, 1, 2, 3])):
+        tags.append({"type": "character", "name": "character_%d_%d" % (cp, rnd.randrange(30)), "title": "キャラクター", "count": str(rnd.randrange(10, 10000))})
+    tags.append({"type": "artist", "name": "artist_%d" % (int(rnd.paretovariate(1.2)) % 5000,), "title": None, "count": str(rnd.randrange(1, 2000))})
+    for g in set(rnd.choices(range(len(general_weights)), cum_weights=general_weights, k=rnd.randrange(10, 40))):
+        tags.append({"type": "general", "name": "general_%d" % (g,), "title": None, "count": str(rnd.randrange(100, 1000000))})
+    if rnd.random() < 0.3:
+        tags.append({"type": "meta", "name": rnd.choice(["highres", "absurdres", "animated", "video"]), "title": None, "count": "1000000"})
+    return tags
+
+
+def generate(directory: str, records: int, files_per_folder: int = 1000, work_files: int = None, seed: int = 0):
+    """
+    生成合成文件库。
+    :return: dict 生成所用的配置
+    """
+    rnd = random.Random(seed)
+    rename, save = load_rules()
+    conf = write_config(directory, rename, save)
+    archive_dir, work_dir = conf["work_path"]["archive_dir"], conf["work_path"]["default_work_dir"]
+    work_files = work_files if work_files is not None else max(records // 100, 10)
+
+    save_rules = compile_save_rules(save["rules"])
+    sources = [rule for rule in save["rules"] if sample_name(rule["filename"], 1, rnd) is not None]
+    source_weights = [SOURCE_WEIGHTS.get(rule["source"], 1) for rule in sources]
+    general_weights, total = [], 0.0
+    for i in range(20000):
+        total += 1.0 / (i + 1)
+        general_weights.append(total)
+
+    db = Database(conf["work_path"]["db_path"])
+    cursor = db.cursor()
+    start = datetime.datetime(2020, 1, 1)
+    rows, folder_count = [], (records + files_per_folder - 1) // files_per_folder
+    for index in range(records):
+        folder = (start + datetime.timedelta(days=index // files_per_folder)).strftime("%Y-%m-%d")
+        rule = rnd.choices(sources, weights=source_weights)[0]
+        name = sample_name(rule["filename"], 1000000 + index, rnd)
+        filename = "%s.%s" % (name, rnd.choice(EXTENSIONS))
+        source, pid, metadata = get_source_info(name, save_rules)
+        # 约1%的文件不入库(未保存)，约1%的记录没有文件(已删除但未标记)
+        roll = rnd.random()
+        if roll >= 0.01:
+            os.makedirs(os.path.join(archive_dir, folder), exist_ok=True)
+            open(os.path.join(archive_dir, folder, filename), "wb").close()
+        if roll < 0.01 or roll >= 0.02:
+            create_time = start + datetime.timedelta(seconds=index * 60)
+            if source == "complex":
+                relations = {
+                    "pools": [{"id": str(rnd.randrange(2000)), "name": "pool_%d" % (rnd.randrange(2000),)}] if rnd.random() < 0.15 else [],
+                    "parent": [str(int(pid) - 1)] if rnd.random() < 0.1 and index > 0 else [],
+                    "children": []
+                }
+                meta = {"source": None, "rating": rnd.choice("sqe"), "md5": "%032x" % (rnd.getrandbits(128),)}
+                rows.append((1, folder, filename, source, pid, json.dumps(random_tags(rnd, general_weights)), json.dumps(relations),
+                             json.dumps(meta), create_time, create_time))
+            else:
+                rows.append((0, folder, filename, source, pid, None, None, json.dumps(metadata) if metadata else None, create_time, None))
+        if len(rows) >= 10000:
+            cursor.executemany('INSERT INTO meta(status, folder, filename, source, pid, tags, relations, meta, create_time, analyse_time) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            rows.clear()
+    if len(rows) > 0:
+        cursor.executemany('INSERT INTO meta(status, folder, filename, source, pid, tags, relations, meta, create_time, analyse_time) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    cursor.connection.commit()
+    cursor.close()
+    # 以数据库自身的维护过程建立紧凑tags和各派生表，与真实数据库的状态一致
+    db.migrate_compact_tags()
+    db.rebuild_tag_stats()
+    db.rebuild_tag_index()
+    db.rebuild_fts()
+    db.rebuild_relations()
+    db.close()
+
+    rename_rules = [rule for rule in rename["rules"] if sample_name(rule["filename"], 1, rnd) is not None]
+    os.makedirs(work_dir, exist_ok=True)
+    for index in range(work_files):
+        rule = rnd.choice(rename_rules)
+        name = sample_name(rule["filename"], 5000000 + index, rnd)
+        open(os.path.join(work_dir, "%s.%s" % (name, rnd.choice(EXTENSIONS))), "wb").close()
+
+    print("# generated %s records in %s folders, %s work files: %s" % (records, folder_count, work_files, directory))
+    return conf
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    directory = sys.argv[1]
+    records = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    files_per_folder = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    work_files = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    generate(directory, records, files_per_folder, work_files)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+检查CLI冷启动的导入耗时。对每个本地命令，在新的解释器中以-X importtime导入imm并取得该命令的函数，
+统计累计导入耗时，并确认没有导入只有下载等命令才需要的重量级依赖。
+任何命令超出预算或导入了禁止的模块时以非0状态退出，可以作为回归检查。
+用法: python benchmark/import_time.py [budget_ms] [repeat]
+"""
+import os
+import re
+import sys
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# 只操作本地文件和数据库的命令
+LOCAL_COMMANDS = ["rename", "save", "ingest", "watch", "organize", "export", "recover", "stats", "query_one", "query_list"]
+
+# 本地命令不应导入的模块
+FORBIDDEN_MODULES = {"requests", "bs4", "urllib3", "socks", "numpy", "PIL"}
+
+__LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def measure(name: str):
+    """
+    :return: (float, set[str]) 累计导入耗时(ms)，和导入的顶层模块集合
+    """
+    code = "import imm, command; command.%s" % (name,)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("%s failed:\n%s" % (name, result.stderr))
+    total, modules = 0, set()
+    for line in result.stderr.splitlines():
+        match = __LINE.match(line)
+        if match is None:
+            continue
+        modules.add(match.group(4).split('.')[0])
+        # 只累加最外层的导入，它们的累计耗时已经包括了嵌套的导入。site属于解释器自身的启动过程，不计入
+        if len(match.group(3)) == 1 and match.group(4) != "site":
+            total += int(match.group(2))
+    return total / 1000, modules
+
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 100
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    failed = False
+    print("%-12s %10s  %s" % ("command", "import ms", "forbidden modules"))
+    for name in LOCAL_COMMANDS:
+        costs, forbidden = [], set()
+        for _ in range(repeat):
+            cost, modules = measure(name)
+            costs.append(cost)
+            forbidden |= modules & FORBIDDEN_MODULES
+        cost = min(costs)
+        over = cost > budget or len(forbidden) > 0
+        failed = failed or over
+        print("%-12s %10.1f  %s%s" % (name, cost, ", ".join(sorted(forbidden)) or "-", "  << over budget" if over else ""))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
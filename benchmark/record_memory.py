@@ -0,0 +1,73 @@
+"""
+比较查询结果以dict形式立即解码全部JSON字段，与以MetaRecord延迟解码时的内存占用和耗时。
+用法: python benchmark/record_memory.py [rows]
+"""
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import tracemalloc
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from module.database import Database
+
+
+def generate(db_path: str, rows: int):
+    random.seed(0)
+    db = Database(db_path)
+    cursor = db.cursor()
+    now = datetime.datetime.now()
+    records = []
+    for i in range(rows):
+        tags = [{"type": "general", "name": "g%d" % random.randrange(2000), "title": None, "count": "100"} for _ in range(20)]
+        tags.append({"type": "copyright", "name": "cp%d" % random.randrange(200), "title": "CP", "count": "10"})
+        relations = {"pools": [], "parent": [], "children": []}
+        meta = {"source": None, "rating": random.choice("sqe"), "md5": "%032x" % random.getrandbits(128)}
+        records.append((1, "2022-01-01", "sankakucomplex_%d.jpg" % i, "complex", str(i), json.dumps(tags), json.dumps(relations), json.dumps(meta), now))
+    cursor.executemany('INSERT INTO meta(status, folder, filename, source, pid, tags, relations, meta, create_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', records)
+    cursor.connection.commit()
+    cursor.close()
+    db.migrate_compact_tags()
+    db.close()
+
+
+def eager_dicts(db: Database):
+    """
+    原先query_list的行为: 每行构造一个dict，并立即解码全部JSON字段。
+    """
+    return [record.to_dict() for record in db.query_list()]
+
+
+def measure(name: str, load, access):
+    tracemalloc.start()
+    start = time.perf_counter()
+    items = load()
+    for item in items:
+        access(item)
+    cost = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("%-28s %8.1f MiB retained %8.1f MiB peak %8.2fs" % (name, current / 1048576, peak / 1048576, cost))
+    del items
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        generate(db_path, rows)
+        db = Database(db_path)
+        print("# %s rows" % (rows,))
+        measure("dict, read pid", lambda: eager_dicts(db), lambda item: item['pid'])
+        measure("MetaRecord, read pid", lambda: db.query_list(), lambda item: item.pid)
+        measure("dict, read tags", lambda: eager_dicts(db), lambda item: item['tags'])
+        measure("MetaRecord, read tags", lambda: db.query_list(), lambda item: item.tags)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
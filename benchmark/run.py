@@ -0,0 +1,164 @@
+"""
+端到端基准测试。在每个规模下用generate.py生成合成文件库，在独立的进程中运行各个imm命令并计时，
+另外在进程内对扫描和入库的核心函数单独计时。结果写为JSON，便于与历次结果比较。
+只读命令(试运行、查询、导出)重复执行并取各次耗时；会修改文件库的命令在最后依次执行一次。
+用法: python benchmark/run.py [--scales 10000,100000] [--repeat 3] [--output FILE] [--keep DIR]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from generate import generate
+from module.database import Database, insert_records
+from module.local import scan_rename_files, scan_move_files
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# (名称, 参数)。只读的命令
+READ_COMMANDS = [
+    ("rename --dry-run", ["rename", "--dry-run"]),
+    ("save --dry-run", ["save", "--dry-run", "--archive", "bench"]),
+    ("organize --mark-deleted --dry-run", ["organize", "--mark-deleted", "--dry-run"]),
+    ("organize --unsaved --dry-run", ["organize", "--unsaved", "--dry-run"]),
+    ("organize --deduplicate --dry-run", ["organize", "--deduplicate", "--dry-run"]),
+    ("query list", ["query", "list", "general_1 -general_2", "--limit", "100"]),
+    ("query search", ["query", "search", "character_1", "--limit", "100"]),
+    ("stats types count", ["stats", "types", "count", "general"]),
+    ("stats --scan types", ["stats", "--scan", "types"]),
+    ("export json", ["export", "--archive", "2020-01-01", "--format", "json", "--output", "{tmp}/export.json"]),
+]
+
+# 依次执行一次、会修改文件库的命令
+WRITE_COMMANDS = [
+    ("rename", ["rename"]),
+    ("save", ["save", "--archive", "bench"]),
+    ("organize --mark-deleted", ["organize", "--mark-deleted"]),
+    ("export --delta", ["export", "--delta", "bench", "--format", "jsonl", "--output", "{tmp}/delta.jsonl"]),
+    ("compact", ["compact", "--days", "0"]),
+]
+
+
+def run_command(directory: str, argv: list[str]):
+    """
+    :return: (float, int, str) 耗时、退出码，和出错时标准错误的末尾
+    """
+    env = dict(os.environ, HOME=os.path.join(directory, "home"), IMM_NO_DAEMON="1")
+    env.pop("IMM_SOCKET", None)
+    argv = [a.replace("{tmp}", directory) for a in argv]
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, os.path.join(ROOT, "imm.py")] + argv, cwd=directory, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    cost = time.perf_counter() - start
+    return cost, result.returncode, result.stderr[-2000:] if result.returncode != 0 else ""
+
+
+def time_function(function, repeat: int):
+    costs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        costs.append(time.perf_counter() - start)
+    return costs
+
+
+def run_functions(directory: str, conf: dict, repeat: int):
+    """
+    在进程内对核心函数计时，排除进程启动和配置加载。
+    """
+    results = []
+    work_dir, archive_dir = conf["work_path"]["default_work_dir"], conf["work_path"]["archive_dir"]
+    folder = sorted(os.listdir(archive_dir))[0]
+    rename, save, extensions = conf["rename"], conf["save"], conf["supported_extensions"]
+    results.append(("scan_rename_files", time_function(
+        lambda: scan_rename_files(work_dir, rename["rules"], extensions, rename.get("excludes", [])), repeat)))
+    results.append(("scan_move_files", time_function(
+        lambda: scan_move_files(os.path.join(archive_dir, folder), save["rules"], extensions), repeat)))
+    # 入库在数据库的副本上进行，不影响之后的命令
+    matched, _ = scan_move_files(os.path.join(archive_dir, folder), save["rules"], extensions)
+    copy_path = os.path.join(directory, "insert.db")
+
+    def insert():
+        shutil.copyfile(conf["work_path"]["db_path"], copy_path)
+        db = Database(copy_path)
+        start = time.perf_counter()
+        insert_records(db, "insert-bench", [("x" + filename, source, pid + "x", metadata) for (filename, source, pid, metadata) in matched])
+        cost = time.perf_counter() - start
+        db.close()
+        return cost
+    results.append(("insert_records(%d)" % (len(matched),), [insert() for _ in range(repeat)]))
+    os.remove(copy_path)
+    return results
+
+
+def summarize(costs: list[float]):
+    ordered = sorted(costs)
+    return {"runs": [round(c, 6) for c in costs], "min": round(ordered[0], 6), "median": round(ordered[len(ordered) // 2], 6)}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="imm端到端基准测试")
+    parser.add_argument("--scales", default="10000,100000", help="逗号分隔的记录数列表，例如10000,100000,1000000")
+    parser.add_argument("--files-per-folder", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="结果文件。默认为benchmark/results/<时间>.json")
+    parser.add_argument("--keep", help="在此目录下生成并保留文件库，而不是使用临时目录")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(ROOT, "benchmark", "results", datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    report = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": []
+    }
+    for scale in [int(s) for s in args.scales.split(",")]:
+        base = args.keep or tempfile.mkdtemp(prefix="imm-bench-")
+        directory = os.path.join(base, str(scale))
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        start = time.perf_counter()
+        conf = generate(directory, scale, args.files_per_folder)
+        report["results"].append({"scale": scale, "name": "generate", "kind": "setup", **summarize([time.perf_counter() - start])})
+
+        for (name, costs) in run_functions(directory, conf, args.repeat):
+            report["results"].append({"scale": scale, "name": name, "kind": "function", **summarize(costs)})
+            print("%10d  %-40s %9.3fs" % (scale, name, min(costs)))
+        for (commands, repeat) in ((READ_COMMANDS, args.repeat), (WRITE_COMMANDS, 1)):
+            for (name, argv) in commands:
+                costs, error = [], None
+                for _ in range(repeat):
+                    cost, code, stderr = run_command(directory, argv)
+                    costs.append(cost)
+                    if code != 0:
+                        error = "exit %s: %s" % (code, stderr)
+                        break
+                report["results"].append({"scale": scale, "name": name, "kind": "command", "error": error, **summarize(costs)})
+                print("%10d  %-40s %9.3fs%s" % (scale, name, min(costs), "  FAILED" if error else ""))
+        if args.keep is None:
+            shutil.rmtree(base)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print("# results: %s" % (output,))
+
+
+if __name__ == '__main__':
+    main()
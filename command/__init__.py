@@ -1,5 +1,37 @@
-from .rename import rename
-from .save import save
-from .download import download
-from .organize import organize
-from .export import export
+import importlib
+
+# 命令名称 -> 所在的模块。命令模块在第一次被访问时才导入，
+# 这样每个子命令只加载自己需要的依赖，不会因为导入command而加载requests、bs4、numpy等
+__commands = {
+    "rename": ".rename",
+    "save": ".save",
+    "download": ".download",
+    "organize": ".organize",
+    "export": ".export",
+    "watch": ".watch",
+    "recover": ".recover",
+    "apply": ".apply",
+    "compact": ".compact",
+    "ingest": ".ingest",
+    "stats": ".stats",
+    "serve": ".serve",
+    "start_profiling": ".profile",
+    "start_progress": ".progress",
+    "query_one": ".query",
+    "query_list": ".query",
+    "query_search": ".query",
+    "query_tags": ".query",
+    "query_family": ".query",
+    "query_pool": ".query"
+}
+
+__all__ = list(__commands.keys())
+
+
+def __getattr__(name: str):
+    module = __commands.get(name)
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
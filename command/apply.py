@@ -0,0 +1,55 @@
+from module.database import Database
+from module.journal import get_journal, apply_plan, recover_pending_plan
+from module.probe import probe_records
+from module.plan import Plan
+from module.config import load_conf
+from module.progress import progress
+import os
+
+
+def apply(plan_path: str, force: bool):
+    """
+    执行由--plan-out保存的计划。执行前校验计划涉及的文件的指纹，而不重新扫描目录；任何文件发生变化，或数据库在计划生成后被修改过时，拒绝执行。
+    移动、数据库记录和删除作为一个日志计划执行，数据库记录在同一个事务中写入。
+
+    :param plan_path: 计划文件
+    :param force: 跳过文件指纹和数据库版本的校验，直接执行计划
+    """
+    conf = load_conf()
+    plan = Plan.load(plan_path)
+    if os.path.abspath(plan.db_path) != os.path.abspath(conf["work_path"]["db_path"]):
+        print("\033[1;31m计划是针对另一个数据库(%s)生成的。\033[0m" % (plan.db_path,))
+        exit(1)
+
+    print("# 计划来源: \033[1;34m%s\033[0m, 移动: %s, 记录: %s, 删除: %s, 标记删除: %s"
+          % (plan.command, len(plan.moves), len(plan.records), len(plan.deletes), len(plan.marks)))
+
+    if not force:
+        with progress.phase("validate", len(plan.fingerprints)):
+            changed = plan.validate()
+            progress.advance(len(plan.fingerprints))
+        if len(changed) > 0:
+            print()
+            print("# === 计划生成后发生变化的文件 %s项 ===" % (len(changed),))
+            for (path, expected, actual) in changed:
+                print("* \033[1;33m%s\033[0m %s" % (path, "已不存在" if actual is None else "新出现" if expected is None else "已修改"))
+            print()
+            print("\033[1;31m# 计划已过期，请重新生成计划。\033[0m")
+            exit(1)
+
+    db = Database(conf["work_path"]["db_path"])
+    journal = get_journal(conf)
+    recover_pending_plan(db, journal)
+    if not force and plan.row_version is not None and db.query_row_version() != plan.row_version:
+        print("\033[1;31m# 计划生成后数据库已被修改，计划已过期，请重新生成计划。\033[0m")
+        exit(1)
+
+    with progress.phase("apply", len(plan.moves) + len(plan.records) + len(plan.deletes) + len(plan.marks)):
+        apply_plan(db, journal, plan.moves, plan.records, plan.deletes)
+        if len(plan.records) > 0:
+            db.write_probes(probe_records(conf["work_path"]["archive_dir"], [(source, pid, folder, filename) for (source, pid, folder, filename, _) in plan.records]))
+        db.mark_deleted_many(plan.marks)
+        progress.advance(len(plan.moves) + len(plan.records) + len(plan.deletes) + len(plan.marks))
+
+    print()
+    print("\033[1;32m# 计划已执行。\033[0m")
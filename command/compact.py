@@ -0,0 +1,33 @@
+from module.database import Database
+from module.config import load_conf
+from datetime import datetime, timedelta
+
+
+def compact(days, purge, dry_run):
+    """
+    将删除已超过指定天数的记录移出meta表，存入meta_archive表，或直接丢弃。
+    已删除的记录仍然占据meta表及其索引，所有查询都要在过滤NOT deleted时扫过它们；移出之后查询只面对有效记录。
+    增量导出尚未送达的墓碑会被保留到下次增量导出之后。
+
+    :param days: 只移出删除时间早于此天数之前的记录
+    :param purge: 直接丢弃记录，而不是存入meta_archive表
+    :param dry_run: 试运行，仅统计符合条件的记录数
+    """
+    conf = load_conf()
+    db = Database(conf["work_path"]["db_path"])
+    before = datetime.now() - timedelta(days=days)
+
+    print()
+    if dry_run:
+        count = db.compact_deleted(before, dry_run=True)
+        if count > 0:
+            print("# === 发现删除已超过%s天的记录 %s条 ===" % (days, count))
+        else:
+            print("# === 未发现删除已超过%s天的记录 ===" % (days,))
+        return
+
+    count = db.compact_deleted(before, purge=purge)
+    if count > 0:
+        print("\033[1;32m# 已%s%s条删除已超过%s天的记录。\033[0m" % ("丢弃" if purge else "归档", count, days))
+    else:
+        print("# === 未发现删除已超过%s天的记录 ===" % (days,))
@@ -1,6 +1,7 @@
 from module.database import Database, get_analyzable_records
-from module.external import External, available_types
+from module.external import shared_external, available_types
 from module.config import load_conf
+from module.progress import progress
 from datetime import datetime
 import time
 
@@ -11,7 +12,7 @@ def download():
     """
     conf = load_conf()
     db = Database(conf["work_path"]["db_path"])
-    external = External(conf["download"].get("strategy", {}), conf["download"].get("params", {}))
+    external = shared_external(conf["download"].get("strategy", {}), conf["download"].get("params", {}))
     waiting_interval = conf["download"].get("waiting_interval", 0)
 
     records = get_analyzable_records(db, available_types)
@@ -26,6 +27,7 @@ def download():
     header_printer = download_header_printer(len(records))
     last_download_time = None
     success_num, failed_num = 0, 0
+    progress.start("download", len(records))
     for index, (source, pid) in enumerate(records):
         if waiting_interval > 0:
             if last_download_time is not None:
@@ -47,11 +49,14 @@ def download():
         if err is not None:
             db.write_error_status(source, pid)
             failed_num += 1
+            progress.error(str(err), source=source, pid=pid)
         else:
             relations = {'pools': result['pools'], 'parent': result['parent'], 'children': result['children']}
             meta = {'source': result['source'], 'rating': result['rating'], 'md5': result['md5']}
             db.write_metadata(source, pid, result['tags'], relations, meta)
             success_num += 1
+        progress.advance()
+    progress.end()
 
     end_download_time = datetime.now()
     print()
@@ -1,44 +1,110 @@
-import json
-import yaml
+import os
+import sys
 from module.config import load_conf
 from module.database import Database
+from module.export_writer import ExportWriter, guess_format, open_output
 
+# 由SQLite JSON1函数直接拼装导出条目，与map_result_item的映射相同。
+# tags取自meta_tag索引和tag字典表。meta_tag不保存tag在记录中的位置，因此两种导出方式都按(type, name)排列tags；
+# pools和relations从relations列的JSON中展开
+__ITEM_JSON = '''json_object(
+    'source', 'sankaku',
+    'sourceId', CAST(meta.pid AS INTEGER),
+    'tags', (SELECT json_group_array(json_object('name', name, 'displayName', title, 'type', type))
+             FROM (SELECT tag.name, tag.title, tag.type FROM meta_tag JOIN tag ON tag.id = meta_tag.tag_id
+                   WHERE meta_tag.meta_id = meta.id ORDER BY tag.type, tag.name)),
+    'pools', (SELECT json_group_array(json_object('title', json_extract(value, '$.name'), 'key', CAST(json_extract(value, '$.id') AS TEXT)))
+              FROM json_each(meta.relations, '$.pools')),
+    'relations', (SELECT json_group_array(CAST(value AS INTEGER))
+                  FROM (SELECT value FROM json_each(meta.relations, '$.parent') UNION ALL SELECT value FROM json_each(meta.relations, '$.children')))
+)'''
 
-def export(archive: str or None, source: str or None, output: str or None):
+# 可以由SQL直接导出的来源类型
+__SQL_SOURCES = ["complex"]
+
+
+def export(archive: str or None, source: str or None, output: str or None, fmt: str or None, python_mapping: bool = False, delta: str or None = None):
+    """
+    导出元数据。记录从数据库中逐条读出并流式写入输出文件，内存占用与导出的记录数无关。
+    增量导出时，只导出自同名增量导出上次导出以来新增或变化的记录，以及此后被标记删除、或移出了导出条件(其他存档文件夹、未解析成功)的记录的墓碑({"deleted": true})。
+    导出完成后才会保存新的水位，因此中断的导出下次会完整重来。
+    :param archive: 仅导出此存档文件夹中的记录
+    :param source: 仅导出指定来源类型的记录
+    :param output: 输出文件。以.gz结尾时写入gzip压缩流。不指定时输出到标准输出
+    :param fmt: 导出格式yaml, json或jsonl。不指定时根据输出文件的扩展名推断
+    :param python_mapping: 在Python中逐条解码并映射记录，而不是由SQLite直接产出每个条目的JSON
+    :param delta: 增量导出的名称。每个名称分别记录自己的水位，对应一个下游系统
+    """
     conf = load_conf()
     db = Database(conf["work_path"]["db_path"])
 
-    if archive is None:
+    if archive is None and delta is None:
         print("\033[1;31m必须指定--archive参数来分割输出。\033[0m")
         exit(1)
 
-    result = db.query_list(folder=archive, source_in=[source] if source is not None else None, status_in=["analysed"])
-    mapped_result = {
-        "kind": "source",
-        "spec": [map_result_item(i) for i in result]
-    }
-
-    if output is None:
-        print(yaml.safe_dump(mapped_result))
-    elif output.endswith(".yaml") or output.endswith(".yml"):
-        with open(output, "w") as f:
-            yaml.safe_dump(mapped_result, f)
-    elif output.endswith(".json"):
-        with open(output, "w") as f:
-            json.dump(mapped_result, f)
-    else:
+    fmt = fmt or guess_format(output)
+    if fmt is None:
         print("\033[1;31m不受支持的输出文件类型。\033[0m")
         exit(1)
 
+    arguments = dict(folder=archive, source_in=[source] if source is not None else None, status_in=["analysed"], order=["id"])
+    if delta is not None:
+        # 上界取导出开始时的版本号，导出期间发生的修改留给下一次增量
+        version_range = (db.query_export_watermark(delta), db.query_row_version())
+        arguments["version_range"] = version_range
+    stream = open_output(output)
+    try:
+        with ExportWriter(stream, fmt, kind="source-delta" if delta is not None else "source") as writer:
+            if python_mapping:
+                for item in db.iter_list(**arguments):
+                    writer.write(map_result_item(item))
+            else:
+                for (item_source, item_json, _) in db.iter_values("meta.source, " + __ITEM_JSON, **arguments):
+                    if item_source not in __SQL_SOURCES:
+                        raise Exception("Unsupported source type %s." % (item_source,))
+                    writer.write_raw(item_json)
+            # 首次增量导出时下游还没有任何记录，不需要墓碑
+            if delta is not None and version_range[0] >= 0:
+                tombstones = db.iter_tombstones(version_range, folder=archive, source_in=arguments["source_in"], status_in=arguments["status_in"])
+                for (item_source, item_pid) in tombstones:
+                    # 不支持导出的来源类型从未被导出过，也就不需要墓碑
+                    if item_source in __SQL_SOURCES:
+                        writer.write(map_tombstone(item_source, item_pid))
+    except BaseException:
+        # 导出失败时移除不完整的输出文件，以免下游读到被截断的文档
+        if stream is not sys.stdout:
+            stream.close()
+            os.remove(output)
+        raise
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    if delta is not None:
+        db.write_export_watermark(delta, version_range[1])
+    if output is not None:
+        print("\033[1;32m# 已导出%s条记录。\033[0m" % (writer.count,))
+        if delta is not None:
+            print("# 增量导出%s的水位: %s -> %s" % (delta, max(version_range[0], 0), version_range[1]))
+
 
 def map_result_item(item):
-    if item["source"] == "complex":
+    if item.source == "complex":
         return {
             "source": "sankaku",
-            "sourceId": int(item["pid"]),
-            "tags": [{"name": i["name"], "displayName": i["title"], "type": i["type"]} for i in item["tags"]],
-            "pools": [{"title": i["name"], "key": str(i["id"])} for i in item["relations"]["pools"]],
-            "relations": [int(i) for i in (item["relations"]["parent"] + item["relations"]["children"])]
+            "sourceId": int(item.pid),
+            "tags": [{"name": i["name"], "displayName": i["title"], "type": i["type"]} for i in sorted(item.tags or [], key=lambda t: (t["type"], t["name"]))],
+            "pools": [{"title": i["name"], "key": str(i["id"])} for i in item.relations["pools"]],
+            "relations": [int(i) for i in (item.relations["parent"] + item.relations["children"])]
         }
     else:
-        raise Exception("Unsupported source type %s." % (item["source"],))
+        raise Exception("Unsupported source type %s." % (item.source,))
+
+
+def map_tombstone(source: str, pid: str):
+    """
+    已删除记录的墓碑条目。
+    """
+    if source == "complex":
+        return {"source": "sankaku", "sourceId": int(pid), "deleted": True}
+    else:
+        raise Exception("Unsupported source type %s." % (source,))
@@ -0,0 +1,119 @@
+from module.local import iter_work_files, iter_rename_files, iter_match_files, compile_rename_rules, compile_excludes, \
+    compile_save_rules, get_today_archive
+from module.database import Database
+from module.journal import get_journal, apply_plan, recover_pending_plan
+from module.pipeline import StageMeter, chunked
+from module.probe import probe_records
+from module.config import load_conf
+from module.progress import progress
+import os
+
+
+def ingest(work_dir, archive, split, chunk_size, dry_run):
+    """
+    以单次流式处理完成工作目录的重命名和保存。
+    流水线由多个生成器阶段串联：扫描 -> 重命名规则 -> 识别规则 -> 分批 -> 批量查重 -> 移动并入库 -> 探测文件信息。
+    扫描只进行一次，文件直接从原文件名移动至存档目录下重命名后的位置，每一批只做一次数据库查询和一次事务写入，
+    因此内存占用只与批次大小相关，而与工作目录中的文件总数无关。
+    未匹配、已存在以及存档目录中已有同名文件的项会保留在工作目录中，并在处理过程中逐条打印。
+
+    :param work_dir: 显式指定工作目录，而不是使用默认路径
+    :param archive: 显式指定存档文件夹。如果不指定，则根据今天的日期生成目录
+    :param split: 指定一个分割的存档。指定后，会使用类似yyyy-MM-dd.N的存档文件夹
+    :param chunk_size: 每一批处理的文件数
+    :param dry_run: 试运行，仅打印处理结果，但不实际移动文件和写入数据库
+    """
+    conf = load_conf()
+    work_dir = work_dir or conf["work_path"]["default_work_dir"]
+    archive_dir_name = archive or get_today_archive(conf["save"].get("archive_time_offset"), split)
+    archive_target_dir = os.path.join(conf["work_path"]["archive_dir"], archive_dir_name)
+
+    db = Database(conf["work_path"]["db_path"])
+    journal = get_journal(conf)
+    recover_pending_plan(db, journal, dry_run=dry_run)
+
+    print("# 归档目标文件夹: \033[1;34m%s\033[0m" % (archive_dir_name,))
+    print()
+
+    meter = StageMeter()
+    files = meter.stage("scan", iter_work_files(work_dir, conf.get("supported_extensions")))
+    files = meter.stage("rename", iter_rename_files(files, compile_rename_rules(conf["rename"]["rules"]), compile_excludes(conf["rename"].get("excludes", []))))
+    files = meter.stage("match", iter_match_files(files, compile_save_rules(conf["save"]["rules"])))
+    chunks = meter.stage("chunk", chunked(files, chunk_size), count=len)
+    chunks = meter.stage("check", __check_existence(db, archive_target_dir, chunks), count=lambda c: len(c[0]))
+    results = meter.stage("move", __apply(db, journal, work_dir, archive_dir_name, archive_target_dir, chunks, dry_run), count=lambda c: len(c[0]))
+    results = meter.stage("probe", __probe(db, conf["work_path"]["archive_dir"], results, dry_run), count=lambda c: c[0])
+
+    saved_num, unmatched_num, exist_num, conflict_num = 0, 0, 0, 0
+    # 文件是流式扫描的，总数事先未知，因此只报告完成数和速率
+    progress.start("ingest")
+    for (saved, unmatched, exists, conflicts) in results:
+        progress.advance(saved + len(unmatched) + len(exists) + len(conflicts))
+        saved_num += saved
+        unmatched_num += len(unmatched)
+        exist_num += len(exists)
+        conflict_num += len(conflicts)
+        for filename in unmatched:
+            print("* \033[1;31m%s\033[0m 未匹配" % (filename,))
+        for (filename, exist_archive, exist_filename) in exists:
+            print("* \033[1;33m%s\033[0m 已存在于 \033[1;33m%s/%s\033[0m" % (filename, exist_archive, exist_filename))
+        for (filename, target_filename) in conflicts:
+            print("* \033[1;33m%s\033[0m 与存档中的文件 \033[1;33m%s\033[0m 重名" % (filename, target_filename))
+    progress.end()
+
+    print()
+    print("# 阶段吞吐量:")
+    for (name, count, cost, rate) in meter.report():
+        print("  %-8s %10d 项 %10.3fs %12.1f 项/s" % (name, count, cost, rate))
+    print()
+    print("\033[1;32m# %s%s个文件。\033[0m 未匹配: %s, 已存在: %s, 重名: %s"
+          % ("可移动并归档" if dry_run else "已移动并归档", saved_num, unmatched_num, exist_num, conflict_num))
+
+
+def __check_existence(db: Database, archive_target_dir: str, chunks):
+    """
+    批量查重阶段。每一批只做一次数据库查询；同一批次内重复的(source, pid)以及存档目录中已有的同名文件也会被摘出。
+    前面批次的记录已经入库，因此跨批次的重复会由数据库查询发现。
+    :return: generator of (list, list[str], list[(str, str, str)], list[(str, str)]) 待保存项、未匹配项、已存在项和重名项
+    """
+    for chunk in chunks:
+        existing = db.query_basic_many([(source, pid) for (_, _, source, pid, _) in chunk if source is not None])
+        accepted, unmatched, exists, conflicts = [], [], [], []
+        seen_keys, seen_targets = dict(), set()
+        for (filename, target_filename, source, pid, metadata) in chunk:
+            if source is None:
+                unmatched.append(filename)
+            elif (source, pid) in existing:
+                exists.append((filename, *existing[(source, pid)]))
+            elif (source, pid) in seen_keys:
+                exists.append((filename, os.path.basename(archive_target_dir), seen_keys[(source, pid)]))
+            elif target_filename in seen_targets or os.path.exists(os.path.join(archive_target_dir, target_filename)):
+                conflicts.append((filename, target_filename))
+            else:
+                seen_keys[(source, pid)] = target_filename
+                seen_targets.add(target_filename)
+                accepted.append((filename, target_filename, source, pid, metadata))
+        yield accepted, unmatched, exists, conflicts
+
+
+def __apply(db: Database, journal, work_dir: str, archive_dir_name: str, archive_target_dir: str, chunks, dry_run: bool):
+    """
+    移动并入库阶段。每一批作为一个日志计划执行。
+    """
+    for (accepted, unmatched, exists, conflicts) in chunks:
+        records = [(source, pid, archive_dir_name, target_filename, metadata) for (_, target_filename, source, pid, metadata) in accepted]
+        if not dry_run:
+            apply_plan(db, journal,
+                       moves=[(os.path.join(work_dir, filename), os.path.join(archive_target_dir, target_filename)) for (filename, target_filename, _, _, _) in accepted],
+                       records=records)
+        yield records, unmatched, exists, conflicts
+
+
+def __probe(db: Database, archive_dir: str, chunks, dry_run: bool):
+    """
+    文件探测阶段。读取已入库文件的头部，写入格式、尺寸和文件大小。
+    """
+    for (records, unmatched, exists, conflicts) in chunks:
+        if not dry_run:
+            db.write_probes(probe_records(archive_dir, [(source, pid, folder, filename) for (source, pid, folder, filename, _) in records]))
+        yield len(records), unmatched, exists, conflicts
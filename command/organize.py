@@ -1,13 +1,16 @@
-import re
-
-from module.local import scan_move_files, do_delete_files, scan_folders, scan_not_existing_files, get_source_info, \
-    get_name_and_extension
+from module.local import scan_move_files, scan_folders, scan_not_existing_files, get_source_info, \
+    get_name_and_extension, compile_save_rules
 from module.database import Database, insert_records
+from module.journal import get_journal, apply_plan, recover_pending_plan
+from module.plan import Plan
 from module.config import load_conf
+from module.probe import probe_records
+from module.progress import progress
 import os
+import time
 
 
-def organize(deduplicate, unsaved, mark_deleted, analyse_metadata, dry_run):
+def organize(deduplicate, unsaved, mark_deleted, analyse_metadata, near_duplicates, distance, probe, rebuild_index, compact_tags, dry_run, plan_out=None):
     """
     进行文件存储和数据库整理。
     :param deduplicate: 移除文件库中的重复文件，以最后一次存档为准
@@ -15,27 +18,51 @@ def organize(deduplicate, unsaved, mark_deleted, analyse_metadata, dry_run):
     :param mark_deleted: 搜索并在数据库中标记已被删除的文件
     :param dry_run: 试运行，生成并打印执行计划，但不实际执行计划
     :param analyse_metadata: 查找空元数据的项，并重新生成元数据
+    :param near_duplicates: 计算文件库中图像的感知哈希，并查找视觉上近似的重复图像
+    :param distance: 判定为近似图像的最大汉明距离
+    :param probe: 查找尚未探测文件信息的记录，读取文件头部补充格式、尺寸和文件大小
+    :param rebuild_index: 全量重建tag统计表、tag索引、全文索引等由数据库增量维护的派生表
+    :param compact_tags: 将以JSON存储的tags迁移为引用tag字典的紧凑格式，并整理数据库文件
+    :param plan_out: 将unsaved、deduplicate和mark_deleted的计划连同文件指纹写入此文件，留待imm apply执行。指定时不实际执行任何整理项
     """
     conf = load_conf()
+    dry_run = dry_run or plan_out is not None
     db = Database(conf["work_path"]["db_path"])
+    plan = Plan("organize", conf["work_path"]["db_path"], db.query_row_version()) if plan_out is not None else None
+    journal = get_journal(conf)
+    recover_pending_plan(db, journal, dry_run=dry_run)
 
     print("# 文件整理")
-    if not unsaved and not deduplicate and not mark_deleted and not analyse_metadata:
+    if not unsaved and not deduplicate and not mark_deleted and not analyse_metadata and not near_duplicates and not probe and not rebuild_index and not compact_tags:
         print("# \033[1;31m未指定任何整理项。\033[0m")
 
     if unsaved:
-        __unsaved(conf, db, dry_run)
+        __unsaved(conf, db, dry_run, plan)
     if deduplicate:
-        __deduplicate(conf, db, dry_run)
+        __deduplicate(conf, db, journal, dry_run, plan)
     if mark_deleted:
-        __mark_deleted(conf, db, dry_run)
+        __mark_deleted(conf, db, dry_run, plan)
     if analyse_metadata:
         __analyse_metadata(conf, db, dry_run)
+    if near_duplicates:
+        __near_duplicates(conf, db, distance)
+    if probe:
+        __probe(conf, db, dry_run)
+    if rebuild_index:
+        __rebuild_index(db, dry_run)
+    if compact_tags:
+        __compact_tags(db, dry_run)
+
+    if plan is not None:
+        plan.save(plan_out)
+        print()
+        print("# 计划已写入\033[1;34m%s\033[0m，可以使用 imm apply %s 执行" % (plan_out, plan_out))
 
 
-def __unsaved(conf, db: Database, dry_run: bool):
+def __unsaved(conf, db: Database, dry_run: bool, plan: Plan or None):
     unsaved_files = []
     all_folders = scan_folders(conf["work_path"]["archive_dir"])
+    progress.start("unsaved", len(all_folders))
     for folder in all_folders:
         matched_files, unmatched_files = scan_move_files(
             work_dir=os.path.join(conf["work_path"]["archive_dir"], folder),
@@ -43,25 +70,29 @@ def __unsaved(conf, db: Database, dry_run: bool):
             extensions=conf.get("supported_extensions")
         )
 
-        for filename, source, pid, _ in matched_files:
+        for filename, source, pid, metadata in matched_files:
             r = db.query_basic(source, pid)
             if r is None:
                 # 遭遇未保存的意外文件
-                unsaved_files.append((folder, filename, source, pid))
+                unsaved_files.append((folder, filename, source, pid, metadata))
+        progress.advance()
+    progress.end()
 
     print()
     if len(unsaved_files) > 0:
         print("# === 发现未保存项 %s项 ===" % (len(unsaved_files),))
-        for folder, filename, _, _ in unsaved_files:
+        for folder, filename, _, _, _ in unsaved_files:
             print("* \033[1;33m%-12s / %-30s\033[0m" % (folder, filename))
 
+        if plan is not None:
+            plan.add_records([(source, pid, folder, filename, metadata) for (folder, filename, source, pid, metadata) in unsaved_files], conf["work_path"]["archive_dir"])
         if not dry_run:
             grouped_files = dict()
-            for folder, filename, source, pid in unsaved_files:
+            for folder, filename, source, pid, metadata in unsaved_files:
                 if folder in grouped_files:
-                    grouped_files[folder].append((filename, source, pid))
+                    grouped_files[folder].append((filename, source, pid, metadata))
                 else:
-                    grouped_files[folder] = [(filename, source, pid)]
+                    grouped_files[folder] = [(filename, source, pid, metadata)]
             for folder, files in grouped_files.items():
                 insert_records(db, folder, files)
             print()
@@ -70,13 +101,14 @@ def __unsaved(conf, db: Database, dry_run: bool):
         print("# === 未发现未保存项 ===")
 
 
-def __deduplicate(conf, db: Database, dry_run: bool):
+def __deduplicate(conf, db: Database, journal, dry_run: bool, plan: Plan or None):
     db_query_cache = dict()
     duplicated_files = []
     need_update_records = []
 
     all_folders = scan_folders(conf["work_path"]["archive_dir"])
     all_folders.sort(reverse=True)
+    progress.start("deduplicate", len(all_folders))
     for folder in all_folders:
         # 扫描所有的folders，然后按照倒序，依次扫描每个folders下的项。
         # 这个扫描顺序能保证最小代价缓存，当db结果更大时，可以直接判定为重复项。
@@ -102,6 +134,8 @@ def __deduplicate(conf, db: Database, dry_run: bool):
                 # 已经建立缓存，表示从现在开始，查询到的每一个项都是重复项了
                 db_folder, db_filename = r
                 duplicated_files.append((folder, filename, db_folder, db_filename))
+        progress.advance()
+    progress.end()
 
     print()
     if len(duplicated_files) > 0:
@@ -116,34 +150,33 @@ def __deduplicate(conf, db: Database, dry_run: bool):
         for folder, filename, db_folder, db_filename, source, pid in need_update_records:
             print("* \033[1;33m%8s | %-12s |\033[0m FROM %-12s / %-30s TO %-12s / %-30s" % (source, pid, db_folder, db_filename, folder, filename))
 
+    records = [(source, pid, folder, filename, None) for folder, filename, _, _, source, pid in need_update_records]
+    deletes = [os.path.join(conf["work_path"]["archive_dir"], folder, filename) for folder, filename, _, _ in duplicated_files]
+    if plan is not None:
+        plan.add_records(records, conf["work_path"]["archive_dir"])
+        plan.add_deletes(deletes)
     if not dry_run:
         print()
+        apply_plan(db, journal, records=records, deletes=deletes)
         if len(duplicated_files) > 0:
-            do_delete_files(conf["work_path"]["archive_dir"], [(folder, filename) for folder, filename, _, _ in duplicated_files])
             print("\033[1;32m# 已清理%s个重复文件。\033[0m" % (len(duplicated_files, )))
         if len(need_update_records) > 0:
-            grouped_files = dict()
-            for folder, filename, _, _, source, pid in need_update_records:
-                if folder in grouped_files:
-                    grouped_files[folder].append((filename, source, pid))
-                else:
-                    grouped_files[folder] = [(filename, source, pid)]
-            for folder, files in grouped_files.items():
-                insert_records(db, folder, files)
             print("\033[1;32m# 已更新%s条过时记录。\033[0m" % (len(need_update_records, )))
 
 
-def __mark_deleted(conf, db: Database, dry_run):
+def __mark_deleted(conf, db: Database, dry_run, plan: Plan or None):
     deleted_records = []
     deleted_record_count = 0
 
-    db_folders = db.query_folders()
-    for db_folder in db_folders:
-        db_filenames = db.query_folder_filenames(db_folder)
+    # 文件夹在按索引顺序扫描的同时逐个列出，事先没有准确的总数，因此不给出total
+    progress.start("mark-deleted")
+    for (db_folder, db_filenames) in db.iter_folder_filenames():
         not_existing_files = scan_not_existing_files(os.path.join(conf["work_path"]["archive_dir"], db_folder), db_filenames)
         if len(not_existing_files) > 0:
             deleted_records.append((db_folder, not_existing_files))
             deleted_record_count += len(not_existing_files)
+        progress.advance()
+    progress.end()
 
     print()
     if deleted_record_count > 0:
@@ -152,10 +185,10 @@ def __mark_deleted(conf, db: Database, dry_run):
             for file in files:
                 print("* \033[1;33m%8s / %s\033[0m" % (folder, file))
 
+        if plan is not None:
+            plan.add_marks([(folder, file) for (folder, files) in deleted_records for file in files], conf["work_path"]["archive_dir"])
         if not dry_run:
-            for (folder, files) in deleted_records:
-                for file in files:
-                    db.mark_deleted(folder, file)
+            db.mark_deleted_many([(folder, file) for (folder, files) in deleted_records for file in files])
             print()
             print("\033[1;32m# 已标记%s条已删除记录。\033[0m" % (deleted_record_count, ))
 
@@ -164,20 +197,20 @@ def __mark_deleted(conf, db: Database, dry_run):
 
 
 def __analyse_metadata(conf, db: Database, dry_run: bool):
-    rules = [{"filename": re.compile(rule["filename"]), "source": rule["source"], "group": rule.get("group"), "metadata": rule.get("metadata")} for rule in conf["save"]["rules"] if "metadata" in rule]
+    rules = compile_save_rules([rule for rule in conf["save"]["rules"] if "metadata" in rule])
     rule_source_types = [rule["source"] for rule in rules]
 
     matched_records = []
 
     ret = db.query_list(source_in=rule_source_types)
     for item in ret:
-        if item["meta"] is None:
-            name, _ = get_name_and_extension(item["filename"])
+        if item.meta is None:
+            name, _ = get_name_and_extension(item.filename)
             r = get_source_info(name, rules)
             if r is not None:
                 _, _, metadata = r
                 if len(metadata) > 0:
-                    matched_records.append((item["source"], item["pid"], metadata))
+                    matched_records.append((item.source, item.pid, metadata))
 
     print()
     if len(matched_records) > 0:
@@ -193,4 +226,121 @@ def __analyse_metadata(conf, db: Database, dry_run: bool):
             print("\033[1;32m# 已重新分析%s条记录。\033[0m" % (len(matched_records),))
 
     else:
-        print("# === 未发现需要重新分析的记录 ===")
\ No newline at end of file
+        print("# === 未发现需要重新分析的记录 ===")
+
+
+def __near_duplicates(conf, db: Database, distance: int):
+    # 感知哈希依赖numpy和Pillow，只在需要时导入
+    from module.phash import scan_hash_files, compute_hashes, find_near_duplicates, to_signed, to_unsigned
+    archive_dir = conf["work_path"]["archive_dir"]
+    cached = dict(((folder, filename), (size, mtime)) for (folder, filename, size, mtime, _, _) in db.query_image_hashes())
+    changed, expired = scan_hash_files(archive_dir, scan_folders(archive_dir), conf.get("supported_extensions"), cached)
+
+    print()
+    if len(changed) > 0:
+        print("# 计算%s个新增或已变化文件的感知哈希" % (len(changed),))
+        batch, failed_num = [], 0
+        progress.start("hash", len(changed))
+        for (folder, filename, size, mtime, h) in compute_hashes(changed):
+            if h is None:
+                failed_num += 1
+                batch.append((folder, filename, size, mtime, None, None))
+                progress.error("cannot decode image", folder=folder, filename=filename)
+            else:
+                batch.append((folder, filename, size, mtime, to_signed(h[0]), to_signed(h[1])))
+            if len(batch) >= 1000:
+                db.write_image_hashes(batch)
+                batch = []
+            progress.advance()
+        db.write_image_hashes(batch)
+        progress.end()
+        if failed_num > 0:
+            print("# \033[1;33m%s个文件无法解码，已跳过\033[0m" % (failed_num,))
+    if len(expired) > 0:
+        db.delete_image_hashes(expired)
+
+    hashes = [((folder, filename), to_unsigned(dhash), to_unsigned(phash)) for (folder, filename, _, _, dhash, phash) in db.query_image_hashes() if phash is not None]
+    pairs = find_near_duplicates(hashes, distance)
+
+    if len(pairs) > 0:
+        print("# === 发现近似图像 %s对 ===" % (len(pairs),))
+        for (folder_a, filename_a), (folder_b, filename_b), phash_distance, dhash_distance in pairs:
+            print("* \033[1;33m%-12s / %-30s\033[0m ~ \033[1;33m%-12s / %-30s\033[0m (pHash %d, dHash %d)"
+                  % (folder_a, filename_a, folder_b, filename_b, phash_distance, dhash_distance))
+    else:
+        print("# === 未发现近似图像 ===")
+
+
+def __probe(conf, db: Database, dry_run: bool):
+    records = db.query_unprobed()
+
+    print()
+    if len(records) > 0:
+        print("# === 发现尚未探测文件信息的记录 %s条 ===" % (len(records),))
+        if not dry_run:
+            probed_num = 0
+            progress.start("probe", len(records))
+            for i in range(0, len(records), 1000):
+                batch = records[i:i + 1000]
+                probes = probe_records(conf["work_path"]["archive_dir"], batch)
+                db.write_probes(probes)
+                probed_num += len(probes)
+                progress.advance(len(batch))
+            progress.end()
+            print()
+            print("\033[1;32m# 已探测%s条记录的文件信息，%s个文件已不存在。\033[0m" % (probed_num, len(records) - probed_num))
+    else:
+        print("# === 未发现尚未探测文件信息的记录 ===")
+
+
+def __rebuild_index(db: Database, dry_run: bool):
+    print()
+    if not dry_run:
+        rows = db.rebuild_tag_stats()
+        print("\033[1;32m# 已根据%s条记录重建tag统计表。\033[0m" % (rows,))
+        rows = db.rebuild_tag_index()
+        print("\033[1;32m# 已根据%s条记录重建tag索引。\033[0m" % (rows,))
+        rows = db.rebuild_fts()
+        print("\033[1;32m# 已根据%s条记录重建全文索引。\033[0m" % (rows,))
+        rows = db.rebuild_relations()
+        print("\033[1;32m# 已根据%s条记录重建关系索引。\033[0m" % (rows,))
+    else:
+        print("# === 将全量重建tag统计表、tag索引、全文索引和关系索引 ===")
+
+
+def __compact_tags(db: Database, dry_run: bool):
+    total = db.count_json_tags()
+    print()
+    if total <= 0:
+        print("# === 未发现以JSON存储tags的记录 ===")
+        return
+    print("# === 发现以JSON存储tags的记录 %s条 ===" % (total,))
+    if dry_run:
+        return
+
+    size_before = db.query_size()
+    rows, scan_before = __scan_tags(db)
+    db.migrate_compact_tags(callback=lambda migrated: print("\r# 已迁移 %s/%s" % (migrated, total), end=""))
+    print()
+    db.vacuum()
+    size_after = db.query_size()
+    _, scan_after = __scan_tags(db)
+
+    print("\033[1;32m# 已迁移%s条记录。\033[0m" % (total,))
+    print("  %-12s %12s %12s" % ("", "迁移前", "迁移后"))
+    print("  %-12s %10.1fMB %10.1fMB" % ("数据库大小", size_before / 1048576, size_after / 1048576))
+    print("  %-12s %11.3fs %11.3fs" % ("全量扫描(%s条)" % (rows,), scan_before, scan_after))
+
+
+def __scan_tags(db: Database):
+    """
+    只读地解码全部记录的tags，用于比较迁移前后的扫描耗时。
+    不使用统计扫描: 它在读取JSON格式的记录时会把tag写入字典表，迁移前后比较的就不是同一种操作。
+    :return: (int, float) 记录数和耗时秒数
+    """
+    start = time.perf_counter()
+    rows = 0
+    for record in db.iter_list():
+        record.tags
+        rows += 1
+    return rows, time.perf_counter() - start
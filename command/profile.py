@@ -0,0 +1,27 @@
+from module.profiler import timer
+import sys
+
+
+def start_profiling(profile_path: str or None):
+    """
+    开始为命令计时。指定profile_path时同时启用cProfile。
+    :param profile_path: pstats结果的写入路径
+    :return: 命令结束时调用的函数，它停止计时并打印各阶段的耗时
+    """
+    profiler = None
+    if profile_path is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+    timer.start()
+    if profiler is not None:
+        profiler.enable()
+
+    def finish():
+        if profiler is not None:
+            profiler.disable()
+        total = timer.stop()
+        timer.report(total)
+        if profiler is not None:
+            profiler.dump_stats(profile_path)
+            print("# 剖析结果已写入%s，可以使用 python -m pstats %s 查看" % (profile_path, profile_path), file=sys.stderr)
+    return finish
@@ -0,0 +1,15 @@
+from module.progress import progress
+
+
+def start_progress(fd: int or None):
+    """
+    开始输出JSON Lines格式的进度事件。
+    :param fd: 输出事件的文件描述符。不指定时输出到标准错误
+    :return: 命令结束时调用的函数，它结束未完成的阶段并关闭输出
+    """
+    progress.open(fd)
+
+    def finish():
+        progress.end()
+        progress.close()
+    return finish
@@ -0,0 +1,192 @@
+from module.database import Database
+from module.query import QuerySyntaxError
+from module.config import load_conf
+import subprocess
+import platform
+import os
+
+
+def query_one(source: str, pid: str, print_all: bool, show: bool, open_file: bool):
+    """
+    查询一条指定的图像元数据。
+    :param print_all: 展示全部tag和元数据，而非仅简要数据
+    :param show: 同时在文件管理器展示此文件
+    :param open_file: 同时打开此文件
+    """
+    conf = load_conf()
+    db = Database(conf["work_path"]["db_path"])
+    item = db.query_one(source, pid)
+    if item is None:
+        print("\033[1;31m%s - %s not found\033[0m" % (source, pid))
+        return
+    print("\033[1;34m-- %s - %s (%s) --\033[0m" % (source, pid, item.status))
+    print("%s / %s" % (item.folder, item.filename))
+    if item.tags is not None:
+        __print_tags(item.tags, print_all)
+    if item.relations is not None:
+        __print_relations(item.relations)
+    if print_all and item.meta is not None:
+        print("\033[1;36m-- meta:\033[0m")
+        for (k, v) in item.meta.items():
+            print("   %s: %s" % (k, v))
+
+    if show or open_file:
+        path = os.path.join(conf["work_path"]["archive_dir"], item.folder, item.filename)
+        __open_path(path, reveal=show and not open_file)
+
+
+def query_list(expression: str or None, source: str or None, create_from: str or None, limit: int, order: list[str], after: str or None, explain: bool):
+    """
+    按tag查询表达式查询记录列表。以键集分页，翻页不需要跳过前面的记录。
+    :param expression: tag查询表达式，参见compile_expression
+    :param source: 过滤指定的数据源类型
+    :param create_from: 过滤某个时间点之后的数据
+    :param limit: 每页数量
+    :param order: 排序列列表，默认按id降序
+    :param after: 上一页给出的续页token
+    :param explain: 打印编译后的SQL和查询计划，而不执行查询
+    """
+    conf = load_conf()
+    db = Database(conf["work_path"]["db_path"])
+    arguments = dict(source_in=[source] if source is not None else None, create_from=create_from,
+                     order=order, limit=limit, expression=expression or "", after=after)
+    try:
+        if explain:
+            sql, plan = db.explain_list(**arguments)
+            print("\033[1;34m-- sql --\033[0m")
+            print(sql)
+            print("\033[1;34m-- query plan --\033[0m")
+            for line in plan:
+                print(line)
+            return
+        items, token = db.query_page(**arguments)
+    except QuerySyntaxError as e:
+        print("\033[1;31m# 查询表达式错误: %s\033[0m" % (e,))
+        return
+
+    for item in items:
+        print("\033[1;33m| %8s | %-12s |\033[0m %-12s/ %-30s | %-12s |" %
+              (item.source, item.pid, item.folder, item.filename, item.status), end="")
+        __print_contains(item.tags or [], item.relations or {})
+    print("\033[1;34m-- %s item(s) --\033[0m" % (len(items),))
+    if token is not None:
+        print("# 下一页: --after %s" % (token,))
+
+
+def query_search(text: str, column: str or None, limit: int):
+    """
+    在tag名称、tag标题和pool名称中全文检索，并打印命中的片段。
+    :param text: 检索文本
+    :param column: 仅检索指定的列
+    :param limit: 最多列出的数量
+    """
+    conf = load_conf()
+    db = Database(conf["work_path"]["db_path"])
+    try:
+        items = db.search_text(text, column, limit)
+    except QuerySyntaxError as e:
+        print("\033[1;31m# 检索文本错误: %s\033[0m" % (e,))
+        return
+    for (source, pid, folder, filename, snippet) in items:
+        print("\033[1;33m| %8s | %-12s |\033[0m %-12s/ %-30s | %s" % (source, pid, folder, filename, snippet.replace("\n", " ")))
+    print("\033[1;34m-- %s item(s) --\033[0m" % (len(items),))
+
+
+def query_tags(prefix: str, tag_type: str or None, source: str or None, limit: int):
+    """
+    按前缀补全tag名称。直接读取增量维护的tag统计表，不扫描记录。
+    :param prefix: tag名称前缀
+    :param tag_type: 仅补全指定tag type
+    :param source: 仅统计指定来源类型的记录
+    :param limit: 最多列出的数量
+    """
+    conf = load_conf()
+    db = Database(conf["work_path"]["db_path"])
+    for (tp, name, count, title) in db.complete_tags(prefix, tag_type, source, limit):
+        print("%-12s %-50s: %4d : %s" % (tp, name, count, title or ""))
+
+
+def query_family(source: str, pid: str):
+    """
+    查询一条记录经parent/child关系相连的全部记录。
+    """
+    conf = load_conf()
+    db = Database(conf["work_path"]["db_path"])
+    members = db.query_family(source, pid)
+    if len(members) <= 1 and members[0][1] is None:
+        print("\033[1;31m%s - %s not found\033[0m" % (source, pid))
+        return
+    missing = 0
+    for (member_pid, folder, filename, deleted) in members:
+        if folder is None and filename is None:
+            missing += 1
+            print("\033[1;31m| %8s | %-12s |\033[0m %s" % (source, member_pid, "missing"))
+        else:
+            print("\033[1;33m| %8s | %-12s |\033[0m %-12s/ %-30s%s" % (source, member_pid, folder, filename, " (deleted)" if deleted else ""))
+    print("\033[1;34m-- %s member(s), %s missing --\033[0m" % (len(members), missing))
+
+
+def query_pool(source: str, pool: str):
+    """
+    查询pool在本地的成员。
+    :param pool: pool id或名称
+    """
+    conf = load_conf()
+    db = Database(conf["work_path"]["db_path"])
+    pools = db.query_pools(source, pool)
+    if len(pools) == 0:
+        print("\033[1;31m%s - pool %s not found\033[0m" % (source, pool))
+        return
+    for (pool_id, name, name_ja) in pools:
+        members = db.query_pool_members(source, pool_id)
+        deleted = sum(1 for member in members if member[3])
+        print("\033[1;34m-- pool %s: %s%s --\033[0m" % (pool_id, name, " / " + name_ja if name_ja else ""))
+        for (member_pid, folder, filename, is_deleted) in members:
+            print("\033[1;33m| %8s | %-12s |\033[0m %-12s/ %-30s%s" % (source, member_pid, folder, filename, " (deleted)" if is_deleted else ""))
+        print("\033[1;34m-- %s local member(s), %s deleted --\033[0m" % (len(members), deleted))
+
+
+def __open_path(path: str, reveal: bool):
+    system = platform.system()
+    if system == "Darwin":
+        subprocess.run(["open", "-R", path] if reveal else ["open", path])
+    elif system == "Windows":
+        subprocess.run(["explorer", "/select,", path] if reveal else ["explorer", path])
+    else:
+        subprocess.run(["xdg-open", os.path.dirname(path) if reveal else path])
+
+
+def __print_tags(tags, print_all):
+    print("\033[1;36m-- tags:\033[0m")
+    types = dict()
+    for tag in tags:
+        types.setdefault(tag["type"], []).append(tag)
+    for t, a in types.items():
+        print("\033[1;32m - %s:\033[0m" % (t,))
+        for tag in (a if print_all else a[:8]):
+            print("   %s %s" % (tag["name"], "[" + tag["title"] + "]" if tag.get("title") else ""))
+        if not print_all and len(a) > 8:
+            print("   ...")
+
+
+def __print_relations(relations):
+    print("\033[1;36m-- relations:\033[0m")
+    if relations.get("pools"):
+        print("\033[1;32m - pools:\033[0m")
+        for pool in relations["pools"]:
+            print("   %s" % (pool,))
+    if relations.get("parent"):
+        print("\033[1;32m - parent: \033[0m%s" % (", ".join(relations["parent"]),))
+    if relations.get("children"):
+        print("\033[1;32m - children:\033[0m")
+        for child in relations["children"]:
+            print("   %s" % (child,))
+
+
+def __print_contains(tags, relations):
+    types = dict()
+    for tag in tags:
+        types[tag["type"]] = types.get(tag["type"], 0) + 1
+    print("\033[1;32m tags[%s], pools(%d), parent(%d), children(%d)\033[0m" %
+          (", ".join("%s(%d)" % (tag, count) for tag, count in types.items()),
+           len(relations.get("pools", [])), len(relations.get("parent", [])), len(relations.get("children", []))))
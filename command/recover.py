@@ -0,0 +1,16 @@
+from module.database import Database
+from module.journal import get_journal, recover_pending_plan
+from module.config import load_conf
+
+
+def recover(rollback):
+    """
+    恢复上次中断的文件操作计划。默认重放计划，使文件和数据库达到计划完成后的状态。
+    指定rollback时，若计划尚未提交数据库，则将已移动的文件移回原位并放弃计划；已提交的计划只能重放。
+
+    :param rollback: 回滚而不是重放未完成的计划
+    """
+    conf = load_conf()
+    db = Database(conf["work_path"]["db_path"])
+    if not recover_pending_plan(db, get_journal(conf), rollback):
+        print("# 未发现未完成的操作计划")
@@ -1,8 +1,12 @@
-from module.local import scan_rename_files, do_rename_files
+from module.local import scan_rename_files
+from module.database import Database
+from module.journal import get_journal, apply_plan, recover_pending_plan
+from module.plan import Plan
 from module.config import load_conf
+import os
 
 
-def rename(work_dir, dry_run, verbose):
+def rename(work_dir, dry_run, verbose, plan_out=None):
     """
     整理重命名工作目录下的文件。整理依据配置文件中的几项规则。
     扫描文件仅在工作目录下进行，并且仅扫描supported_extensions中指定的扩展名。如果没有指定此配置，那么会扫描所有文件。
@@ -13,9 +17,15 @@ def rename(work_dir, dry_run, verbose):
     :param work_dir: 显示指定工作目录，而不是使用默认路径。如果没有配置默认工作目录，则使用当前目录
     :param dry_run: 试运行，生成并打印执行计划，但不实际执行计划
     :param verbose: 打印详细信息。这将打印详细的rename计划。需要注意的是，其它异常计划总是会打印
+    :param plan_out: 将计划连同文件指纹写入此文件，留待imm apply执行。指定时不实际执行计划
     """
     conf = load_conf()
+    dry_run = dry_run or plan_out is not None
     work_dir = work_dir or conf.get("work_path", {})["default_work_dir"]
+    journal = get_journal(conf)
+    # 上次中断的可能是带有数据库记录的save等计划，重放它需要数据库
+    db = Database(conf["work_path"]["db_path"]) if journal.exists() else None
+    recover_pending_plan(db, journal, dry_run=dry_run)
 
     result = scan_rename_files(
         work_dir=work_dir,
@@ -66,8 +76,13 @@ def rename(work_dir, dry_run, verbose):
 
     print()
 
-    if not dry_run and len(result["renames"]) > 0:
-        do_rename_files(work_dir, result["renames"])
+    if plan_out is not None:
+        plan = Plan("rename", conf["work_path"]["db_path"])
+        plan.add_moves([(os.path.join(work_dir, old), os.path.join(work_dir, new)) for (old, new) in result["renames"]])
+        plan.save(plan_out)
+        print("# 计划已写入\033[1;34m%s\033[0m，可以使用 imm apply %s 执行" % (plan_out, plan_out))
+    elif not dry_run and len(result["renames"]) > 0:
+        apply_plan(None, journal, moves=[(os.path.join(work_dir, old), os.path.join(work_dir, new)) for (old, new) in result["renames"]])
         print("\033[1;32m# 已重命名%s个文件。\033[0m" % (result["rename_count"]))
 
     if len(unmatched) > 0 or len(duplicated) > 0:
@@ -1,10 +1,14 @@
-from module.local import scan_move_files, do_move_files, do_delete_files, get_today_archive
-from module.database import Database, scan_record_existence, insert_records
+from module.local import scan_move_files, get_today_archive
+from module.database import Database, scan_record_existence
+from module.journal import get_journal, apply_plan, recover_pending_plan
+from module.plan import Plan
+from module.probe import probe_records
 from module.config import load_conf
+from module.progress import progress
 import os
 
 
-def save(work_dir, archive, split, replace, no_meta, dry_run):
+def save(work_dir, archive, split, replace, no_meta, dry_run, plan_out=None):
     """
     将工作目录下的文件移动到存档目录的指定位置，同时根据分析规则，将文件的来源信息保存到数据库。
     扫描文件仅在工作目录下进行，并且仅扫描supported_extensions中指定的扩展名。如果没有指定此配置，那么会扫描所有文件。
@@ -12,6 +16,8 @@ def save(work_dir, archive, split, replace, no_meta, dry_run):
     移入的归档目录会根据今天的日期生成，并位于archive_dir目录下，默认格式yyyy-MM-dd。使用offset配置项可以偏移日期计算，使用split选项可以增加分割点。
     如果不能完成任何匹配，默认是不接受移入无元数据的项的，会拒绝移入。使用no-meta选项，指示强制存储无元数据的文件，这将仅移入而不存储其元数据。
     如果文件在数据库中已存在其他相同来源项，默认也不接受重复文件存入，同样拒绝移入。使用replace选项，指示强制替代旧的文件，这也将自动移除旧文件。
+    移动、入库和删除作为一个计划先写入日志再执行，中途崩溃的计划会在下次运行时被重放。
+    入库之后，会读取文件头部探测图像/视频的格式、尺寸和文件大小，并写入数据库。
 
     :param work_dir: 显式指定工作目录，而不是使用默认路径。如果没有配置默认工作目录，则使用当前目录
     :param split: 指定一个分割的存档。指定后，会使用类似yyyy-MM-dd.N的存档文件夹。这可以帮助分割存放
@@ -19,20 +25,26 @@ def save(work_dir, archive, split, replace, no_meta, dry_run):
     :param no_meta: 指示在无元数据时，仅移入而不存储元数据
     :param replace: 指示在重复文件时，选择替代旧文件存入，并替代旧文件
     :param dry_run: 试运行，生成并打印执行计划，但不实际执行计划
+    :param plan_out: 将计划连同文件指纹写入此文件，留待imm apply执行。指定时不实际执行计划
     """
     conf = load_conf()
+    dry_run = dry_run or plan_out is not None
     work_dir = work_dir or conf["work_path"]["default_work_dir"]
     archive_dir_name = archive or get_today_archive(conf["save"].get("archive_time_offset"), split)
     archive_target_dir = os.path.join(conf["work_path"]["archive_dir"], archive_dir_name)
 
+    db = Database(conf["work_path"]["db_path"])
+    journal = get_journal(conf)
+    recover_pending_plan(db, journal, dry_run=dry_run)
+    # 计划依据此刻的数据库内容生成，执行时数据库必须没有变化
+    row_version = db.query_row_version() if plan_out is not None else None
+
     matched_files, unmatched_files = scan_move_files(
         work_dir=work_dir,
         rules=conf["save"]["rules"],
         extensions=conf.get("supported_extensions"),
     )
 
-    db = Database(conf["work_path"]["db_path"])
-
     move_files, exist_files = scan_record_existence(db, matched_files)
 
     print("# 扫描总数: %s, 移动并归档: %s, 未匹配: %s, 已存在: %s" % (len(matched_files) + len(unmatched_files), len(move_files), len(unmatched_files), len(exist_files)))
@@ -53,21 +65,36 @@ def save(work_dir, archive, split, replace, no_meta, dry_run):
 
     print()
 
-    if not dry_run:
+    if plan_out is not None or not dry_run:
+        moves, records, deletes = [], [], []
+        if len(move_files) > 0:
+            moves += [(os.path.join(work_dir, filename), os.path.join(archive_target_dir, filename)) for (filename, _, _, _) in move_files]
+            records += [(source, pid, archive_dir_name, filename, metadata) for (filename, source, pid, metadata) in move_files]
+        if len(unmatched_files) > 0 and no_meta:
+            moves += [(os.path.join(work_dir, filename), os.path.join(archive_target_dir, filename)) for filename in unmatched_files]
+        if len(exist_files) > 0 and replace:
+            deletes += [os.path.join(conf["work_path"]["archive_dir"], folder, filename) for (_, _, _, _, folder, filename) in exist_files]
+            moves += [(os.path.join(work_dir, filename), os.path.join(archive_target_dir, filename)) for (filename, _, _, _, _, _) in exist_files]
+            records += [(source, pid, archive_dir_name, filename, metadata) for (filename, source, pid, metadata, _, _) in exist_files]
+        if plan_out is not None:
+            plan = Plan("save", conf["work_path"]["db_path"], row_version)
+            plan.add_moves(moves)
+            plan.add_deletes(deletes)
+            plan.add_records(records, conf["work_path"]["archive_dir"])
+            plan.save(plan_out)
+            print("# 计划已写入\033[1;34m%s\033[0m，可以使用 imm apply %s 执行" % (plan_out, plan_out))
+            return
+        with progress.phase("save", len(moves)):
+            apply_plan(db, journal, moves, records, deletes)
+            db.write_probes(probe_records(conf["work_path"]["archive_dir"], [(source, pid, folder, filename) for (source, pid, folder, filename, _) in records]))
+            progress.advance(len(moves))
+
         if len(move_files) > 0:
-            insert_records(db, archive_dir_name, move_files)
-            do_move_files(work_dir, archive_target_dir, [filename for (filename, _, _, _) in move_files])
             print("\033[1;32m# 已移动并归档%s个文件。\033[0m" % (len(move_files,)))
         if len(unmatched_files) > 0 and no_meta:
-            do_move_files(work_dir, archive_target_dir, unmatched_files)
             print("\033[1;32m# 由于已指定允许无元数据归档，已移动%s个未匹配的文件。\033[0m" % (len(unmatched_files,)))
-            pass
         if len(exist_files) > 0 and replace:
-            do_delete_files(conf["work_path"]["archive_dir"], [(folder, filename) for (_, _, _, _, folder, filename) in exist_files])
-            do_move_files(work_dir, archive_target_dir, [filename for (filename, _, _, _, _, _) in exist_files])
-            insert_records(db, archive_dir_name, [(filename, source, pid, metadata) for (filename, source, pid, metadata, _, _) in exist_files])
             print("\033[1;32m# 由于已指定允许替代，已移动并归档%s个重复存在的文件，且已删除它们的旧文件。\033[0m" % (len(exist_files, )))
-            pass
 
     if len(unmatched_files) > 0 and not no_meta:
         print("\033[1;31m# 存在无法处理的未匹配文件。无法解析其元信息，请重命名、指定无元数据归档、或手动完成处理。\033[0m")
@@ -0,0 +1,40 @@
+from module.daemon import serve as serve_socket, get_socket_path, is_supported
+from module.database import Database
+from module.config import load_conf
+import command
+import signal
+
+
+def serve(socket_path: str or None, run):
+    """
+    启动常驻进程。常驻进程运行期间，imm命令会把参数转发给它执行，省去每次的启动和初始化开销。
+    :param socket_path: 监听的Unix socket路径。不指定时使用默认路径
+    :param run: 执行一条命令的函数，参数为命令行参数列表
+    """
+    if not is_supported():
+        print("\033[1;31m当前平台不支持Unix socket，无法启动常驻进程。\033[0m")
+        exit(1)
+    Database.share_connections()
+    # 预先导入全部命令模块，并打开数据库连接
+    for name in command.__all__:
+        getattr(command, name)
+    conf = load_conf()
+    Database(conf["work_path"]["db_path"])
+
+    def run_one(argv: list[str]):
+        try:
+            return run(argv)
+        finally:
+            Database.rollback_shared_connections()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, stop)
+
+    path = socket_path or get_socket_path()
+    print("\033[1;32m# 常驻进程已启动，监听%s。按Ctrl+C停止。\033[0m" % (path,))
+    try:
+        serve_socket(path, run_one)
+    except KeyboardInterrupt:
+        print()
+        print("# 常驻进程已停止")
@@ -0,0 +1,100 @@
+from module.database import Database
+from module.statistics import run_statistics, TagTypeAggregator, TagCountAggregator
+from module.config import load_conf
+import os
+
+
+ignored_belongs_names = {"original", "original character"}
+
+
+def stats(specs: list[tuple], source: str or None, scan: bool):
+    """
+    统计元数据库中的tag分布。types和count默认直接读取增量维护的tag统计表；
+    需要扫描时，所有指定的统计项在同一次扫描中完成，每条记录只解码一次。
+    归属分析基于tag共现矩阵。矩阵会缓存在数据库旁边，数据库没有变化时直接读取缓存，不再扫描。
+    :param specs: 统计项列表。每项为("types",)、("count", tag_type)或("belongs", parent_type, child_type)
+    :param source: 仅统计指定来源类型的记录
+    :param scan: 强制全量扫描记录，而不是读取tag统计表
+    """
+    conf = load_conf()
+    db = Database(conf["work_path"]["db_path"])
+
+    aggregators = []
+    if scan:
+        for spec in specs:
+            if spec[0] == "types":
+                aggregators.append(TagTypeAggregator())
+            elif spec[0] == "count":
+                aggregators.append(TagCountAggregator(spec[1]))
+
+    belongs = [spec[1:] for spec in specs if spec[0] == "belongs"]
+    matrix, matrix_aggregator = None, None
+    if len(belongs) > 0:
+        # 共现矩阵依赖numpy，只在归属分析时导入
+        from module.cooccurrence import CooccurrenceAggregator, CooccurrenceMatrix, entity_types
+        required_types = sorted(set(entity_types).union(t for pair in belongs for t in pair))
+        cache_path = os.path.join(os.path.dirname(conf["work_path"]["db_path"]), "cooccurrence%s.npz" % ("" if source is None else "." + source,))
+        fingerprint = db.query_fingerprint()
+        matrix = CooccurrenceMatrix.load(cache_path, fingerprint, required_types)
+        if matrix is None:
+            matrix_aggregator = CooccurrenceAggregator(required_types)
+            aggregators.append(matrix_aggregator)
+
+    if len(aggregators) > 0:
+        interner, rows, cost = run_statistics(db, aggregators, source)
+        if matrix_aggregator is not None:
+            matrix = matrix_aggregator.result(interner)
+            matrix.save(cache_path, fingerprint)
+    else:
+        interner, rows, cost = None, 0, 0
+
+    if not scan:
+        for spec in specs:
+            if spec[0] == "types":
+                print()
+                __print_types(db.query_tag_type_stats(source))
+            elif spec[0] == "count":
+                print()
+                __print_count(spec[1], *db.query_tag_stats(spec[1], source))
+    for aggregator in aggregators:
+        if isinstance(aggregator, TagTypeAggregator):
+            print()
+            __print_types(aggregator.result(interner))
+        elif isinstance(aggregator, TagCountAggregator):
+            print()
+            __print_count(aggregator.tag_type, *aggregator.result(interner))
+    for (parent_type, child_type) in belongs:
+        print()
+        __print_belongs(parent_type, child_type, *matrix.belongs(parent_type, child_type, ignored_belongs_names))
+
+    print()
+    if interner is not None:
+        print("# 扫描%s条记录，%s个不同的tag，耗时%.2fs (%.0f条/s)" % (rows, len(interner.names), cost, rows / cost if cost > 0 else 0))
+    elif len(belongs) > 0:
+        print("# 数据库无变化，已使用缓存的共现矩阵")
+    else:
+        print("# 已读取tag统计表")
+
+
+def __print_types(type_count: list[(str, int)]):
+    print("# === tag type分布 ===")
+    for k, v in type_count:
+        print("%-16s: %s" % (k, v))
+
+
+def __print_count(tag_type: str, items: list[(str, int, str)], absent: int):
+    print("# === %s ===" % (tag_type,))
+    for name, count, title in items:
+        print("%-50s: %4d : %s" % (name, count, title or ""))
+    print("%-50s: %4d" % ("[no %s]" % (tag_type,), absent))
+
+
+def __print_belongs(parent_type: str, child_type: str, parents: list, no_parent: list):
+    print("# === %s -> %s ===" % (parent_type, child_type))
+    for name, count, title, children in parents:
+        print("%-50s: %4d : %s" % ("%s (%d)" % (name, len(children)), count, title or ""))
+        for child_name, child_count, child_title, confidence in children:
+            print("        %-42s: %4d : %3d%% : %s" % (child_name, child_count, confidence * 100, child_title or ""))
+    print("NO PARENT:")
+    for name, count, title in no_parent:
+        print("        %-42s: %4d : %s" % (name, count, title or ""))
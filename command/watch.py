@@ -0,0 +1,96 @@
+from module.local import scan_rename_files, scan_move_files, get_today_archive
+from module.database import Database, scan_record_existence
+from module.watcher import create_watcher, Debouncer
+from module.journal import get_journal, apply_plan, recover_pending_plan
+from module.probe import probe_records
+from module.config import load_conf
+from datetime import datetime
+import os
+
+
+def watch(work_dir, archive, split, debounce, interval, polling):
+    """
+    持续监视工作目录，对新落地的文件依次执行重命名和保存。
+    启动时会先处理一次工作目录中的已有文件，之后仅处理新出现或发生变化的文件，因此每一轮的处理代价只与新文件数相关。
+    文件的大小和修改时间在debounce秒内不再变化才会被视作写入完成，以避免处理下载了一半的文件。
+    优先使用inotify监视目录，在不支持的平台上回退至按interval定时扫描。
+
+    :param work_dir: 显式指定工作目录，而不是使用默认路径
+    :param archive: 显式指定存档文件夹。如果不指定，则每一批都根据当天的日期生成目录
+    :param split: 指定一个分割的存档。指定后，会使用类似yyyy-MM-dd.N的存档文件夹
+    :param debounce: 防抖时间，单位是秒
+    :param interval: 定时扫描模式下的扫描间隔，单位是秒
+    :param polling: 强制使用定时扫描模式
+    """
+    conf = load_conf()
+    work_dir = work_dir or conf["work_path"]["default_work_dir"]
+    db = Database(conf["work_path"]["db_path"])
+    journal = get_journal(conf)
+    recover_pending_plan(db, journal)
+
+    watcher, watcher_type = create_watcher(work_dir, interval, polling)
+    debouncer = Debouncer(work_dir, debounce)
+    debouncer.add([f.name for f in os.scandir(work_dir) if f.is_file()])
+
+    print("# 开始监视工作目录 \033[1;34m%s\033[0m (%s)，按Ctrl+C停止" % (work_dir, watcher_type))
+    try:
+        while True:
+            # 单独一批的失败(文件在处理中途消失、探测失败、数据库被锁定等)只记录下来，不中止监视。
+            # 失败批次中的文件留在工作目录中，在下次变化或下次启动时重新处理
+            try:
+                debouncer.add(watcher.poll(debounce if debouncer.has_pending() else interval))
+                ready = debouncer.ready()
+                if len(ready) > 0:
+                    # 上一批中断时可能留下未完成的计划，先恢复它，以免被新的计划覆盖
+                    recover_pending_plan(db, journal)
+                    __process(conf, db, journal, work_dir, archive or get_today_archive(conf["save"].get("archive_time_offset"), split), ready)
+            except Exception as e:
+                print("%s | \033[1;31m# 处理失败: %s: %s\033[0m" % (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), type(e).__name__, e))
+    except KeyboardInterrupt:
+        print()
+        print("# 监视中止")
+    finally:
+        watcher.close()
+        db.close()
+
+
+def __process(conf, db: Database, journal, work_dir: str, archive_dir_name: str, filenames: list[str]):
+    """
+    对一批已写入完成的文件执行重命名和保存。
+    """
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    rename_result = scan_rename_files(
+        work_dir=work_dir,
+        rules=conf["rename"]["rules"],
+        extensions=conf.get("supported_extensions"),
+        excludes=conf["rename"].get("excludes", []),
+        filenames=filenames
+    )
+    # 只处理了新文件，因此还需要检查重命名目标是否与目录中的其他已有文件重名
+    renames = [(old, new) for (old, new) in rename_result["renames"] if not os.path.exists(os.path.join(work_dir, new))]
+    apply_plan(None, journal, moves=[(os.path.join(work_dir, old), os.path.join(work_dir, new)) for (old, new) in renames])
+    renamed = dict(renames)
+    for (old, new) in renames:
+        print("%s | \033[1;32m%s\033[0m -> \033[1;32m%s\033[0m" % (timestamp, old, new))
+
+    matched_files, unmatched_files = scan_move_files(
+        work_dir=work_dir,
+        rules=conf["save"]["rules"],
+        extensions=conf.get("supported_extensions"),
+        filenames=[renamed.get(f, f) for f in filenames if os.path.exists(os.path.join(work_dir, renamed.get(f, f)))]
+    )
+    move_files, exist_files = scan_record_existence(db, matched_files)
+
+    for item in unmatched_files:
+        print("%s | \033[1;31m%s\033[0m 未匹配，需要手动处理" % (timestamp, item))
+    for (filename, _, _, _, exist_archive, exist_filename) in exist_files:
+        print("%s | \033[1;33m%s\033[0m 已存在于 \033[1;33m%s/%s\033[0m" % (timestamp, filename, exist_archive, exist_filename))
+
+    if len(move_files) > 0:
+        archive_target_dir = os.path.join(conf["work_path"]["archive_dir"], archive_dir_name)
+        apply_plan(db, journal,
+                   moves=[(os.path.join(work_dir, filename), os.path.join(archive_target_dir, filename)) for (filename, _, _, _) in move_files],
+                   records=[(source, pid, archive_dir_name, filename, metadata) for (filename, source, pid, metadata) in move_files])
+        db.write_probes(probe_records(conf["work_path"]["archive_dir"], [(source, pid, archive_dir_name, filename) for (filename, source, pid, _) in move_files]))
+        print("%s | \033[1;32m# 已移动并归档%s个文件至 %s\033[0m" % (timestamp, len(move_files), archive_dir_name))
@@ -1,18 +1,37 @@
+import sys
+
+if __name__ == '__main__':
+    # 常驻进程正在运行时直接转发命令，不必导入click和命令模块
+    from module.daemon import forward
+    forwarded = forward(sys.argv[1:])
+    if forwarded is not None:
+        sys.exit(forwarded)
+
 import click
 import command
 
 
 @click.group(help="IMM: 图像元数据管理器")
-def imm():
-    pass
+@click.option("--timing", is_flag=True, help="命令结束时打印扫描、规则匹配、数据库和文件操作各阶段的耗时，以及执行的SQL语句数")
+@click.option("--profile", "profile_path", metavar="FILE", help="以cProfile剖析整个命令，并将pstats结果写入FILE。同时打印各阶段耗时")
+@click.option("--progress", "progress_format", type=click.Choice(["text", "json"]), default="text",
+              help="json: 以JSON Lines向标准错误输出阶段开始/结束、完成数、速率、预计剩余时间和错误事件，供其他程序读取", show_default=True)
+@click.option("--progress-fd", type=int, metavar="FD", help="将JSON进度事件写入指定的文件描述符，而不是标准错误")
+@click.pass_context
+def imm(ctx, timing, profile_path, progress_format, progress_fd):
+    if timing or profile_path:
+        ctx.call_on_close(command.start_profiling(profile_path))
+    if progress_format == "json":
+        ctx.call_on_close(command.start_progress(progress_fd))
 
 
 @imm.command("rename", help="整理重命名图像文档")
 @click.option("--work-dir", "-d", help="显式指定工作目录")
 @click.option("--dry-run", is_flag=True, help="模拟重命名结果并打印，并不实际执行重命名操作")
 @click.option("--verbose", "-v", is_flag=True, help="打印详细的重命名计划列表")
-def rename(work_dir, dry_run, verbose):
-    command.rename(work_dir, dry_run, verbose)
+@click.option("--plan-out", metavar="FILE", help="将计划连同文件指纹写入FILE而不执行，之后可以使用imm apply FILE执行")
+def rename(work_dir, dry_run, verbose, plan_out):
+    command.rename(work_dir, dry_run, verbose, plan_out)
 
 
 @imm.command("save", help="移动，并将图像信息保存入库")
@@ -22,8 +41,30 @@ def rename(work_dir, dry_run, verbose):
 @click.option("--replace", "-r", is_flag=True, help="对于库中已有的重复文件，执行替换操作")
 @click.option("--no-meta", "-n", is_flag=True, help="对于无元数据匹配的项，同样允许存档，但不保存元数据")
 @click.option("--dry-run", is_flag=True, help="模拟保存结果并打印，并不实际执行保存和移动操作")
-def save(work_dir, archive, split, replace, no_meta, dry_run):
-    command.save(work_dir, archive, split, replace, no_meta, dry_run)
+@click.option("--plan-out", metavar="FILE", help="将计划连同文件指纹写入FILE而不执行，之后可以使用imm apply FILE执行")
+def save(work_dir, archive, split, replace, no_meta, dry_run, plan_out):
+    command.save(work_dir, archive, split, replace, no_meta, dry_run, plan_out)
+
+
+@imm.command("ingest", help="以单次流式处理完成重命名、查重、移动和入库")
+@click.option("--work-dir", "-d", help="显式指定工作目录")
+@click.option("--archive", "-a", help="显示指定保存目录。不指定的情况下，默认根据今天的日期生成目录")
+@click.option("--split", "-s", help="指定一个分割的存档。指定后，会使用类似yyyy-MM-dd.N的存档文件夹")
+@click.option("--chunk-size", "-c", type=int, default=500, help="每一批处理的文件数", show_default=True)
+@click.option("--dry-run", is_flag=True, help="模拟处理结果并打印，并不实际执行移动和入库操作")
+def ingest(work_dir, archive, split, chunk_size, dry_run):
+    command.ingest(work_dir, archive, split, chunk_size, dry_run)
+
+
+@imm.command("watch", help="持续监视工作目录，自动重命名并保存新落地的文件")
+@click.option("--work-dir", "-d", help="显式指定工作目录")
+@click.option("--archive", "-a", help="显示指定保存目录。不指定的情况下，默认根据当天的日期生成目录")
+@click.option("--split", "-s", help="指定一个分割的存档。指定后，会使用类似yyyy-MM-dd.N的存档文件夹")
+@click.option("--debounce", type=float, default=2.0, help="文件在此秒数内不再变化才视作写入完成", show_default=True)
+@click.option("--interval", type=float, default=5.0, help="定时扫描模式下的扫描间隔秒数", show_default=True)
+@click.option("--polling", is_flag=True, help="强制使用定时扫描模式，而不是inotify")
+def watch(work_dir, archive, split, debounce, interval, polling):
+    command.watch(work_dir, archive, split, debounce, interval, polling)
 
 
 @imm.command("download", help="下载图像的元数据")
@@ -36,17 +77,77 @@ def download():
 @click.option("--unsaved", "-s", is_flag=True, help="查找文件库中的未保存文件，并加入保存")
 @click.option("--mark-deleted", "-m", is_flag=True, help="搜索并在数据库中标记已被删除的文件，添加已删除标记")
 @click.option("--analyse-metadata", "-a", is_flag=True, help="查找空元数据的项，并重新生成元数据")
+@click.option("--near-duplicates", "-n", is_flag=True, help="计算图像的感知哈希，查找文件库中视觉上近似的重复图像")
+@click.option("--distance", type=int, default=4, help="近似图像判定的最大汉明距离", show_default=True)
+@click.option("--probe", "-p", is_flag=True, help="读取文件头部，为尚未探测的记录补充格式、尺寸和文件大小")
+@click.option("--rebuild-index", is_flag=True, help="全量重建tag统计表、tag索引等由数据库增量维护的派生表")
+@click.option("--compact-tags", is_flag=True, help="将以JSON存储的tags迁移为引用tag字典的紧凑格式，整理数据库文件并报告迁移前后的大小和扫描耗时")
 @click.option("--dry-run", is_flag=True, help="模拟整理结果并打印，并不实际执行整理操作")
-def organize(deduplicate, unsaved, mark_deleted, analyse_metadata, dry_run):
-    command.organize(deduplicate, unsaved, mark_deleted, analyse_metadata, dry_run)
+@click.option("--plan-out", metavar="FILE", help="将--unsaved、--deduplicate和--mark-deleted的计划连同文件指纹写入FILE而不执行，之后可以使用imm apply FILE执行")
+def organize(deduplicate, unsaved, mark_deleted, analyse_metadata, near_duplicates, distance, probe, rebuild_index, compact_tags, dry_run, plan_out):
+    command.organize(deduplicate, unsaved, mark_deleted, analyse_metadata, near_duplicates, distance, probe, rebuild_index, compact_tags, dry_run, plan_out)
+
+
+@imm.command("apply", help="执行由--plan-out保存的计划。执行前校验文件指纹，而不重新扫描目录")
+@click.argument("plan_file")
+@click.option("--force", is_flag=True, help="跳过文件指纹和数据库版本的校验")
+def apply(plan_file, force):
+    command.apply(plan_file, force)
+
+
+@imm.command("recover", help="恢复上次中断的文件操作计划")
+@click.option("--rollback", is_flag=True, help="回滚尚未提交的计划，而不是重放它")
+def recover(rollback):
+    command.recover(rollback)
+
+
+@imm.command("compact", help="将删除已久的记录移出主表，存入归档表或直接丢弃")
+@click.option("--days", type=int, default=30, help="只处理删除时间早于此天数之前的记录", show_default=True)
+@click.option("--purge", is_flag=True, help="直接丢弃记录，而不是存入归档表meta_archive")
+@click.option("--dry-run", is_flag=True, help="仅统计符合条件的记录数，并不实际执行")
+def compact(days, purge, dry_run):
+    command.compact(days, purge, dry_run)
 
 
 @imm.command("export", help="导出元数据")
 @click.option("--archive", "-a", help="指定保存目录")
 @click.option("--source", "-s", help="指定来源类型")
-@click.option("--output", "-o", help="指定输出文件")
-def export(archive, source, output):
-    command.export(archive, source, output)
+@click.option("--output", "-o", help="指定输出文件。以.gz结尾时写入gzip压缩文件")
+@click.option("--format", "-f", "fmt", type=click.Choice(["yaml", "json", "jsonl"]), help="导出格式。默认根据输出文件的扩展名推断")
+@click.option("--python-mapping", is_flag=True, help="在Python中逐条映射记录，而不是由SQLite直接生成每条记录的JSON")
+@click.option("--delta", "-d", metavar="NAME", help="增量导出: 只导出自名为NAME的上次增量导出以来变化的记录和已删除记录的墓碑。此时--archive可以省略")
+def export(archive, source, output, fmt, python_mapping, delta):
+    command.export(archive, source, output, fmt, python_mapping, delta)
+
+
+@imm.group(chain=True, help="统计元数据库中的tag分布。可以串联多个统计项，它们会在同一次扫描中完成")
+@click.option("--source", "-s", help="仅统计指定来源类型的记录")
+@click.option("--scan", is_flag=True, help="强制全量扫描记录，而不是读取增量维护的tag统计表")
+def stats(source, scan):
+    pass
+
+
+@stats.command("types", help="统计每种tag type下不同tag的数量")
+def stats_types():
+    return "types",
+
+
+@stats.command("count", help="统计指定tag type下每个tag出现的记录数")
+@click.argument("tag_type")
+def stats_count(tag_type):
+    return "count", tag_type
+
+
+@stats.command("belongs", help="分析child类型的tag归属于哪个parent类型的tag")
+@click.argument("parent_type")
+@click.argument("child_type")
+def stats_belongs(parent_type, child_type):
+    return "belongs", parent_type, child_type
+
+
+@stats.result_callback()
+def stats_process(specs, source, scan):
+    command.stats(specs, source, scan)
 
 
 @imm.group(help="查询元数据库")
@@ -61,15 +162,56 @@ def query():
 @click.option("--show", "-s", is_flag=True, help="同时在文件管理器展示此文件")
 @click.option("--open", "-o", is_flag=True, help="同时打开此文件")
 def query_one(source, pid, all, show, open):
-    print("query one")
+    command.query_one(source, pid, all, show, open)
 
 
-@query.command(name="list", help="查询符合条件的数据记录列表")
+@query.command(name="list", help="查询符合条件的数据记录列表。EXPRESSION是tag查询表达式，例如 'character:x AND NOT meta:animated'")
+@click.argument("expression", required=False)
 @click.option("--source", "-s", help="过滤指定的数据源类型")
 @click.option("--create-from", "-c", help="过滤某个时间点之后的数据")
-@click.option("--limit", "-l", help="限制查询数量", default=20)
-def query_list(source, create_from, limit):
-    print("query list")
+@click.option("--limit", "-l", type=int, help="限制查询数量", default=20)
+@click.option("--order", "-o", multiple=True, help="排序列，前缀-表示降序。可选id, create-time, analyse-time, folder, filename, source, pid, status。默认为-id")
+@click.option("--after", help="从上一页给出的续页token继续查询")
+@click.option("--explain", is_flag=True, help="打印编译后的SQL和查询计划，而不执行查询")
+def query_list(expression, source, create_from, limit, order, after, explain):
+    command.query_list(expression, source, create_from, limit, list(order), after, explain)
+
+
+@query.command(name="search", help="在tag名称、tag标题和pool名称中全文检索。TEXT中的词均需命中，\"...\"表示短语，以*结尾表示前缀")
+@click.argument("text")
+@click.option("--column", "-c", type=click.Choice(["names", "titles", "pools"]), help="仅检索指定的列")
+@click.option("--limit", "-l", type=int, default=20, help="限制查询数量", show_default=True)
+def query_search(text, column, limit):
+    command.query_search(text, column, limit)
+
+
+@query.command(name="tags", help="按前缀补全tag名称")
+@click.argument("prefix")
+@click.option("--type", "-t", "tag_type", help="仅补全指定tag type")
+@click.option("--source", "-s", help="仅统计指定来源类型的记录")
+@click.option("--limit", "-l", type=int, default=20, help="限制补全数量", show_default=True)
+def query_tags(prefix, tag_type, source, limit):
+    command.query_tags(prefix, tag_type, source, limit)
+
+
+@query.command(name="family", help="查询一条记录经parent/child关系相连的全部记录，并标出本地缺失的成员")
+@click.argument("source")
+@click.argument("pid")
+def query_family(source, pid):
+    command.query_family(source, pid)
+
+
+@query.command(name="pool", help="查询pool在本地的成员。POOL是pool id或名称，名称可以使用*通配符")
+@click.argument("source")
+@click.argument("pool")
+def query_pool(source, pool):
+    command.query_pool(source, pool)
+
+
+@imm.command("serve", help="启动常驻进程。常驻进程运行时，其他imm命令会转发给它执行，省去每次的启动和初始化开销")
+@click.option("--socket", help="监听的Unix socket路径。默认为$XDG_RUNTIME_DIR/imm-<uid>.sock，或通过环境变量IMM_SOCKET指定")
+def serve(socket):
+    command.serve(socket, lambda argv: imm.main(args=argv, prog_name="imm", standalone_mode=True))
 
 
 if __name__ == '__main__':
@@ -1,15 +1,79 @@
 import os
+import re
+import pickle
+import hashlib
 import platform
-import yaml
+import tempfile
+
+# 缓存内容的格式发生变化时递增，使旧的缓存失效
+__CACHE_VERSION = 1
+
+# 本进程中已加载的配置: 真实路径 -> (缓存键, 配置)
+__loaded: dict[str, (tuple, dict)] = dict()
 
 
 def read_conf(filename):
+    """
+    读取配置文件。解析并完成环境变量替换的配置会以pickle缓存，缓存以文件的真实路径、修改时间和大小为键，
+    配置文件未变化时直接读取缓存，不再导入yaml和解析YAML。同一进程中重复读取时直接返回已加载的配置。
+    """
     try:
-        with open(filename, 'r') as f:
-            conf = yaml.load(f.read(), Loader=yaml.FullLoader)
-            return analyse_conf_env(conf)
+        stat = os.stat(filename)
     except FileNotFoundError:
         return None
+    path = os.path.realpath(filename)
+    key = (path, stat.st_mtime_ns, stat.st_size, os.environ.get("HOME"), __CACHE_VERSION)
+    loaded = __loaded.get(path)
+    if loaded is not None and loaded[0] == key:
+        return loaded[1]
+
+    cache_path = __get_cache_path(path)
+    conf = __read_cache(cache_path, key)
+    if conf is None:
+        try:
+            conf = analyse_conf_env(__parse_yaml(filename))
+        except FileNotFoundError:
+            return None
+        validate_conf(conf)
+        __write_cache(cache_path, key, conf)
+    __loaded[path] = (key, conf)
+    return conf
+
+
+def __parse_yaml(filename):
+    import yaml
+    # 优先使用libyaml实现的加载器
+    loader = getattr(yaml, "CFullLoader", yaml.FullLoader)
+    with open(filename, 'rb') as f:
+        return yaml.load(f, Loader=loader)
+
+
+def __get_cache_path(path: str):
+    cache_dir = os.path.join(get_appdata_dir() or tempfile.gettempdir(), "imm", "cache")
+    return os.path.join(cache_dir, "config-%s.pickle" % (hashlib.sha1(path.encode()).hexdigest()[:16],))
+
+
+def __read_cache(cache_path: str, key: tuple):
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_key, conf = pickle.load(f)
+        return conf if cached_key == key else None
+    except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+        return None
+
+
+def __write_cache(cache_path: str, key: tuple, conf):
+    """
+    写入缓存。先写入临时文件再原子替换，并发的进程不会读到不完整的缓存。缓存目录不可写时静默跳过。
+    """
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = "%s.%s.tmp" % (cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((key, conf), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
 
 
 def analyse_conf_env(conf):
@@ -26,6 +90,22 @@ def analyse_conf_env(conf):
     return conf
 
 
+def validate_conf(conf):
+    """
+    校验配置中的正则表达式规则，使错误的规则在加载配置时就被报告，而不是在扫描中途。通过校验的配置才会被缓存。
+    """
+    patterns = [("rename.rules", rule.get("filename")) for rule in conf.get("rename", {}).get("rules", [])] + \
+               [("rename.excludes", exclude) for exclude in conf.get("rename", {}).get("excludes", [])] + \
+               [("save.rules", rule.get("filename")) for rule in conf.get("save", {}).get("rules", [])]
+    for (field, pattern) in patterns:
+        if not isinstance(pattern, str):
+            raise ValueError("Invalid rule in %s: %s" % (field, pattern))
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise ValueError("Invalid regular expression in %s: '%s' (%s)" % (field, pattern, e))
+
+
 def get_appdata_dir():
     system = platform.system()
     if system == "Linux":
@@ -0,0 +1,135 @@
+import os
+from array import array
+import numpy
+from module.statistics import TagInterner
+
+
+entity_types = ['copyright', 'character', 'artist', 'studio']
+
+
+class CooccurrenceAggregator:
+    """
+    在统计扫描中构造tag共现矩阵。只有指定类型的tag参与共现，以免general等大类型使矩阵规模膨胀。
+    每条记录的tag两两配对追加进COO缓冲区，缓冲区达到flush_size后用numpy合并去重，因此内存只与不同的tag对数量相关。
+    """
+    def __init__(self, types: list[str], flush_size: int = 4000000):
+        self.types = set(types)
+        self.__flush_size = flush_size
+        self.__keys = array('Q')
+        self.__merged_keys = numpy.zeros(0, dtype=numpy.uint64)
+        self.__merged_values = numpy.zeros(0, dtype=numpy.int64)
+        self.__counts: dict[int, int] = dict()
+
+    def feed(self, tag_ids: list[int], interner: TagInterner):
+        types = interner.types
+        ids = [i for i in tag_ids if types[i] in self.types]
+        for i in ids:
+            self.__counts[i] = self.__counts.get(i, 0) + 1
+        if len(ids) > 1:
+            keys = self.__keys
+            for a in ids:
+                high = a << 32
+                for b in ids:
+                    if a != b:
+                        keys.append(high | b)
+            if len(keys) >= self.__flush_size:
+                self.__flush()
+
+    def __flush(self):
+        keys = numpy.frombuffer(self.__keys, dtype=numpy.uint64)
+        keys = numpy.concatenate((self.__merged_keys, keys))
+        values = numpy.concatenate((self.__merged_values, numpy.ones(len(keys) - len(self.__merged_keys), dtype=numpy.int64)))
+        self.__merged_keys, inverse = numpy.unique(keys, return_inverse=True)
+        self.__merged_values = numpy.bincount(inverse, weights=values).astype(numpy.int64)
+        self.__keys = array('Q')
+
+    def result(self, interner: TagInterner):
+        self.__flush()
+        size = len(interner.names)
+        rows = (self.__merged_keys >> numpy.uint64(32)).astype(numpy.int64)
+        cols = (self.__merged_keys & numpy.uint64(0xFFFFFFFF)).astype(numpy.int64)
+        counts = numpy.zeros(size, dtype=numpy.int64)
+        for (i, c) in self.__counts.items():
+            counts[i] = c
+        # 键已按(row, col)排序，直接转换为CSR
+        indptr = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(rows, minlength=size))))
+        return CooccurrenceMatrix(sorted(self.types), interner.types, interner.names, interner.titles, counts, indptr, cols, self.__merged_values)
+
+
+class CooccurrenceMatrix:
+    """
+    以CSR形式存储的tag共现矩阵。第i行中列j的值，是同时带有tag i和tag j的记录数。
+    """
+    def __init__(self, matrix_types: list[str], types, names, titles, counts, indptr, indices, values):
+        self.matrix_types = list(matrix_types)
+        self.types = numpy.asarray(types, dtype=object)
+        self.names = numpy.asarray(names, dtype=object)
+        self.titles = numpy.asarray(titles, dtype=object)
+        self.counts = numpy.asarray(counts)
+        self.indptr = numpy.asarray(indptr)
+        self.indices = numpy.asarray(indices)
+        self.values = numpy.asarray(values)
+
+    def save(self, path: str, fingerprint: str):
+        tmp_path = path + ".tmp.npz"
+        numpy.savez(tmp_path, fingerprint=numpy.array(fingerprint), matrix_types=numpy.array(self.matrix_types),
+                    types=self.types.astype(str), names=self.names.astype(str),
+                    titles=numpy.array(["" if t is None else t for t in self.titles]), has_title=numpy.array([t is not None for t in self.titles]),
+                    counts=self.counts, indptr=self.indptr, indices=self.indices, values=self.values)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str, fingerprint: str, required_types: list[str]):
+        """
+        加载磁盘缓存。缓存的数据库指纹不一致，或缓存不包含所需的tag类型时返回None。
+        """
+        try:
+            with numpy.load(path) as data:
+                if str(data["fingerprint"]) != fingerprint or not set(required_types).issubset(set(data["matrix_types"].tolist())):
+                    return None
+                titles = [t if h else None for (t, h) in zip(data["titles"].tolist(), data["has_title"].tolist())]
+                return CooccurrenceMatrix(data["matrix_types"].tolist(), data["types"].tolist(), data["names"].tolist(), titles,
+                                          data["counts"], data["indptr"], data["indices"], data["values"])
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+
+    def __coo_rows(self):
+        return numpy.repeat(numpy.arange(len(self.indptr) - 1), numpy.diff(self.indptr))
+
+    def belongs(self, parent_type: str, child_type: str, ignored_names: set[str]):
+        """
+        分析child类型的tag归属于哪个parent类型的tag。全部计算都以向量化完成：
+        对每个child取共现次数最大的parent(argmax)，并列时选择全局计数最少的parent；
+        并以共现次数除以child自身的计数，给出归属的置信度。
+        :return: list[(str, int, str or None, list[(str, int, str or None, float)])], list[(str, int, str or None)]
+                 parent列表，每项为(name, count, title, children列表)，按count升序；以及没有归属的children列表
+        """
+        ignored = numpy.isin(self.names, list(ignored_names))
+        is_parent = (self.types == parent_type) & ~ignored & (self.counts > 0)
+        is_child = (self.types == child_type) & ~ignored & (self.counts > 0)
+
+        rows, cols, values = self.__coo_rows(), self.indices, self.values
+        mask = is_child[rows] & is_parent[cols]
+        rows, cols, values = rows[mask], cols[mask], values[mask]
+
+        order = numpy.lexsort((self.counts[cols], -values, rows))
+        rows, cols, values = rows[order], cols[order], values[order]
+        first = numpy.concatenate(([True], rows[1:] != rows[:-1])) if len(rows) > 0 else numpy.zeros(0, dtype=bool)
+        children, parents, shared = rows[first], cols[first], values[first]
+        confidence = shared / self.counts[children]
+
+        def describe(i):
+            return self.names[i], int(self.counts[i]), self.titles[i]
+
+        children_of: dict[int, list] = dict()
+        for c, p, r in sorted(zip(children.tolist(), parents.tolist(), confidence.tolist()), key=lambda t: self.counts[t[0]]):
+            children_of.setdefault(p, []).append((*describe(c), r))
+
+        parent_ids = numpy.nonzero(is_parent)[0]
+        parent_ids = parent_ids[numpy.argsort(self.counts[parent_ids], kind="stable")]
+        result = [(*describe(p), children_of.get(p, [])) for p in parent_ids.tolist()]
+
+        child_ids = numpy.nonzero(is_child)[0]
+        orphan_ids = numpy.setdiff1d(child_ids, children)
+        orphan_ids = orphan_ids[numpy.argsort(self.counts[orphan_ids], kind="stable")]
+        return result, [describe(c) for c in orphan_ids.tolist()]
@@ -0,0 +1,206 @@
+import os
+import io
+import sys
+import json
+import socket
+import struct
+import tempfile
+import traceback
+
+# 帧类型: 标准输出、标准错误和退出码
+__STDOUT, __STDERR, __EXIT = b'O', b'E', b'X'
+frame_header = struct.Struct('>cI')
+
+# 不转发给常驻进程的命令。watch会长时间占用常驻进程，serve是常驻进程本身
+local_commands = {"serve", "watch"}
+
+# imm命令组上带有参数值的选项。寻找子命令时需要跳过它们的值
+value_options = {"--profile", "--progress", "--progress-fd"}
+
+
+def get_socket_path():
+    """
+    常驻进程监听的Unix socket路径。可以通过环境变量IMM_SOCKET指定。
+    """
+    path = os.environ.get("IMM_SOCKET")
+    if path:
+        return path
+    return os.path.join(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(), "imm-%s.sock" % (os.getuid(),))
+
+
+def is_supported():
+    return hasattr(socket, "AF_UNIX") and hasattr(os, "getuid")
+
+
+def send_frame(conn, kind: bytes, data: bytes):
+    conn.sendall(frame_header.pack(kind, len(data)) + data)
+
+
+def __recv_exactly(conn, size: int):
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = conn.recv(size - len(buffer))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        buffer += chunk
+    return bytes(buffer)
+
+
+class FrameWriter(io.TextIOBase):
+    """
+    将写入的文本按帧发送给客户端，替代常驻进程中命令的sys.stdout/sys.stderr。
+    文本在缓冲区中积累，遇到flush或缓冲区满时才发送，避免逐次print产生大量小包。
+    """
+    BUFFER_SIZE = 1 << 14
+
+    def __init__(self, conn, kind: bytes):
+        super().__init__()
+        self.__conn = conn
+        self.__kind = kind
+        self.__buffer = []
+        self.__size = 0
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return False
+
+    def write(self, s: str or bytes):
+        # click在某些情况下直接写入字节
+        if isinstance(s, (bytes, bytearray)):
+            s = bytes(s).decode("utf-8", "replace")
+        self.__buffer.append(s)
+        self.__size += len(s)
+        if self.__size >= self.BUFFER_SIZE:
+            self.flush()
+        return len(s)
+
+    def flush(self):
+        if self.__size > 0 or self.__buffer:
+            data = "".join(self.__buffer).encode("utf-8")
+            self.__buffer.clear()
+            self.__size = 0
+            if data:
+                send_frame(self.__conn, self.__kind, data)
+
+
+def get_command_name(argv: list[str]):
+    """
+    找出命令行参数中的子命令名称，跳过命令组选项及其参数值。
+    :return: str or None
+    """
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if not arg.startswith("-"):
+            return arg
+        if arg in value_options:
+            i += 1
+        i += 1
+    return None
+
+
+def forward(argv: list[str]):
+    """
+    如果常驻进程正在运行，把命令行参数和工作目录转发给它执行，并把它的输出写到本进程的输出。
+    :return: int or None 命令的退出码。常驻进程没有运行或命令不适合转发时返回None，由调用者在本进程执行
+    """
+    name = get_command_name(argv)
+    # --profile剖析的是本进程，--progress-fd写入的是本进程的文件描述符，因此也在本进程执行
+    if not is_supported() or os.environ.get("IMM_NO_DAEMON") or name is None or name in local_commands or "--help" in argv \
+            or any(arg.startswith("--profile") or arg.startswith("--progress-fd") for arg in argv):
+        return None
+    path = get_socket_path()
+    if not os.path.exists(path):
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        conn.close()
+        return None
+    try:
+        conn.sendall(json.dumps({"argv": argv, "cwd": os.getcwd()}).encode("utf-8") + b'\n')
+        while True:
+            kind, size = frame_header.unpack(__recv_exactly(conn, frame_header.size))
+            data = __recv_exactly(conn, size)
+            if kind == __EXIT:
+                return int(data.decode())
+            stream = sys.stdout if kind == __STDOUT else sys.stderr
+            stream.buffer.write(data)
+            stream.flush()
+    except ConnectionError:
+        print("\033[1;31m与常驻进程的连接中断。\033[0m", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+
+
+def serve(path: str, run):
+    """
+    在Unix socket上接收并依次执行转发来的命令。常驻进程中数据库连接、配置、编译后的规则和HTTP会话在命令之间保持，
+    因此每个命令省去了解释器启动、导入和初始化的开销。命令按接收顺序串行执行，与直接在命令行中依次执行的效果相同。
+    :param path: socket路径
+    :param run: 执行一条命令的函数，参数为命令行参数列表，返回退出码
+    """
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            probe.close()
+            raise RuntimeError("another imm server is listening on %s" % (path,))
+        except (ConnectionRefusedError, FileNotFoundError):
+            # 上次的常驻进程异常退出，遗留了socket文件
+            os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    __handle(conn, run)
+                except (ConnectionError, BrokenPipeError):
+                    pass
+    finally:
+        server.close()
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def __handle(conn, run):
+    line = conn.makefile('rb').readline()
+    if not line:
+        return
+    request = json.loads(line.decode("utf-8"))
+    stdout, stderr = FrameWriter(conn, __STDOUT), FrameWriter(conn, __STDERR)
+    original = (sys.stdout, sys.stderr, os.getcwd())
+    sys.stdout, sys.stderr = stdout, stderr
+    try:
+        os.chdir(request["cwd"])
+        code = run(request["argv"])
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except (ConnectionError, BrokenPipeError):
+        raise
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout, sys.stderr = original[0], original[1]
+        os.chdir(original[2])
+    stdout.flush()
+    stderr.flush()
+    send_frame(conn, __EXIT, str(code or 0).encode())
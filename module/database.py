@@ -1,6 +1,12 @@
+import os
 import sqlite3
 import json
 import datetime
+from collections import Counter
+from itertools import groupby
+from module.query import compile_expression, compile_order, compile_keyset, encode_token, decode_token, fts_terms, fts_query, like_pattern
+from module.tag_dictionary import TagDictionary, normalize_tags
+from module.profiler import connect
 
 
 class STATUS:
@@ -22,10 +28,118 @@ def index_to_status(index):
     return ['NOT_ANALYSED', 'ANALYSED', 'ERROR'][index]
 
 
+# 记录带有tags: 已迁移为紧凑格式，或仍以JSON存储
+has_tags_condition = '(tag_ids IS NOT NULL OR (tags IS NOT NULL AND tags != \'\'))'
+
+record_columns = 'meta.id, source, pid, status, folder, filename, tags, relations, meta, create_time, analyse_time, tag_ids, tag_counts'
+
+
+class MetaRecord:
+    """
+    数据库中的一条元数据记录。
+    tags、relations和meta保留数据库中的原始值，首次访问时才解码并缓存解码结果，只读取pid等标量字段时没有解码开销。
+    使用__slots__，每条记录不再附带一个字典。同时支持record.pid和record["pid"]两种访问方式，可以直接替代原先的dict。
+    """
+    __slots__ = ('id', 'source', 'pid', 'status_index', 'folder', 'filename', 'create_time', 'analyse_time',
+                 '_tags', '_tags_raw', '_dictionary', '_relations', '_relations_raw', '_meta', '_meta_raw')
+
+    fields = ('id', 'source', 'pid', 'status', 'folder', 'filename', 'tags', 'relations', 'meta', 'create_time', 'analyse_time')
+
+    def __init__(self, dictionary: TagDictionary, meta_id, source, pid, status_index, folder, filename, tags_json, relations_raw, meta_raw,
+                 create_time, analyse_time, tag_ids, tag_counts):
+        self.id = meta_id
+        self.source = source
+        self.pid = pid
+        self.status_index = status_index
+        self.folder = folder
+        self.filename = filename
+        self.create_time = create_time
+        self.analyse_time = analyse_time
+        self._tags, self._tags_raw, self._dictionary = None, (tag_ids, tag_counts, tags_json), dictionary
+        self._relations, self._relations_raw = None, relations_raw
+        self._meta, self._meta_raw = None, meta_raw
+
+    @property
+    def status(self):
+        return index_to_status(self.status_index)
+
+    @property
+    def tags(self):
+        if self._tags_raw is not None:
+            self._tags, self._tags_raw, self._dictionary = self._dictionary.decode(*self._tags_raw), None, None
+        return self._tags
+
+    @property
+    def relations(self):
+        if self._relations_raw is not None:
+            self._relations, self._relations_raw = json.loads(self._relations_raw), None
+        return self._relations
+
+    @property
+    def meta(self):
+        if self._meta_raw is not None:
+            self._meta, self._meta_raw = json.loads(self._meta_raw), None
+        return self._meta
+
+    def __getitem__(self, key: str):
+        if key not in MetaRecord.fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in MetaRecord.fields else default
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in MetaRecord.fields}
+
+    def __repr__(self):
+        return "MetaRecord(%s, %s)" % (self.source, self.pid)
+
+
 class Database:
+    # 常驻进程中共享的连接: 真实路径 -> [连接, tag字典, data_version]。为None时每个实例各自打开连接
+    __shared: dict or None = None
+
     def __init__(self, path):
-        self.__conn = sqlite3.connect(path)
-        self.__initialize()
+        if Database.__shared is None:
+            self.__conn = connect(path)
+            self.__dictionary = TagDictionary(self.__conn)
+            self.__initialize()
+            return
+        shared = Database.__shared.get(os.path.realpath(path))
+        if shared is None:
+            self.__conn = connect(path)
+            self.__dictionary = TagDictionary(self.__conn)
+            self.__initialize()
+            shared = [self.__conn, self.__dictionary, self.__data_version()]
+            Database.__shared[os.path.realpath(path)] = shared
+        else:
+            self.__conn, self.__dictionary = shared[0], shared[1]
+            # 其他进程修改过数据库时，tag字典中可能有已被删除后重新分配的id，需要重新加载
+            data_version = self.__data_version()
+            if data_version != shared[2]:
+                self.__dictionary.reset()
+                shared[2] = data_version
+
+    @staticmethod
+    def share_connections():
+        """
+        在常驻进程中启用连接共享。此后打开同一数据库文件的Database实例共用一个连接和tag字典，close不再关闭连接。
+        """
+        if Database.__shared is None:
+            Database.__shared = dict()
+
+    @staticmethod
+    def rollback_shared_connections():
+        """
+        回滚共享连接上未提交的事务。常驻进程在每个命令结束后调用，中途失败的命令不会把半个事务留给下一个命令。
+        """
+        for (conn, _, _) in (Database.__shared or {}).values():
+            if conn.in_transaction:
+                conn.rollback()
+
+    def __data_version(self):
+        return self.__conn.execute('PRAGMA data_version').fetchone()[0]
 
     def __initialize(self):
         cursor = self.__conn.cursor()
@@ -46,13 +160,185 @@ class Database:
             create_time TIMESTAMP NOT NULL,
             analyse_time TIMESTAMP NULL DEFAULT NULL
         )''')
+        self.__add_columns(cursor, 'meta', [
+            ('format', 'VARCHAR(8) NULL'),
+            ('width', 'INTEGER NULL'),
+            ('height', 'INTEGER NULL'),
+            ('file_size', 'INTEGER NULL'),
+            ('tag_ids', 'BLOB NULL'),
+            ('tag_counts', 'TEXT NULL'),
+            ('row_version', 'INTEGER NOT NULL DEFAULT 0'),
+            ('delete_time', 'TIMESTAMP NULL')
+        ])
         cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS meta_source_pid ON meta(source, pid)')
         cursor.execute('CREATE INDEX IF NOT EXISTS meta_analyse_status ON meta(source, status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS meta_format_size ON meta(format, width, height)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS meta_folder_file_size ON meta(folder, file_size)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS meta_folder_filename ON meta(folder, filename)')
+        # 排序用的时间索引只包含未删除的记录，查询以NOT deleted过滤时才能使用。
+        # 不能把deleted作为索引的首列: 那样SQLite会选择它来过滤deleted，放弃按id主键和meta_tag子查询的查找
+        cursor.execute('DROP INDEX IF EXISTS meta_deleted_create_time')
+        cursor.execute('DROP INDEX IF EXISTS meta_deleted_analyse_time')
+        cursor.execute('CREATE INDEX IF NOT EXISTS meta_live_create_time ON meta(create_time) WHERE NOT deleted')
+        # analyse_time可为NULL，排序键中带有"是否为NULL"一项，升序和降序各需一个与排序键一致的索引
+        cursor.execute('CREATE INDEX IF NOT EXISTS meta_live_analyse_time ON meta(analyse_time IS NULL, analyse_time) WHERE NOT deleted')
+        cursor.execute('CREATE INDEX IF NOT EXISTS meta_live_analyse_time_desc ON meta(analyse_time IS NULL, analyse_time DESC, id DESC) WHERE NOT deleted')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS image_hash(
+            folder TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL,
+            dhash INTEGER NULL,
+            phash INTEGER NULL,
+            PRIMARY KEY (folder, filename)
+        )''')
+        tag_stats_exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tag_stats'").fetchone() is not None
+        cursor.execute('''CREATE TABLE IF NOT EXISTS tag_stats(
+            source VARCHAR(16) NOT NULL,
+            type VARCHAR(16) NOT NULL,
+            name TEXT NOT NULL,
+            title TEXT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (source, type, name)
+        )''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS tag_stats_name ON tag_stats(name)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS tag_stats_source_type_count ON tag_stats(source, type, count)')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS tag_type_stats(
+            source VARCHAR(16) NOT NULL,
+            type VARCHAR(16) NOT NULL,
+            records INTEGER NOT NULL,
+            PRIMARY KEY (source, type)
+        )''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS meta_md5 ON meta(json_extract(meta, '$.md5'))")
+        tag_index_exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meta_tag'").fetchone() is not None
+        cursor.execute('''CREATE TABLE IF NOT EXISTS tag(
+            id INTEGER PRIMARY KEY,
+            type VARCHAR(16) NOT NULL,
+            name TEXT NOT NULL,
+            title TEXT NULL
+        )''')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS tag_type_name ON tag(type, name)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS tag_name ON tag(name)')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS meta_tag(
+            tag_id INTEGER NOT NULL,
+            meta_id INTEGER NOT NULL,
+            PRIMARY KEY (tag_id, meta_id)
+        ) WITHOUT ROWID''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS meta_tag_meta ON meta_tag(meta_id)')
+        fts_exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meta_fts'").fetchone() is not None
+        if not fts_exists:
+            # trigram分词支持任意子串匹配，对没有空格分词的日文标题同样有效；旧版本SQLite不支持时退回unicode61
+            try:
+                cursor.execute("CREATE VIRTUAL TABLE meta_fts USING fts5(names, titles, pools, tokenize = 'trigram')")
+            except sqlite3.OperationalError:
+                cursor.execute("CREATE VIRTUAL TABLE meta_fts USING fts5(names, titles, pools, tokenize = 'unicode61')")
+        relation_exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'relation'").fetchone() is not None
+        cursor.execute('''CREATE TABLE IF NOT EXISTS relation(
+            meta_id INTEGER NOT NULL,
+            kind VARCHAR(8) NOT NULL,
+            target_id VARCHAR(16) NOT NULL,
+            PRIMARY KEY (meta_id, kind, target_id)
+        ) WITHOUT ROWID''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS relation_kind_target ON relation(kind, target_id)')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS pool(
+            source VARCHAR(16) NOT NULL,
+            id VARCHAR(16) NOT NULL,
+            name TEXT NULL,
+            name_ja TEXT NULL,
+            PRIMARY KEY (source, id)
+        )''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS pool_name ON pool(name)')
+        # 行版本号: 每次插入或修改导出相关的列时，从全局计数器取一个新的版本号写入该行，增量导出据此找出变化的记录
+        cursor.execute('CREATE INDEX IF NOT EXISTS meta_row_version ON meta(row_version)')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS meta_version(
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            value INTEGER NOT NULL
+        )''')
+        cursor.execute('INSERT OR IGNORE INTO meta_version(id, value) VALUES (1, 0)')
+        cursor.execute('''CREATE TRIGGER IF NOT EXISTS meta_insert_version AFTER INSERT ON meta BEGIN
+            UPDATE meta_version SET value = value + 1 WHERE id = 1;
+            UPDATE meta SET row_version = (SELECT value FROM meta_version WHERE id = 1) WHERE id = NEW.id;
+        END''')
+        # tag_ids和tag_counts不在触发列中: 单独改写它们的只有migrate_compact_tags，它只改变tags的编码而不改变内容，
+        # 不应让增量导出重新导出整个库。修改tags内容的write_metadata总是同时写入status和relations
+        update_trigger = '''CREATE TRIGGER meta_update_version
+        AFTER UPDATE OF source, pid, status, folder, filename, relations, deleted ON meta BEGIN
+            UPDATE meta_version SET value = value + 1 WHERE id = 1;
+            UPDATE meta SET row_version = (SELECT value FROM meta_version WHERE id = 1) WHERE id = NEW.id;
+        END'''
+        existing_trigger = cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'meta_update_version'").fetchone()
+        if existing_trigger is None or existing_trigger[0] != update_trigger:
+            cursor.execute('DROP TRIGGER IF EXISTS meta_update_version')
+            cursor.execute(update_trigger)
+        # 已写入数据库的日志计划。计划的记录与计划id在同一事务中写入，恢复中断的计划时据此判断记录是否已经提交
+        cursor.execute('''CREATE TABLE IF NOT EXISTS applied_plan(
+            id TEXT PRIMARY KEY,
+            apply_time TIMESTAMP NOT NULL
+        )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS export_watermark(
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            update_time TIMESTAMP NOT NULL
+        )''')
+        # 由compact移出meta表的已删除记录。tags以解码后的JSON保存，不依赖tag字典。
+        # 归档表有自己的id，meta_id是记录在meta表中的原id
+        archive_columns = [name for (_, name, _, _, _, _) in cursor.execute('PRAGMA table_info(meta_archive)').fetchall()]
+        legacy_archive = len(archive_columns) > 0 and 'meta_id' not in archive_columns
+        if legacy_archive:
+            cursor.execute('ALTER TABLE meta_archive RENAME TO meta_archive_legacy')
+            cursor.execute('DROP INDEX IF EXISTS meta_archive_source_pid')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS meta_archive(
+            id INTEGER PRIMARY KEY,
+            meta_id INTEGER NOT NULL,
+            status TINYINT NOT NULL,
+            folder TEXT NULL,
+            filename TEXT NOT NULL,
+            source VARCHAR(16) NOT NULL,
+            pid VARCHAR(16) NOT NULL,
+            tags TEXT NULL,
+            relations TEXT NULL,
+            meta TEXT NULL,
+            create_time TIMESTAMP NOT NULL,
+            analyse_time TIMESTAMP NULL,
+            format VARCHAR(8) NULL,
+            width INTEGER NULL,
+            height INTEGER NULL,
+            file_size INTEGER NULL,
+            delete_time TIMESTAMP NULL,
+            archive_time TIMESTAMP NOT NULL
+        )''')
+        if legacy_archive:
+            cursor.execute('INSERT INTO meta_archive(meta_id, %s) SELECT id, %s FROM meta_archive_legacy' % (self.__archive_columns, self.__archive_columns))
+            cursor.execute('DROP TABLE meta_archive_legacy')
+        cursor.execute('CREATE INDEX IF NOT EXISTS meta_archive_source_pid ON meta_archive(source, pid)')
         cursor.close()
         self.__conn.commit()
+        if not tag_stats_exists:
+            self.rebuild_tag_stats()
+        if not tag_index_exists:
+            self.rebuild_tag_index()
+        if not fts_exists:
+            self.rebuild_fts()
+        if not relation_exists:
+            self.rebuild_relations()
+
+    @staticmethod
+    def __add_columns(cursor, table: str, columns: list[(str, str)]):
+        """
+        为已存在的旧表补充新增的列。
+        """
+        existing = set(name for (_, name, _, _, _, _) in cursor.execute('PRAGMA table_info(%s)' % (table,)).fetchall())
+        for (name, definition) in columns:
+            if name not in existing:
+                cursor.execute('ALTER TABLE %s ADD COLUMN %s %s' % (table, name, definition))
 
     def close(self):
-        self.__conn.close()
+        if Database.__shared is None:
+            self.__conn.close()
+
+    @property
+    def tag_dictionary(self):
+        return self.__dictionary
 
     def cursor(self):
         return self.__conn.cursor()
@@ -67,32 +353,183 @@ class Database:
         finally:
             cursor.close()
 
+    def query_basic_many(self, keys: list[(str, str)]):
+        """
+        批量查询多个(source, pid)的存储位置。
+        :return: dict[(str, str), (str, str)] 已存在的项，{(source, pid): (folder, filename)}
+        """
+        ret = dict()
+        cursor = self.__conn.cursor()
+        try:
+            for i in range(0, len(keys), 400):
+                batch = keys[i:i + 400]
+                result = cursor.execute('SELECT source, pid, folder, filename FROM meta WHERE (source, pid) IN (VALUES ' +
+                                        ', '.join(['(?, ?)'] * len(batch)) + ')', [v for key in batch for v in key]).fetchall()
+                for (source, pid, folder, filename) in result:
+                    ret[(source, pid)] = (folder, filename)
+            return ret
+        finally:
+            cursor.close()
+
     def query_one(self, source, pid):
         cursor = self.__conn.cursor()
         try:
-            result = cursor.execute('SELECT status, folder, filename, tags, relations, meta, create_time, analyse_time '
-                                    'FROM meta WHERE source = ? AND pid = ?', (source, pid)).fetchone()
+            result = cursor.execute('SELECT ' + record_columns + ' FROM meta WHERE source = ? AND pid = ?', (source, pid)).fetchone()
             if result is None:
                 return None
-            status, folder, filename, tags, relations, meta, create_time, analyse_time = result
-            return {
-                'source': source,
-                'pid': pid,
-                'status': index_to_status(status),
-                'folder': folder,
-                'filename': filename,
-                'tags': json.loads(tags) if tags is not None else None,
-                'relations': json.loads(relations) if relations is not None else None,
-                'meta': json.load(meta) if meta is not None else None,
-                'create_time': create_time,
-                'analyse_time': analyse_time
-            }
+            return MetaRecord(self.__dictionary, *result)
         finally:
             cursor.close()
 
     def query_list(self, folder=None, filename=None, source_in=None, status_in=None,
-                   create_from=None, analyse_from=None, order=None, limit=None):
-        sql = 'SELECT source, pid, status, folder, filename, tags, relations, meta, create_time, analyse_time FROM meta'
+                   create_from=None, analyse_from=None, order=None, limit=None, expression=None, after=None):
+        """
+        查询符合条件的记录列表。
+        :param order: 排序项列表，只能使用sortable_columns中的列，前缀-表示降序
+        :param expression: 查询表达式，参见compile_expression
+        :param after: 上一页给出的续页token
+        """
+        return self.query_page(folder, filename, source_in, status_in, create_from, analyse_from, order, limit, expression, after)[0]
+
+    def query_page(self, folder=None, filename=None, source_in=None, status_in=None,
+                   create_from=None, analyse_from=None, order=None, limit=None, expression=None, after=None):
+        """
+        以键集分页查询一页记录。续页条件直接定位到上一页最后一条记录的排序键之后，不需要跳过前面的记录，
+        因此翻页的开销只与页大小有关。参数同query_list。
+        :return: (list[MetaRecord], str or None) 记录列表，和下一页的续页token。没有下一页时为None
+        """
+        sql, parameters, key_count = self.__list_sql(folder, filename, source_in, status_in, create_from, analyse_from, order, limit, expression, after)
+        cursor = self.__conn.cursor()
+        try:
+            result = cursor.execute(sql, parameters).fetchall()
+            ret = [MetaRecord(self.__dictionary, *res[:13]) for res in result]
+            token = None
+            if limit is not None and len(result) >= limit > 0:
+                token = encode_token(list(order or []), list(result[-1][13:13 + key_count]))
+            return ret, token
+        finally:
+            cursor.close()
+
+    def iter_list(self, folder=None, filename=None, source_in=None, status_in=None,
+                  create_from=None, analyse_from=None, order=None, limit=None, expression=None, version_range=None):
+        """
+        与query_list相同，但逐行从游标中产出记录而不是一次取出全部结果，适合遍历大量记录。参数同query_list。
+        :param version_range: (int, int) 仅列出行版本号在(下界, 上界]之间的记录
+        :return: Iterator[MetaRecord]
+        """
+        sql, parameters, _ = self.__list_sql(folder, filename, source_in, status_in, create_from, analyse_from, order, limit, expression, None,
+                                             version_range=version_range)
+        cursor = self.__conn.cursor()
+        try:
+            for res in cursor.execute(sql, parameters):
+                yield MetaRecord(self.__dictionary, *res[:13])
+        finally:
+            cursor.close()
+
+    def iter_values(self, columns: str, folder=None, filename=None, source_in=None, status_in=None,
+                    create_from=None, analyse_from=None, order=None, limit=None, expression=None, version_range=None):
+        """
+        以与iter_list相同的条件逐行查询，但只取出给定的SQL表达式而不构造记录。
+        用于让SQLite直接产出最终结果(例如以JSON1函数拼装的JSON文本)，不在Python中逐字段解码。
+        :param columns: SELECT的列表达式，可以引用meta表的列
+        :param version_range: 参见iter_list
+        :return: Iterator[tuple]
+        """
+        sql, parameters, _ = self.__list_sql(folder, filename, source_in, status_in, create_from, analyse_from, order, limit, expression, None,
+                                             columns, version_range)
+        cursor = self.__conn.cursor()
+        try:
+            for res in cursor.execute(sql, parameters):
+                yield res
+        finally:
+            cursor.close()
+
+    def iter_tombstones(self, version_range: (int, int), folder=None, source_in=None, status_in=None):
+        """
+        列出行版本号在(下界, 上界]之间、但不在同样条件的增量中导出的记录: 已被标记为删除的记录，
+        以及移到了其他存档文件夹或状态不再符合条件的记录。下游之前可能导出过它们，因此需要墓碑。
+        从未导出过的记录也可能得到墓碑，删除一个不存在的记录对下游没有影响。
+        来源是记录标识的一部分，不会改变，因此按来源直接过滤。
+        :return: Iterator[(str, str)] (source, pid)
+        """
+        sql = 'SELECT source, pid FROM meta WHERE row_version > ? AND row_version <= ?'
+        parameters = list(version_range)
+        if source_in is not None and len(source_in) > 0:
+            sql += ' AND source IN (' + ', '.join(['?'] * len(source_in)) + ')'
+            parameters += source_in
+        exported = ['NOT deleted']
+        if folder is not None:
+            exported.append('folder LIKE ?')
+            parameters.append(folder)
+        if status_in is not None and len(status_in) > 0:
+            exported.append('status IN (' + ', '.join(['?'] * len(status_in)) + ')')
+            parameters += [str(status_to_index(i)) for i in status_in]
+        # folder为NULL时LIKE的结果为NULL，同样视为不符合条件
+        sql += ' AND NOT COALESCE(' + ' AND '.join(exported) + ', FALSE)'
+        cursor = self.__conn.cursor()
+        try:
+            for res in cursor.execute(sql + ' ORDER BY row_version', parameters):
+                yield res
+        finally:
+            cursor.close()
+
+    def query_row_version(self):
+        """
+        :return: int 当前最新的行版本号
+        """
+        cursor = self.__conn.cursor()
+        try:
+            return cursor.execute('SELECT value FROM meta_version WHERE id = 1').fetchone()[0]
+        finally:
+            cursor.close()
+
+    def query_export_watermark(self, name: str):
+        """
+        :return: int 指定增量导出上次导出到的行版本号。从未导出时为-1，此时增量包括全部记录
+        """
+        cursor = self.__conn.cursor()
+        try:
+            result = cursor.execute('SELECT version FROM export_watermark WHERE name = ?', (name,)).fetchone()
+            return result[0] if result is not None else -1
+        finally:
+            cursor.close()
+
+    def write_export_watermark(self, name: str, version: int):
+        cursor = self.__conn.cursor()
+        try:
+            cursor.execute('INSERT INTO export_watermark(name, version, update_time) VALUES (?, ?, ?) '
+                           'ON CONFLICT(name) DO UPDATE SET version = excluded.version, update_time = excluded.update_time',
+                           (name, version, datetime.datetime.now()))
+        finally:
+            cursor.close()
+            self.__conn.commit()
+
+    def explain_list(self, folder=None, filename=None, source_in=None, status_in=None,
+                     create_from=None, analyse_from=None, order=None, limit=None, expression=None, after=None):
+        """
+        给出query_list对应的SQL和SQLite选择的查询计划。
+        :return: (str, list[str]) SQL语句，和缩进排列的查询计划行
+        """
+        sql, parameters, _ = self.__list_sql(folder, filename, source_in, status_in, create_from, analyse_from, order, limit, expression, after)
+        cursor = self.__conn.cursor()
+        try:
+            depth = dict()
+            lines = []
+            for (node_id, parent_id, _, detail) in cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall():
+                depth[node_id] = depth.get(parent_id, -1) + 1
+                lines.append('  ' * depth[node_id] + detail)
+            return sql, lines
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def __list_sql(folder, filename, source_in, status_in, create_from, analyse_from, order, limit, expression, after,
+                   columns=record_columns, version_range=None):
+        """
+        :return: (str, list, int) SQL语句、参数，以及附加在结果列末尾的排序键数量
+        """
+        keys = compile_order(list(order or []))
+        sql = 'SELECT ' + columns + ', ' + ', '.join(column for (column, _, _) in keys) + ' FROM meta'
         parameters = []
 
         wheres = []
@@ -114,44 +551,34 @@ class Database:
         if analyse_from is not None:
             wheres.append('analyse_time > ?')
             parameters.append(analyse_from)
-        wheres.append('(NOT deleted)')
-        if len(wheres) > 0:
-            sql += ' WHERE ' + ' AND '.join(wheres)
-
-        if order is not None and len(order) > 0:
-            orders = []
-            for o in order:
-                if o.startswith('-'):
-                    orders.append(o[1:].replace('-', '_') + ' DESC')
-                else:
-                    orders.append(o.replace('-', '_'))
-            sql += ' ORDER BY ' + ', '.join(orders)
+        if version_range is not None:
+            wheres.append('row_version > ? AND row_version <= ?')
+            parameters += list(version_range)
+        if expression is not None and expression.strip() != '':
+            condition, condition_parameters = compile_expression(expression)
+            wheres.append('(%s)' % (condition,))
+            parameters += condition_parameters
+        if after is not None:
+            condition, condition_parameters = compile_keyset(keys, decode_token(after, list(order or [])))
+            wheres.append(condition)
+            parameters += condition_parameters
+        # 必须与部分索引的条件写法一致
+        wheres.append('NOT deleted')
+        sql += ' WHERE ' + ' AND '.join(wheres)
+        sql += ' ORDER BY ' + ', '.join('%s DESC' % (column,) if descending else column for (column, descending, _) in keys)
 
         if limit is not None:
             sql += ' LIMIT ?'
             parameters.append(limit)
+        return sql, parameters, len(keys)
 
-        cursor = self.__conn.cursor()
-        try:
-            result = cursor.execute(sql, parameters).fetchall()
-            ret = []
-            for res in result:
-                source, pid, status, folder, filename, tags, relations, meta, create_time, analyse_time = res
-                ret.append({
-                    'source': source,
-                    'pid': pid,
-                    'status': index_to_status(status),
-                    'folder': folder,
-                    'filename': filename,
-                    'tags': json.loads(tags) if tags is not None else None,
-                    'relations': json.loads(relations) if relations is not None else None,
-                    'meta': json.loads(meta) if meta is not None else None,
-                    'create_time': create_time,
-                    'analyse_time': analyse_time
-                })
-            return ret
-        finally:
-            cursor.close()
+    def query_fingerprint(self):
+        """
+        生成一个反映记录变化的指纹，用于判断派生缓存是否过期。
+        插入记录，以及修改tags、deleted等列时都会从全局计数器取新的行版本号，因此以计数器的当前值为指纹。
+        不使用MAX(row_version): compact移出版本号最大的已删除记录后，它会退回到删除之前的值。
+        """
+        return "v%s" % (self.query_row_version(),)
 
     def query_folders(self):
         cursor = self.__conn.cursor()
@@ -169,37 +596,94 @@ class Database:
         finally:
             cursor.close()
 
+    def iter_folder_filenames(self):
+        """
+        以一次按(folder, filename)索引顺序的扫描，列出所有未删除记录的文件。
+        :return: Iterator[(str, list[str])] 每个文件夹及其下的文件名列表
+        """
+        cursor = self.__conn.cursor()
+        try:
+            for (folder, rows) in groupby(cursor.execute('SELECT folder, filename FROM meta WHERE folder IS NOT NULL AND NOT deleted ORDER BY folder, filename'),
+                                          key=lambda row: row[0]):
+                yield folder, [filename for (_, filename) in rows]
+        finally:
+            cursor.close()
+
     def insert(self, source, pid, folder: str = None, filename: str = None, metadata: dict[str, str] = None, replace=True):
         cursor = self.__conn.cursor()
         try:
-            result = cursor.execute('SELECT id, meta FROM meta WHERE source = ? AND pid = ? LIMIT 1', (source, pid)).fetchone()
-            if result is not None:
-                if replace:
-                    (_, old_metadata) = result
-                    if metadata is not None and len(metadata) > 0:
-                        new_metadata = json.loads(old_metadata) if old_metadata is not None else {}
-                        for (k, v) in metadata.items():
-                            new_metadata[k] = v
-                        cursor.execute(
-                            'UPDATE meta SET folder = ?, filename = ?, create_time = ?, meta = ?, deleted = FALSE WHERE source = ? AND pid = ?',
-                            (folder, filename, datetime.datetime.now(), json.dumps(new_metadata), source, pid))
-                    else:
-                        cursor.execute(
-                            'UPDATE meta SET folder = ?, filename = ?, create_time = ?, deleted = FALSE WHERE source = ? AND pid = ?',
-                            (folder, filename, datetime.datetime.now(), source, pid))
-                return False
-            else:
-                cursor.execute('INSERT INTO meta(status, folder, filename, source, pid, tags, relations, meta, create_time)VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                               (STATUS.NOT_ANALYSED, folder, filename, source, pid,
-                                None, None, json.dumps(metadata) if metadata is not None else None, datetime.datetime.now()))
-                return True
+            return self.__insert(cursor, source, pid, folder, filename, metadata, replace)
+        finally:
+            cursor.close()
+            self.__conn.commit()
+
+    def insert_many(self, records: list[(str, str, str, str, dict[str, str])], replace=True, plan_id: str = None):
+        """
+        在同一个事务中批量写入(source, pid, folder, filename, metadata)记录。
+        :param plan_id: 记录所属的日志计划。计划id与记录在同一事务中写入，参见query_plan_applied
+        """
+        cursor = self.__conn.cursor()
+        try:
+            result = [self.__insert(cursor, source, pid, folder, filename, metadata, replace) for (source, pid, folder, filename, metadata) in records]
+            if plan_id is not None:
+                cursor.execute('INSERT OR IGNORE INTO applied_plan(id, apply_time) VALUES (?, ?)', (plan_id, datetime.datetime.now()))
+            return result
+        finally:
+            cursor.close()
+            self.__conn.commit()
+
+    def query_plan_applied(self, plan_id: str):
+        """
+        :return: bool 指定日志计划的记录是否已经提交到数据库
+        """
+        cursor = self.__conn.cursor()
+        try:
+            return cursor.execute('SELECT 1 FROM applied_plan WHERE id = ?', (plan_id,)).fetchone() is not None
+        finally:
+            cursor.close()
+
+    def forget_plan(self, plan_id: str):
+        """
+        日志计划完成并移除后，删除它的提交记录。
+        """
+        cursor = self.__conn.cursor()
+        try:
+            cursor.execute('DELETE FROM applied_plan WHERE id = ?', (plan_id,))
         finally:
             cursor.close()
             self.__conn.commit()
 
+    def __insert(self, cursor, source, pid, folder, filename, metadata, replace):
+        result = cursor.execute('SELECT id, meta, deleted, tag_ids, tag_counts, tags FROM meta WHERE source = ? AND pid = ? LIMIT 1', (source, pid)).fetchone()
+        if result is not None:
+            if replace:
+                (_, old_metadata, deleted, tag_ids, tag_counts, tags) = result
+                if deleted:
+                    self.__update_tag_stats(cursor, source, self.__dictionary.decode(tag_ids, tag_counts, tags), 1)
+                if metadata is not None and len(metadata) > 0:
+                    new_metadata = json.loads(old_metadata) if old_metadata is not None else {}
+                    for (k, v) in metadata.items():
+                        new_metadata[k] = v
+                    cursor.execute(
+                        'UPDATE meta SET folder = ?, filename = ?, create_time = ?, meta = ?, deleted = FALSE, '
+                        'format = NULL, width = NULL, height = NULL, file_size = NULL WHERE source = ? AND pid = ?',
+                        (folder, filename, datetime.datetime.now(), json.dumps(new_metadata), source, pid))
+                else:
+                    cursor.execute(
+                        'UPDATE meta SET folder = ?, filename = ?, create_time = ?, deleted = FALSE, '
+                        'format = NULL, width = NULL, height = NULL, file_size = NULL WHERE source = ? AND pid = ?',
+                        (folder, filename, datetime.datetime.now(), source, pid))
+            return False
+        else:
+            cursor.execute('INSERT INTO meta(status, folder, filename, source, pid, tags, relations, meta, create_time)VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           (STATUS.NOT_ANALYSED, folder, filename, source, pid,
+                            None, None, json.dumps(metadata) if metadata is not None else None, datetime.datetime.now()))
+            return True
+
     def write_only_meta(self, source, pid, meta):
         cursor = self.__conn.cursor()
         try:
+            self.__revive(cursor, source, pid)
             cursor.execute('UPDATE meta SET meta = ?, analyse_time = ?, deleted = FALSE WHERE source = ? AND pid = ?',
                            (json.dumps(meta) if meta is not None else None, datetime.datetime.now(), source, pid))
         finally:
@@ -209,22 +693,149 @@ class Database:
     def write_metadata(self, source, pid, tags, relations, meta):
         cursor = self.__conn.cursor()
         try:
-            cursor.execute('UPDATE meta SET status = ?, tags = ?, relations = ?, meta = ?, analyse_time = ?, deleted = FALSE '
+            old = cursor.execute('SELECT id, tag_ids, tag_counts, tags, deleted FROM meta WHERE source = ? AND pid = ?', (source, pid)).fetchone()
+            if old is None:
+                return
+            (meta_id, old_tag_ids, old_tag_counts, old_tags, deleted) = old
+            tags = normalize_tags(tags)
+            if not deleted:
+                self.__update_tag_stats(cursor, source, self.__dictionary.decode(old_tag_ids, old_tag_counts, old_tags), -1)
+            ids, tag_ids, tag_counts = self.__dictionary.encode(cursor, tags)
+            cursor.execute('UPDATE meta SET status = ?, tags = NULL, tag_ids = ?, tag_counts = ?, relations = ?, meta = ?, analyse_time = ?, deleted = FALSE '
                            'WHERE source = ? AND pid = ?',
                            (STATUS.ANALYSED,
-                            json.dumps(tags) if tags is not None else None,
+                            tag_ids, tag_counts,
                             json.dumps(relations) if relations is not None else None,
                             json.dumps(meta) if meta is not None else None,
                             datetime.datetime.now(),
                             source, pid))
+            self.__update_tag_stats(cursor, source, tags, 1)
+            self.__write_tag_index(cursor, meta_id, ids)
+            self.__write_fts(cursor, meta_id, tags, relations)
+            self.__write_relations(cursor, meta_id, source, relations)
         finally:
             cursor.close()
             self.__conn.commit()
 
     def mark_deleted(self, folder, filename):
+        return self.mark_deleted_many([(folder, filename)])
+
+    def mark_deleted_many(self, files: list[(str, str)]):
+        """
+        在同一个事务中将一批文件的记录标记为已删除，并记录删除时间。
+        文件列表先写入临时表，再以一次联结查询取出需要扣减tag统计的记录，和一条UPDATE完成标记。
+        :param files: (folder, filename)列表
+        :return: int 新标记的记录数
+        """
+        if len(files) <= 0:
+            return 0
+        cursor = self.__conn.cursor()
+        try:
+            cursor.execute('CREATE TEMP TABLE IF NOT EXISTS deleted_file(folder TEXT NOT NULL, filename TEXT NOT NULL)')
+            cursor.execute('DELETE FROM temp.deleted_file')
+            cursor.executemany('INSERT INTO temp.deleted_file(folder, filename) VALUES (?, ?)', files)
+            records = cursor.execute('SELECT meta.source, meta.tag_ids, meta.tag_counts, meta.tags FROM temp.deleted_file AS d '
+                                     'JOIN meta ON meta.folder = d.folder AND meta.filename = d.filename WHERE NOT meta.deleted').fetchall()
+            for (source, tag_ids, tag_counts, tags) in records:
+                self.__update_tag_stats(cursor, source, self.__dictionary.decode(tag_ids, tag_counts, tags), -1)
+            cursor.execute('UPDATE meta SET deleted = TRUE, delete_time = ? '
+                           'WHERE NOT deleted AND (folder, filename) IN (SELECT folder, filename FROM temp.deleted_file)', (datetime.datetime.now(),))
+            cursor.execute('DELETE FROM temp.deleted_file')
+            return len(records)
+        finally:
+            cursor.close()
+            self.__conn.commit()
+
+    def compact_deleted(self, before: datetime.datetime, purge: bool = False, dry_run: bool = False):
+        """
+        将删除时间早于before的记录移出meta表，并移除它们在tag索引、全文索引和关系索引中的行。
+        启用本功能之前就已删除、没有删除时间的记录同样视为足够早。
+        增量导出还没有送达的墓碑会被保留，直到所有增量导出的水位都越过它们。
+        id最大的记录总是被保留：meta.id不是AUTOINCREMENT，新记录的id取当前最大id加一，
+        保留它可以保证被移出的id不会分配给新记录，续页token和各索引表中的id始终唯一。
+        :param before: 删除时间的上限
+        :param purge: 直接丢弃记录，而不是移入meta_archive表
+        :param dry_run: 只统计符合条件的记录数
+        :return: int 移出的记录数
+        """
+        condition = 'deleted AND (delete_time IS NULL OR delete_time < ?) ' \
+                    'AND row_version <= COALESCE((SELECT MIN(version) FROM export_watermark), row_version) ' \
+                    'AND id < (SELECT MAX(id) FROM meta)'
+        cursor = self.__conn.cursor()
+        try:
+            if dry_run:
+                return cursor.execute('SELECT COUNT(*) FROM meta WHERE ' + condition, (before,)).fetchone()[0]
+            records = cursor.execute('SELECT id, status, folder, filename, source, pid, tag_ids, tag_counts, tags, relations, meta, '
+                                     'create_time, analyse_time, format, width, height, file_size, delete_time FROM meta WHERE ' + condition, (before,)).fetchall()
+            if len(records) <= 0:
+                return 0
+            if not purge:
+                now = datetime.datetime.now()
+                cursor.executemany('INSERT INTO meta_archive(meta_id, ' + self.__archive_columns + ') '
+                                   'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                   ((meta_id, status, folder, filename, source, pid, self.__encode_archived_tags(self.__dictionary.decode(tag_ids, tag_counts, tags)),
+                                     relations, meta, create_time, analyse_time, fmt, width, height, file_size, delete_time, now)
+                                    for (meta_id, status, folder, filename, source, pid, tag_ids, tag_counts, tags, relations, meta,
+                                         create_time, analyse_time, fmt, width, height, file_size, delete_time) in records))
+            ids = [(record[0],) for record in records]
+            cursor.executemany('DELETE FROM meta_tag WHERE meta_id = ?', ids)
+            cursor.executemany('DELETE FROM meta_fts WHERE rowid = ?', ids)
+            cursor.executemany('DELETE FROM relation WHERE meta_id = ?', ids)
+            cursor.executemany('DELETE FROM meta WHERE id = ?', ids)
+            return len(records)
+        finally:
+            cursor.close()
+            self.__conn.commit()
+
+    # meta_archive中除id和meta_id之外的列
+    __archive_columns = 'status, folder, filename, source, pid, tags, relations, meta, create_time, analyse_time, format, width, height, file_size, delete_time, archive_time'
+
+    @staticmethod
+    def __encode_archived_tags(tags):
+        return json.dumps(tags, ensure_ascii=False) if tags is not None else None
+
+    def query_unprobed(self):
+        """
+        查询所有尚未探测文件信息的记录。
+        :return: list[(str, str, str, str)] (source, pid, folder, filename)列表
+        """
         cursor = self.__conn.cursor()
         try:
-            cursor.execute('UPDATE meta SET deleted = TRUE WHERE folder = ? AND filename = ?', (folder, filename))
+            return cursor.execute('SELECT source, pid, folder, filename FROM meta WHERE file_size IS NULL AND folder IS NOT NULL AND NOT deleted').fetchall()
+        finally:
+            cursor.close()
+
+    def write_probes(self, probes: list[(str, int, int, int, str, str)]):
+        """
+        批量写入文件探测结果。
+        :param probes: (format, width, height, file_size, source, pid)列表
+        """
+        cursor = self.__conn.cursor()
+        try:
+            cursor.executemany('UPDATE meta SET format = ?, width = ?, height = ?, file_size = ? WHERE source = ? AND pid = ?', probes)
+        finally:
+            cursor.close()
+            self.__conn.commit()
+
+    def query_image_hashes(self):
+        cursor = self.__conn.cursor()
+        try:
+            return cursor.execute('SELECT folder, filename, size, mtime, dhash, phash FROM image_hash').fetchall()
+        finally:
+            cursor.close()
+
+    def write_image_hashes(self, hashes: list[(str, str, int, int, int or None, int or None)]):
+        cursor = self.__conn.cursor()
+        try:
+            cursor.executemany('INSERT OR REPLACE INTO image_hash(folder, filename, size, mtime, dhash, phash) VALUES (?, ?, ?, ?, ?, ?)', hashes)
+        finally:
+            cursor.close()
+            self.__conn.commit()
+
+    def delete_image_hashes(self, files: list[(str, str)]):
+        cursor = self.__conn.cursor()
+        try:
+            cursor.executemany('DELETE FROM image_hash WHERE folder = ? AND filename = ?', files)
         finally:
             cursor.close()
             self.__conn.commit()
@@ -232,12 +843,409 @@ class Database:
     def write_error_status(self, source, pid):
         cursor = self.__conn.cursor()
         try:
+            self.__revive(cursor, source, pid)
             cursor.execute('UPDATE meta SET status = ?, analyse_time = ?, deleted = FALSE WHERE source = ? AND pid = ?',
                            (STATUS.ERROR, datetime.datetime.now(), source, pid))
         finally:
             cursor.close()
             self.__conn.commit()
 
+    def __revive(self, cursor, source, pid):
+        """
+        记录即将被取消删除标记时，将其tags重新计入统计。
+        """
+        result = cursor.execute('SELECT tag_ids, tag_counts, tags FROM meta WHERE source = ? AND pid = ? AND deleted', (source, pid)).fetchone()
+        if result is not None:
+            self.__update_tag_stats(cursor, source, self.__dictionary.decode(*result), 1)
+
+    @staticmethod
+    def __update_tag_stats(cursor, source, tags, delta: int):
+        """
+        将一条记录的tags以delta(1或-1)增量计入tag_stats和tag_type_stats。计数归零的行会被移除。
+        :param tags: 已解码的tag列表
+        """
+        if tags is None:
+            return
+        unique = dict()
+        for tag in tags:
+            key = (tag["type"], tag["name"])
+            if unique.get(key) is None:
+                unique[key] = tag.get("title")
+        # 类型"*"是带有tags的记录总数，用于计算没有某类型tag的记录数
+        types = set(tp for (tp, _) in unique.keys())
+        types.add('*')
+        cursor.executemany('INSERT INTO tag_stats(source, type, name, title, count) VALUES (?, ?, ?, ?, ?) '
+                           'ON CONFLICT(source, type, name) DO UPDATE SET count = count + excluded.count, title = COALESCE(title, excluded.title)',
+                           [(source, tp, name, title, delta) for ((tp, name), title) in unique.items()])
+        cursor.executemany('INSERT INTO tag_type_stats(source, type, records) VALUES (?, ?, ?) '
+                           'ON CONFLICT(source, type) DO UPDATE SET records = records + excluded.records',
+                           [(source, tp, delta) for tp in types])
+        if delta < 0:
+            cursor.executemany('DELETE FROM tag_stats WHERE source = ? AND type = ? AND name = ? AND count <= 0',
+                               [(source, tp, name) for (tp, name) in unique.keys()])
+            cursor.executemany('DELETE FROM tag_type_stats WHERE source = ? AND type = ? AND records <= 0',
+                               [(source, tp) for tp in types])
+
+    def rebuild_tag_stats(self):
+        """
+        全量扫描未删除记录的tags，重建tag_stats和tag_type_stats。
+        :return: int 扫描的记录数
+        """
+        counts, type_records = Counter(), Counter()
+        rows = 0
+        dictionary = self.__dictionary
+        cursor = self.__conn.cursor()
+        try:
+            for (source, ids) in self.iter_tag_ids(with_source=True):
+                rows += 1
+                counts.update((source, tag_id) for tag_id in set(ids))
+                type_records.update((source, tp) for tp in set(dictionary.get(tag_id)[0] for tag_id in ids).union(('*',)))
+
+            cursor.execute('DELETE FROM tag_stats')
+            cursor.execute('DELETE FROM tag_type_stats')
+            cursor.executemany('INSERT INTO tag_stats(source, type, name, title, count) VALUES (?, ?, ?, ?, ?)',
+                               ((source, *dictionary.get(tag_id), count) for ((source, tag_id), count) in counts.items()))
+            cursor.executemany('INSERT INTO tag_type_stats(source, type, records) VALUES (?, ?, ?)',
+                               ((*key, count) for (key, count) in type_records.items()))
+            return rows
+        finally:
+            cursor.close()
+            self.__conn.commit()
+
+    @staticmethod
+    def __write_tag_index(cursor, meta_id: int, ids):
+        """
+        以一条记录的新tag id列表替换其在meta_tag中的全部索引项。
+        """
+        cursor.execute('DELETE FROM meta_tag WHERE meta_id = ?', (meta_id,))
+        if len(ids) > 0:
+            cursor.executemany('INSERT INTO meta_tag(tag_id, meta_id) VALUES (?, ?)', [(tag_id, meta_id) for tag_id in set(ids)])
+
+    def rebuild_tag_index(self):
+        """
+        全量重建tag字典表和meta_tag索引。
+        :return: int 建立索引的记录数
+        """
+        rows = 0
+        cursor = self.__conn.cursor()
+        try:
+            cursor.execute('DELETE FROM meta_tag')
+            records = cursor.execute('SELECT id, tag_ids, tags FROM meta WHERE ' + has_tags_condition).fetchall()
+            for (meta_id, tag_ids, tags) in records:
+                rows += 1
+                self.__write_tag_index(cursor, meta_id, self.__dictionary.ids(cursor, tag_ids, tags))
+            # 已不被任何记录引用的tag不再保留
+            cursor.execute('DELETE FROM tag WHERE NOT EXISTS (SELECT 1 FROM meta_tag WHERE meta_tag.tag_id = tag.id)')
+            self.__dictionary.reset()
+            return rows
+        finally:
+            cursor.close()
+            self.__conn.commit()
+
+    @staticmethod
+    def __write_fts(cursor, meta_id: int, tags, relations):
+        """
+        以一条记录的tag名称、tag标题和pool名称替换其全文索引行。
+        """
+        cursor.execute('DELETE FROM meta_fts WHERE rowid = ?', (meta_id,))
+        tags = tags or []
+        pools = (relations or {}).get('pools') or []
+        if len(tags) > 0 or len(pools) > 0:
+            cursor.execute('INSERT INTO meta_fts(rowid, names, titles, pools) VALUES (?, ?, ?, ?)',
+                           (meta_id,
+                            '\n'.join(tag["name"] for tag in tags),
+                            '\n'.join(tag["title"] for tag in tags if tag.get("title")),
+                            '\n'.join(v for pool in pools for v in (pool.get("name"), pool.get("name_ja")) if v)))
+
+    def rebuild_fts(self):
+        """
+        全量重建全文索引表meta_fts。
+        :return: int 建立索引的记录数
+        """
+        rows = 0
+        cursor = self.__conn.cursor()
+        try:
+            cursor.execute('DELETE FROM meta_fts')
+            records = cursor.execute('SELECT id, tag_ids, tag_counts, tags, relations FROM meta WHERE ' + has_tags_condition + ' OR relations IS NOT NULL').fetchall()
+            for (meta_id, tag_ids, tag_counts, tags, relations_str) in records:
+                rows += 1
+                self.__write_fts(cursor, meta_id,
+                                 self.__dictionary.decode(tag_ids, tag_counts, tags),
+                                 json.loads(relations_str) if relations_str else None)
+            cursor.execute("INSERT INTO meta_fts(meta_fts) VALUES ('optimize')")
+            return rows
+        finally:
+            cursor.close()
+            self.__conn.commit()
+
+    @staticmethod
+    def __write_relations(cursor, meta_id: int, source: str, relations):
+        """
+        以一条记录的relations替换其在relation表中的全部边，并更新其中pool的名称。
+        relation表中的kind为parent、child或pool，target_id为同一来源下的pid或pool id。
+        """
+        cursor.execute('DELETE FROM relation WHERE meta_id = ?', (meta_id,))
+        if relations is None:
+            return
+        pools = relations.get('pools') or []
+        edges = [('parent', str(pid)) for pid in relations.get('parent') or []] + \
+                [('child', str(pid)) for pid in relations.get('children') or []] + \
+                [('pool', str(pool['id'])) for pool in pools]
+        cursor.executemany('INSERT OR IGNORE INTO relation(meta_id, kind, target_id) VALUES (?, ?, ?)',
+                           [(meta_id, kind, target_id) for (kind, target_id) in edges])
+        cursor.executemany('INSERT INTO pool(source, id, name, name_ja) VALUES (?, ?, ?, ?) '
+                           'ON CONFLICT(source, id) DO UPDATE SET name = COALESCE(excluded.name, name), name_ja = COALESCE(excluded.name_ja, name_ja)',
+                           [(source, str(pool['id']), pool.get('name'), pool.get('name_ja')) for pool in pools])
+
+    def rebuild_relations(self):
+        """
+        全量重建relation表和pool表。
+        :return: int 建立索引的记录数
+        """
+        rows = 0
+        cursor = self.__conn.cursor()
+        try:
+            cursor.execute('DELETE FROM relation')
+            cursor.execute('DELETE FROM pool')
+            records = cursor.execute('SELECT id, source, relations FROM meta WHERE relations IS NOT NULL').fetchall()
+            for (meta_id, source, relations_str) in records:
+                rows += 1
+                self.__write_relations(cursor, meta_id, source, json.loads(relations_str))
+            return rows
+        finally:
+            cursor.close()
+            self.__conn.commit()
+
+    def query_family(self, source: str, pid: str):
+        """
+        以递归CTE沿parent/child边查找一条记录所在的整个家族(连通分量)。每一步都经由meta(source, pid)唯一索引、
+        relation主键或relation(kind, target_id)索引展开，与数据库的总记录数无关。
+        :return: list[(str, str or None, str or None, bool or None)] (pid, folder, filename, deleted)列表。本地不存在的成员folder等为None
+        """
+        cursor = self.__conn.cursor()
+        try:
+            return cursor.execute('''WITH RECURSIVE family(pid) AS (
+                SELECT ?
+                UNION
+                SELECT relation.target_id FROM family
+                JOIN meta ON meta.source = ? AND meta.pid = family.pid
+                JOIN relation ON relation.meta_id = meta.id AND relation.kind IN ('parent', 'child')
+                UNION
+                SELECT meta.pid FROM family
+                JOIN relation ON relation.kind IN ('parent', 'child') AND relation.target_id = family.pid
+                JOIN meta ON meta.id = relation.meta_id AND meta.source = ?
+            )
+            SELECT family.pid, meta.folder, meta.filename, meta.deleted FROM family
+            LEFT JOIN meta ON meta.source = ? AND meta.pid = family.pid
+            ORDER BY family.pid''', (pid, source, source, source)).fetchall()
+        finally:
+            cursor.close()
+
+    def query_pools(self, source: str, pool: str):
+        """
+        按pool id或名称查找pool。名称可以使用*通配符。
+        :return: list[(str, str or None, str or None)] (id, name, name_ja)列表
+        """
+        cursor = self.__conn.cursor()
+        try:
+            result = cursor.execute('SELECT id, name, name_ja FROM pool WHERE source = ? AND id = ?', (source, pool)).fetchall()
+            if len(result) == 0:
+                result = cursor.execute('SELECT id, name, name_ja FROM pool WHERE source = ? AND (name GLOB ? OR name_ja GLOB ?) ORDER BY name',
+                                        (source, pool, pool)).fetchall()
+            return result
+        finally:
+            cursor.close()
+
+    def query_pool_members(self, source: str, pool_id: str):
+        """
+        查找pool在本地的全部成员。
+        :return: list[(str, str, str, bool)] (pid, folder, filename, deleted)列表。deleted的成员表示文件已不在本地
+        """
+        cursor = self.__conn.cursor()
+        try:
+            return cursor.execute('SELECT meta.pid, meta.folder, meta.filename, meta.deleted FROM relation '
+                                  'JOIN meta ON meta.id = relation.meta_id AND meta.source = ? '
+                                  'WHERE relation.kind = \'pool\' AND relation.target_id = ? ORDER BY meta.pid', (source, pool_id)).fetchall()
+        finally:
+            cursor.close()
+
+    def search_text(self, text: str, column: str = None, limit: int = 20):
+        """
+        在tag名称、tag标题和pool名称中全文检索。
+        :param text: 空格分隔的词均需命中；"..."表示短语；以*结尾表示前缀
+        :param column: 仅检索指定的列，names、titles或pools
+        :return: list[(str, str, str, str, str)] (source, pid, folder, filename, 命中片段)列表，按相关度排序
+        """
+        terms = fts_terms(text)
+        if any(len(word) < 3 for (word, _) in terms):
+            return self.__search_text_like(terms, column, limit)
+        query = fts_query(terms)
+        if column is not None:
+            query = '{%s} : (%s)' % (column, query)
+        cursor = self.__conn.cursor()
+        try:
+            return cursor.execute('SELECT meta.source, meta.pid, meta.folder, meta.filename, '
+                                  'snippet(meta_fts, -1, \'\033[1;31m\', \'\033[0m\', \'…\', 12) '
+                                  'FROM meta_fts JOIN meta ON meta.id = meta_fts.rowid '
+                                  'WHERE meta_fts MATCH ? AND NOT meta.deleted ORDER BY meta_fts.rank LIMIT ?', (query, limit)).fetchall()
+        finally:
+            cursor.close()
+
+    def __search_text_like(self, terms: list[(str, bool)], column: str or None, limit: int):
+        """
+        trigram分词无法在MATCH中检索少于3个字符的词(例如两个字的日文标题)，此时改为在meta_fts的各列上以LIKE扫描。
+        结果按记录id倒序排列，命中片段是第一个包含检索词的行。
+        """
+        columns = [column] if column is not None else ['names', 'titles', 'pools']
+        conditions, parameters = [], []
+        for (word, _) in terms:
+            conditions.append('(%s)' % (' OR '.join("meta_fts.%s LIKE ? ESCAPE '\\'" % (c,) for c in columns),))
+            parameters += [like_pattern(word)] * len(columns)
+        cursor = self.__conn.cursor()
+        try:
+            result = cursor.execute('SELECT meta.source, meta.pid, meta.folder, meta.filename, ' + ', '.join('meta_fts.' + c for c in columns) + ' '
+                                    'FROM meta_fts JOIN meta ON meta.id = meta_fts.rowid '
+                                    'WHERE ' + ' AND '.join(conditions) + ' AND NOT meta.deleted ORDER BY meta_fts.rowid DESC LIMIT ?',
+                                    parameters + [limit]).fetchall()
+        finally:
+            cursor.close()
+        words = [word.lower() for (word, _) in terms]
+        ret = []
+        for (source, pid, folder, filename, *texts) in result:
+            lines = [line for text in texts if text for line in text.split('\n')]
+            line = next((line for line in lines if any(w in line.lower() for w in words)), '')
+            for word in sorted(set(words), key=len, reverse=True):
+                index = line.lower().find(word)
+                if index >= 0:
+                    line = line[:index] + '\033[1;31m' + line[index:index + len(word)] + '\033[0m' + line[index + len(word):]
+                    break
+            ret.append((source, pid, folder, filename, line))
+        return ret
+
+    def iter_tag_ids(self, source: str = None, with_source: bool = False):
+        """
+        流式读取全部未删除记录的tag id列表，不构造tag字典。
+        :return: generator of array('I') or list[int]，with_source时为(source, ids)
+        """
+        sql = 'SELECT source, tag_ids, tags FROM meta WHERE NOT deleted AND ' + has_tags_condition
+        parameters = []
+        if source is not None:
+            sql += ' AND source = ?'
+            parameters.append(source)
+        cursor = self.__conn.cursor()
+        write_cursor = self.__conn.cursor()
+        try:
+            for (row_source, tag_ids, tags) in cursor.execute(sql, parameters):
+                ids = self.__dictionary.ids(write_cursor, tag_ids, tags)
+                yield (row_source, ids) if with_source else ids
+        finally:
+            write_cursor.close()
+            cursor.close()
+            self.__conn.commit()
+
+    def migrate_compact_tags(self, batch_size: int = 2000, callback=None):
+        """
+        将仍以JSON存储tags的记录迁移为紧凑格式。每一批在单独的事务中完成，迁移过程中数据库仍可正常读写，
+        中断后再次执行会从剩余的记录继续。
+        :param callback: 每完成一批时以已迁移的记录数调用
+        :return: int 迁移的记录数
+        """
+        migrated = 0
+        cursor = self.__conn.cursor()
+        try:
+            while True:
+                records = cursor.execute('SELECT id, tags FROM meta WHERE tags IS NOT NULL LIMIT ?', (batch_size,)).fetchall()
+                if len(records) == 0:
+                    return migrated
+                updates = []
+                for (meta_id, tags) in records:
+                    _, tag_ids, tag_counts = self.__dictionary.encode(cursor, json.loads(tags) if tags != '' else None)
+                    updates.append((tag_ids, tag_counts, meta_id))
+                cursor.executemany('UPDATE meta SET tag_ids = ?, tag_counts = ?, tags = NULL WHERE id = ?', updates)
+                self.__conn.commit()
+                migrated += len(records)
+                if callback is not None:
+                    callback(migrated)
+        finally:
+            cursor.close()
+            self.__conn.commit()
+
+    def count_json_tags(self):
+        """
+        :return: int 仍以JSON存储tags、尚未迁移的记录数
+        """
+        cursor = self.__conn.cursor()
+        try:
+            return cursor.execute('SELECT COUNT(*) FROM meta WHERE tags IS NOT NULL').fetchone()[0]
+        finally:
+            cursor.close()
+
+    def vacuum(self):
+        self.__conn.execute('VACUUM')
+
+    def query_size(self):
+        """
+        :return: int 数据库的字节数
+        """
+        cursor = self.__conn.cursor()
+        try:
+            (page_count,) = cursor.execute('PRAGMA page_count').fetchone()
+            (page_size,) = cursor.execute('PRAGMA page_size').fetchone()
+            return page_count * page_size
+        finally:
+            cursor.close()
+
+    def query_tag_stats(self, tag_type: str, source: str = None):
+        """
+        从tag_stats读取指定tag type下每个tag出现的记录数。
+        :return: list[(str, int, str or None)], int (name, count, title)列表，按count升序；以及没有此类型tag的记录数
+        """
+        cursor = self.__conn.cursor()
+        try:
+            source_filter = '' if source is None else ' AND source = ?'
+            parameters = [tag_type] if source is None else [tag_type, source]
+            items = cursor.execute('SELECT name, SUM(count) AS c, MAX(title) FROM tag_stats WHERE type = ?' + source_filter +
+                                   ' GROUP BY name ORDER BY c, name', parameters).fetchall()
+            (total, present) = cursor.execute('SELECT SUM(CASE WHEN type = \'*\' THEN records ELSE 0 END), SUM(CASE WHEN type = ? THEN records ELSE 0 END) '
+                                              'FROM tag_type_stats WHERE type IN (\'*\', ?)' + source_filter, [tag_type] + parameters).fetchone()
+            return items, (total or 0) - (present or 0)
+        finally:
+            cursor.close()
+
+    def query_tag_type_stats(self, source: str = None):
+        """
+        从tag_stats读取每种tag type下不同tag的数量。
+        :return: list[(str, int)] (type, 不同tag数)列表，按数量降序
+        """
+        cursor = self.__conn.cursor()
+        try:
+            if source is None:
+                return cursor.execute('SELECT type, COUNT(DISTINCT name) AS c FROM tag_stats GROUP BY type ORDER BY c DESC').fetchall()
+            return cursor.execute('SELECT type, COUNT(*) AS c FROM tag_stats WHERE source = ? GROUP BY type ORDER BY c DESC', (source,)).fetchall()
+        finally:
+            cursor.close()
+
+    def complete_tags(self, prefix: str, tag_type: str = None, source: str = None, limit: int = 20):
+        """
+        按前缀补全tag名称。前缀匹配以name索引上的范围扫描完成。
+        :return: list[(str, str, int, str or None)] (type, name, count, title)列表，按count降序
+        """
+        sql = 'SELECT type, name, SUM(count) AS c, MAX(title) FROM tag_stats WHERE name >= ? AND name < ?'
+        parameters = [prefix, prefix + '\U0010ffff']
+        if tag_type is not None:
+            sql += ' AND type = ?'
+            parameters.append(tag_type)
+        if source is not None:
+            sql += ' AND source = ?'
+            parameters.append(source)
+        sql += ' GROUP BY type, name ORDER BY c DESC, name LIMIT ?'
+        parameters.append(limit)
+        cursor = self.__conn.cursor()
+        try:
+            return cursor.execute(sql, parameters).fetchall()
+        finally:
+            cursor.close()
+
 
 def scan_record_existence(db: Database, files: list[(str, str, str, dict[str, str])]):
     """
@@ -245,8 +1253,9 @@ def scan_record_existence(db: Database, files: list[(str, str, str, dict[str, st
     :return: list[(str, str, str, dict[str, str])], list[(str, str, str, dict[str, str], str, str)] 不存在的列表，和重复存在的列表
     """
     exists, not_exists = [], []
+    existing = db.query_basic_many([(source, pid) for (_, source, pid, _) in files])
     for (filename, source, pid, metadata) in files:
-        ex = db.query_basic(source, pid)
+        ex = existing.get((source, pid))
         if ex is not None:
             exists.append((filename, source, pid, metadata, *ex))
         else:
@@ -257,85 +1266,14 @@ def scan_record_existence(db: Database, files: list[(str, str, str, dict[str, st
 
 def insert_records(db: Database, folder: str, files: list[(str, str, str, dict[str, str])]):
     """
-    将指定的文件信息存入数据库。
+    将指定的文件信息存入数据库。全部记录在同一个事务中写入。
     """
-    for (filename, source, pid, metadata) in files:
-        db.insert(source, pid, folder=folder, filename=filename, metadata=metadata, replace=True)
+    db.insert_many([(source, pid, folder, filename, metadata) for (filename, source, pid, metadata) in files], replace=True)
 
 
 def get_analyzable_records(db: Database, source: list[str]):
     """
     查询所有可分析的记录列表。
     """
-    return [(item["source"], item["pid"]) for item in db.query_list(status_in=['not-analysed', 'error'], source_in=source, order=['create-time'])]
-
-
-def analyze_tag_types(db: Database, source: str):
-    """
-    分析现有数据的tag type的分布情况。
-    """
-    cursor = db.cursor()
-    try:
-        fetch = cursor.execute('SELECT source, tags FROM meta WHERE source = ?', (source,)).fetchall()
-
-        # name -> type
-        tag_type: dict[str, str] = dict()
-        # name -> count
-        tag_count: dict[str, int] = dict()
-        for record in fetch:
-            source, tags_str = record
-            if tags_str is not None:
-                tags = json.loads(tags_str)
-                for tag in tags:
-                    name = tag['name']
-                    tp = tag['type']
-                    tag_count[name] = tag_count[name] + 1 if name in tag_count else 1
-                    if name not in tag_type:
-                        tag_type[name] = tp
-
-        # type -> count(tag)
-        type_count: dict[str, int] = dict()
-        for tp in tag_type.values():
-            type_count[tp] = type_count[tp] + 1 if tp in type_count else 1
-    finally:
-        cursor.close()
-
-    return type_count
-
-
-def get_tag_of_type(db: Database, source: str, tag_type: str):
-    cursor = db.cursor()
-    try:
-        fetch = cursor.execute('SELECT source, tags FROM meta WHERE source = ?', (source,)).fetchall()
-
-        # name -> count
-        tag_count: dict[str, int] = dict()
-        no_this_tag = 0
-        cnt = 0
-        for record in fetch:
-            source, tags_str = record
-            if tags_str is not None:
-                tags = json.loads(tags_str)
-                any_this_tag = False
-                for tag in tags:
-                    name = tag['name']
-                    tp = tag['type']
-                    if tp == tag_type:
-                        tag_count[name] = tag_count[name] + 1 if name in tag_count else 1
-                        any_this_tag = True
-                if not any_this_tag:
-                    no_this_tag += 1
-            cnt += 1
-    finally:
-        cursor.close()
-
-    return sorted(tag_count.items(), key=lambda x: (x[1], x[0])), no_this_tag, cnt
-
+    return [(item.source, item.pid) for item in db.query_list(status_in=['not-analysed', 'error'], source_in=source, order=['create-time'])]
 
-if __name__ == '__main__':
-    d = Database('/home/heer/.config/imm/data.db')
-    r, ntt, c = get_tag_of_type(d, 'complex', 'copyright')
-    for i in r:
-        print("%-56s: %d" % i)
-    print("%-56s: %d" % ("no this tag type", ntt))
-    print("%-56s: %d" % ("[all count]", c))
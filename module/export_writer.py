@@ -0,0 +1,118 @@
+import sys
+import gzip
+import json
+import yaml
+
+try:
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper
+
+formats = ["yaml", "json", "jsonl"]
+
+# 写出文件时的缓冲区大小
+__BUFFER_SIZE = 1 << 20
+
+
+def guess_format(output: str or None):
+    """
+    根据输出文件的扩展名推断导出格式。可以带有.gz后缀。
+    :return: str or None yaml, json, jsonl之一。无法推断时为None
+    """
+    if output is None:
+        return "yaml"
+    name = output[:-3] if output.endswith(".gz") else output
+    if name.endswith(".yaml") or name.endswith(".yml"):
+        return "yaml"
+    if name.endswith(".jsonl"):
+        return "jsonl"
+    if name.endswith(".json"):
+        return "json"
+    return None
+
+
+def open_output(output: str or None):
+    """
+    打开输出流。None表示标准输出；以.gz结尾的文件写入gzip流；其他文件使用大块缓冲写入。
+    """
+    if output is None:
+        return sys.stdout
+    if output.endswith(".gz"):
+        return gzip.open(output, "wt", encoding="utf-8", compresslevel=6)
+    return open(output, "w", encoding="utf-8", buffering=__BUFFER_SIZE)
+
+
+class ExportWriter:
+    """
+    逐条写出导出文档。文档结构为 {"kind": kind, "spec": [item...]}，写出过程中不保留已写出的条目，因此内存占用与记录总数无关。
+    jsonl格式每行写出一个条目，不包含kind。
+    写出过程中发生异常时不写出文档的结尾，失败的导出不会留下一个格式完整却被截断的文档。
+    """
+    # yaml每次序列化的条目数。libyaml的单次调用开销较大，因此攒够一批再写出
+    BATCH_SIZE = 500
+
+    def __init__(self, stream, fmt: str, kind: str = "source"):
+        if fmt not in formats:
+            raise ValueError("Unsupported export format %s." % (fmt,))
+        self.__stream = stream
+        self.__format = fmt
+        self.__kind = kind
+        self.__batch = []
+        self.__count = 0
+        self.__spec_started = False
+
+    @property
+    def count(self):
+        return self.__count
+
+    def __enter__(self):
+        if self.__format == "yaml":
+            self.__stream.write(yaml.dump({"kind": self.__kind}, Dumper=SafeDumper))
+        elif self.__format == "json":
+            self.__stream.write('{"kind": %s, "spec": [' % (json.dumps(self.__kind),))
+        return self
+
+    def write(self, item: dict):
+        if self.__format == "yaml":
+            self.__batch.append(item)
+            if len(self.__batch) >= self.BATCH_SIZE:
+                self.__flush_yaml()
+        elif self.__format == "json":
+            self.__stream.write((", " if self.__count > 0 else "") + json.dumps(item))
+        else:
+            self.__stream.write(json.dumps(item) + "\n")
+        self.__count += 1
+
+    def write_raw(self, item_json: str):
+        """
+        写出已经序列化为JSON文本的条目。json和jsonl格式直接写出文本；yaml格式需要先解析。
+        """
+        if self.__format == "yaml":
+            self.write(json.loads(item_json))
+            return
+        if self.__format == "json":
+            self.__stream.write((", " if self.__count > 0 else "") + item_json)
+        else:
+            self.__stream.write(item_json + "\n")
+        self.__count += 1
+
+    def __flush_yaml(self):
+        if len(self.__batch) > 0:
+            # spec键在第一批条目写出时才写出，没有条目时在结尾写出空列表
+            if not self.__spec_started:
+                self.__stream.write("spec:\n")
+                self.__spec_started = True
+            yaml.dump(self.__batch, self.__stream, Dumper=SafeDumper)
+            self.__batch.clear()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.__stream.flush()
+            return
+        if self.__format == "yaml":
+            self.__flush_yaml()
+            if not self.__spec_started:
+                self.__stream.write("spec: []\n")
+        elif self.__format == "json":
+            self.__stream.write("]}")
+        self.__stream.flush()
@@ -36,3 +36,18 @@ class External(object):
         obj = clazz(adapter=adapter, params=external_params)
         self.__external[name] = obj
         return obj
+
+
+# 常驻进程中共享的External实例: 配置 -> External。已登录的会话和HTTP连接池在命令之间保持
+__shared: dict[str, External] = dict()
+
+
+def shared_external(strategy, params):
+    """
+    取得与给定配置对应的External实例。同一进程中配置相同时复用已有的实例。
+    """
+    key = repr((strategy, params))
+    external = __shared.get(key)
+    if external is None:
+        external = __shared[key] = External(strategy, params)
+    return external
@@ -0,0 +1,137 @@
+import os
+import json
+import uuid
+from module.local import move_files, delete_files, fsync_directory
+
+
+class Journal:
+    """
+    文件操作的预写日志。一次执行计划包括移动列表、数据库记录和删除列表，执行前完整写入日志文件，执行完成后移除。
+    计划按以下顺序执行：移动文件 -> 在同一事务中写入数据库记录和计划id -> 标记已提交 -> 删除文件。
+    数据库记录提交之前，计划可以通过把文件移回原位而回滚；此后则只能重放。写入数据库之后、标记提交之前中断时，
+    恢复根据数据库中的计划id判断记录已经提交，不会把文件移走而留下指向存档的记录。所有步骤都是幂等的，因此可以反复重放。
+    """
+    def __init__(self, path: str):
+        self.__path = path
+
+    def exists(self):
+        return os.path.exists(self.__path)
+
+    def load(self):
+        try:
+            with open(self.__path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write(self, plan: dict):
+        """
+        以"写入临时文件 -> fsync -> 原子替换"的方式写入日志，保证日志文件总是完整的。
+        """
+        tmp_path = self.__path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(plan, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.__path)
+        fsync_directory(os.path.dirname(os.path.abspath(self.__path)))
+
+    def remove(self):
+        try:
+            os.remove(self.__path)
+        except FileNotFoundError:
+            pass
+
+
+def get_journal(conf):
+    """
+    取得与数据库位于同一目录下的日志文件。
+    """
+    return Journal(os.path.join(os.path.dirname(conf["work_path"]["db_path"]), "file-journal.json"))
+
+
+def apply_plan(db, journal: Journal, moves: list[(str, str)] = None, records: list[(str, str, str, str, dict[str, str])] = None, deletes: list[str] = None):
+    """
+    通过日志执行一个文件操作计划。
+    :param db: 数据库。没有数据库记录时可以为None
+    :param journal: 日志
+    :param moves: (源路径, 目标路径)列表
+    :param records: (source, pid, folder, filename, metadata)列表，以replace方式写入数据库
+    :param deletes: 待删除的文件路径列表。与移动目标相同的路径会被忽略，以免删除刚移入的新文件
+    """
+    moves, records, deletes = moves or [], records or [], deletes or []
+    if len(moves) <= 0 and len(records) <= 0 and len(deletes) <= 0:
+        return
+    move_targets = set(dst for (_, dst) in moves)
+    plan = {
+        "id": uuid.uuid4().hex,
+        "moves": moves,
+        "records": records,
+        "deletes": [d for d in deletes if d not in move_targets],
+        "committed": False
+    }
+    journal.write(plan)
+    __replay(db, journal, plan)
+
+
+def __replay(db, journal: Journal, plan: dict):
+    if not plan["committed"]:
+        move_files([(src, dst) for (src, dst) in plan["moves"] if os.path.exists(src)])
+        if len(plan["records"]) > 0:
+            db.insert_many([tuple(r) for r in plan["records"]], replace=True, plan_id=plan.get("id"))
+        plan["committed"] = True
+        journal.write(plan)
+    delete_files(plan["deletes"])
+    journal.remove()
+    if len(plan["records"]) > 0 and plan.get("id") is not None:
+        db.forget_plan(plan["id"])
+
+
+def __records_committed(db, plan: dict):
+    """
+    :return: bool 计划的数据库记录是否已经提交。日志尚未标记提交时，以数据库中的计划id为准
+    """
+    if plan["committed"]:
+        return True
+    return len(plan["records"]) > 0 and plan.get("id") is not None and db.query_plan_applied(plan["id"])
+
+
+def recover_journal(db, journal: Journal, rollback: bool = False):
+    """
+    检查并恢复上次未完成的计划。默认重放计划；指定rollback时，若计划的数据库记录尚未提交，则将已移动的文件移回原位并放弃计划。
+    :return: (str, dict) or None 恢复方式("replay"/"rollback")和被恢复的计划；没有未完成的计划时返回None
+    """
+    plan = journal.load()
+    if plan is None:
+        return None
+    if rollback and not __records_committed(db, plan):
+        move_files([(dst, src) for (src, dst) in plan["moves"] if os.path.exists(dst) and not os.path.exists(src)])
+        journal.remove()
+        return "rollback", plan
+    __replay(db, journal, plan)
+    return "replay", plan
+
+
+def recover_pending_plan(db, journal: Journal, rollback=False, dry_run=False):
+    """
+    检查日志中是否有上次中断的计划，有则恢复它并打印恢复结果。试运行时仅给出提示而不恢复。
+    :return: bool 是否恢复了计划
+    """
+    if dry_run:
+        if journal.exists():
+            print("\033[1;33m# 存在上次未完成的操作计划，它将在下次实际运行时被重放。试运行结果可能与实际不同。\033[0m")
+            print()
+        return False
+    result = recover_journal(db, journal, rollback)
+    if result is None:
+        return False
+    action, plan = result
+    if action == "rollback":
+        print("\033[1;33m# 已回滚上次未完成的操作计划，移回%s个文件。\033[0m" % (len(plan["moves"]),))
+    else:
+        print("\033[1;33m# 已重放上次未完成的操作计划：移动%s个文件，写入%s条记录，删除%s个文件。\033[0m"
+              % (len(plan["moves"]), len(plan["records"]), len(plan["deletes"])))
+        if rollback:
+            print("\033[1;33m# 此计划已提交数据库，无法回滚。\033[0m")
+    print()
+    return True
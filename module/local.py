@@ -1,6 +1,9 @@
 import os
 import re
+import errno
+import shutil
 import datetime
+from module.profiler import timer
 
 
 def get_today_archive(offset: int or None, split: int or None):
@@ -10,6 +13,24 @@ def get_today_archive(offset: int or None, split: int or None):
     return "%s.%s" % (now.strftime("%Y-%m-%d"), split) if split is not None else now.strftime("%Y-%m-%d")
 
 
+def compile_rename_rules(rules: list[dict]):
+    """
+    预编译重命名规则。结构参考config.yaml的rename.rules。
+    """
+    return [{"filename": re.compile(rule["filename"]), "rename": rule["rename"]} for rule in rules]
+
+
+def compile_excludes(excludes: list[str]):
+    return [re.compile(s) for s in excludes]
+
+
+def compile_save_rules(rules: list[dict]):
+    """
+    预编译识别规则。结构参考config.yaml的save.rules。
+    """
+    return [{"filename": re.compile(rule["filename"]), "source": rule["source"], "group": rule.get("group"), "metadata": rule.get("metadata")} for rule in rules]
+
+
 def __get_fullname(name: str, extension: str or None):
     return "%s.%s" % (name, extension) if extension is not None else name
 
@@ -42,15 +63,16 @@ def __get_files_in_directory(directory: str):
     :return: list[str] filenames
     """
     result = []
-    for top, dirs, non_dirs in os.walk(directory):
-        result.extend(non_dirs)
+    with timer.phase("scan"):
+        for top, dirs, non_dirs in os.walk(directory):
+            result.extend(non_dirs)
     return result
 
 
 def __split_and_filter_extensions(filenames: list[str], extensions: list[str]):
     result = []
     for filename in filenames:
-        n, e = __get_name_and_extension(filename)
+        n, e = get_name_and_extension(filename)
         if extensions is None or e in extensions:
             result.append((n, e))
     return result
@@ -82,7 +104,7 @@ def __replace_template(template: str, take):
         begin = start + len(value)
 
 
-def __get_rename(name: str, rules: list[dict]):
+def get_rename(name: str, rules: list[dict]):
     """
     根据规则，匹配得到重命名后的名称。如果没有匹配，返回None。
     """
@@ -125,24 +147,26 @@ def __split_duplicated_names(renamed_files: list[(str, str, str)], other_files:
     return not_duplicated, duplicated
 
 
-def scan_rename_files(work_dir: str, rules: list[dict], extensions: list[str], excludes: list[str]):
+def scan_rename_files(work_dir: str, rules: list[dict], extensions: list[str], excludes: list[str], filenames: list[str] = None):
     """
     扫描指定的工作目录，然后识别符合重命名规则的文件列表。
     :param work_dir: 工作目录
     :param rules: 重命名规则。结构参考config.yaml的rename.rules
     :param excludes: 排除规则。包含所有排除的正则表达式。它应该包含包括重命名后的文件名的匹配模式
     :param extensions: 支持扫描的文件类型
+    :param filenames: 显式指定要处理的文件名列表。指定后不再扫描工作目录
     """
     # 预处理规则
-    rules = [{"filename": re.compile(rule["filename"]), "rename": rule["rename"]} for rule in rules]
-    excludes = [re.compile(s) for s in excludes]
+    rules = compile_rename_rules(rules)
+    excludes = compile_excludes(excludes)
     # 扫描并过滤基本文件列表
-    files: list[(str, str)] = __split_and_filter_extensions(__get_files_in_directory(work_dir), extensions)
-    # 过滤掉exclude列表
-    included_files, excluded_files = __filter_into(files, lambda f: len([1 for e in excludes if e.match(f[0])]) <= 0)
-    excluded: list[str] = [__get_fullname(name, extension) for (name, extension) in excluded_files]
-    # 根据文件列表生成重命名清单，然后过滤出unmatched列表和matched列表
-    renamed_files: list[(str, str, str or None)] = [(name, extension, __get_rename(name, rules)) for (name, extension) in included_files]
+    files: list[(str, str)] = __split_and_filter_extensions(filenames if filenames is not None else __get_files_in_directory(work_dir), extensions)
+    with timer.phase("match"):
+        # 过滤掉exclude列表
+        included_files, excluded_files = __filter_into(files, lambda f: len([1 for e in excludes if e.match(f[0])]) <= 0)
+        excluded: list[str] = [__get_fullname(name, extension) for (name, extension) in excluded_files]
+        # 根据文件列表生成重命名清单，然后过滤出unmatched列表和matched列表
+        renamed_files: list[(str, str, str or None)] = [(name, extension, get_rename(name, rules)) for (name, extension) in included_files]
     matched_files, unmatched_files = __filter_into(renamed_files, lambda t: t[2] is not None)
     unmatched: list[str] = [__get_fullname(name, extension) for (name, extension, _) in unmatched_files]
     # 根据清单，将matched中的重名项过滤出来
@@ -163,12 +187,56 @@ def scan_rename_files(work_dir: str, rules: list[dict], extensions: list[str], e
     }
 
 
+def iter_work_files(work_dir: str, extensions: list[str] or None):
+    """
+    流式扫描工作目录顶层的文件，不会一次性读入整个目录列表。
+    :return: generator of (str, str) (文件名, 扩展名)
+    """
+    with os.scandir(work_dir) as it:
+        for entry in it:
+            if entry.is_file():
+                name, extension = get_name_and_extension(entry.name)
+                if extensions is None or extension in extensions:
+                    yield name, extension
+
+
+def iter_rename_files(files, rules: list[dict], excludes: list):
+    """
+    流式应用重命名规则。符合排除规则或不能匹配重命名规则的文件保持原名。
+    :param files: (文件名, 扩展名)的可迭代对象
+    :param rules: 已预编译的重命名规则
+    :param excludes: 已预编译的排除规则
+    :return: generator of (str, str, str) (原文件名, 重命名后的名称部分, 扩展名)
+    """
+    for (name, extension) in files:
+        rename = None
+        if not any(e.match(name) for e in excludes):
+            rename = get_rename(name, rules)
+        yield __get_fullname(name, extension), rename or name, extension
+
+
+def iter_match_files(files, rules: list[dict]):
+    """
+    流式应用识别规则。
+    :param files: (原文件名, 名称部分, 扩展名)的可迭代对象
+    :param rules: 已预编译的识别规则
+    :return: generator of (str, str, str or None, str or None, dict[str, str] or None) (原文件名, 目标文件名, source, pid, metadata)。未能匹配时后三项为None
+    """
+    for (filename, name, extension) in files:
+        info = get_source_info(name, rules)
+        if info is None:
+            yield filename, __get_fullname(name, extension), None, None, None
+        else:
+            yield (filename, __get_fullname(name, extension), *info)
+
+
 def do_rename_files(work_dir, rename_list: list[(str, str)]):
     """
     执行重命名计划。
     """
-    for (old, new) in rename_list:
-        os.rename(os.path.join(work_dir, old), os.path.join(work_dir, new))
+    with timer.phase("filesystem"):
+        for (old, new) in rename_list:
+            os.rename(os.path.join(work_dir, old), os.path.join(work_dir, new))
 
 
 def get_source_info(name: str, rules: list[dict]):
@@ -195,20 +263,22 @@ def get_source_info(name: str, rules: list[dict]):
     return None
 
 
-def scan_move_files(work_dir: str, rules: list[dict], extensions: list[str]):
+def scan_move_files(work_dir: str, rules: list[dict], extensions: list[str], filenames: list[str] = None):
     """
     指定工作目录，然后按照规则识别出应该被移动的文件列表及其元数据。
     :param work_dir: 工作目录
     :param rules: 识别规则，结构参考config.yaml的save.rules
     :param extensions: 支持扫描的文件类型
+    :param filenames: 显式指定要处理的文件名列表。指定后不再扫描工作目录
     :return: (list[(str, str, str, dict[str, str])], list[str]) 给出(文件名, source, pid, metadata)的元组列表，和不匹配文件的列表
     """
     # 预处理规则
-    rules = [{"filename": re.compile(rule["filename"]), "source": rule["source"], "group": rule.get("group"), "metadata": rule.get("metadata")} for rule in rules]
+    rules = compile_save_rules(rules)
     # 扫描并过滤基本文件列表
-    files: list[(str, str)] = __split_and_filter_extensions(__get_files_in_directory(work_dir), extensions)
+    files: list[(str, str)] = __split_and_filter_extensions(filenames if filenames is not None else __get_files_in_directory(work_dir), extensions)
     # 根据文件列表和规则清单匹配，分理出matched和unmatched项
-    analyzed_files: list[(str, (str, str, dict[str, str]))] = [(__get_fullname(name, extension), get_source_info(name, rules)) for (name, extension) in files]
+    with timer.phase("match"):
+        analyzed_files: list[(str, (str, str, dict[str, str]))] = [(__get_fullname(name, extension), get_source_info(name, rules)) for (name, extension) in files]
 
     matched = [(filename, *s) for (filename, s) in analyzed_files if s is not None]
     unmatched = [filename for (filename, s) in analyzed_files if s is None]
@@ -220,23 +290,128 @@ def do_move_files(work_dir: str, target_dir: str, move_list: list[str]):
     """
     执行移动计划。
     """
-    try:
-        os.makedirs(target_dir)
-    except FileExistsError:
-        pass
-    for filename in move_list:
-        os.rename(os.path.join(work_dir, filename), os.path.join(target_dir, filename))
+    move_files([(os.path.join(work_dir, filename), os.path.join(target_dir, filename)) for filename in move_list])
 
 
 def do_delete_files(work_dir: str, delete_list: list[(str, str)]):
     """
     执行删除计划。
     """
-    for (folder, filename) in delete_list:
+    delete_files([os.path.join(work_dir, folder, filename) for (folder, filename) in delete_list])
+
+
+def move_files(move_list: list[(str, str)], fsync_batch: int = 64):
+    """
+    移动文件列表。同一文件系统内直接rename；跨文件系统时在内核中复制文件内容，
+    每fsync_batch个文件集中做一次fsync，确认落盘之后再删除源文件。
+    :param move_list: (源路径, 目标路径)列表
+    :param fsync_batch: 跨文件系统复制时，每批fsync的文件数
+    """
+    created_dirs = set()
+    copied: list[(str, str)] = []
+    with timer.phase("filesystem"):
+        for (src, dst) in move_list:
+            target_dir = os.path.dirname(dst)
+            if target_dir not in created_dirs:
+                os.makedirs(target_dir, exist_ok=True)
+                created_dirs.add(target_dir)
+            try:
+                os.rename(src, dst)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                __copy_file(src, dst + ".part")
+                copied.append((src, dst))
+                if len(copied) >= fsync_batch:
+                    __commit_copied_files(copied)
+                    copied = []
+        __commit_copied_files(copied)
+
+
+def delete_files(delete_list: list[str]):
+    """
+    删除文件列表。已不存在的文件会被忽略。
+    """
+    with timer.phase("filesystem"):
+        for path in delete_list:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def fsync_directory(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def __copy_file(src: str, dst: str):
+    """
+    复制文件内容和时间戳。优先使用copy_file_range，其次sendfile，都在内核中完成复制而不经过Python缓冲区。
+    两者都不可用时，回退至普通的缓冲区复制。
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(in_fd).st_size
+        copied = 0
+        for copy_func in (__copy_file_range, __sendfile):
+            try:
+                copied = copy_func(in_fd, out_fd, size)
+                break
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP):
+                    raise
+            except AttributeError:
+                pass
+        if copied < size:
+            fsrc.seek(copied)
+            fdst.seek(copied)
+            fdst.truncate()
+            shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+    shutil.copystat(src, dst)
+
+
+def __copy_file_range(in_fd: int, out_fd: int, size: int):
+    copied = 0
+    while copied < size:
+        n = os.copy_file_range(in_fd, out_fd, size - copied, copied, copied)
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+
+def __sendfile(in_fd: int, out_fd: int, size: int):
+    copied = 0
+    while copied < size:
+        n = os.sendfile(out_fd, in_fd, copied, size - copied)
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+
+def __commit_copied_files(copied: list[(str, str)]):
+    """
+    将一批跨文件系统复制的临时文件落盘，原子替换为目标文件，然后删除源文件。
+    """
+    if len(copied) <= 0:
+        return
+    for (_, dst) in copied:
+        fd = os.open(dst + ".part", os.O_RDONLY)
         try:
-            os.remove(os.path.join(work_dir, folder, filename))
-        except FileNotFoundError:
-            pass
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    for (_, dst) in copied:
+        os.replace(dst + ".part", dst)
+    for target_dir in set(os.path.dirname(dst) for (_, dst) in copied):
+        fsync_directory(target_dir)
+    for (src, _) in copied:
+        os.remove(src)
 
 
 def scan_folders(archive_dir: str):
@@ -245,7 +420,8 @@ def scan_folders(archive_dir: str):
     :param archive_dir: 归档目录
     :return: list[str]
     """
-    return [f.name for f in os.scandir(archive_dir) if f.is_dir()]
+    with timer.phase("scan"):
+        return [f.name for f in os.scandir(archive_dir) if f.is_dir()]
 
 
 def scan_not_existing_files(work_dir: str, files: list[str]):
@@ -255,7 +431,8 @@ def scan_not_existing_files(work_dir: str, files: list[str]):
     :param files: 文件清单
     :return: list[str]
     """
-    filenames = set(f.name for f in os.scandir(work_dir) if not f.is_dir())
+    with timer.phase("scan"):
+        filenames = set(f.name for f in os.scandir(work_dir) if not f.is_dir())
     return [f for f in files if f not in filenames]
 
 
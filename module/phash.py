@@ -0,0 +1,165 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+from PIL import Image
+
+
+hashable_extensions = ['jpg', 'jpeg', 'png', 'gif']
+
+__HASH_MASK = (1 << 64) - 1
+
+__POPCOUNT_TABLE = numpy.array([bin(i).count("1") for i in range(256)], dtype=numpy.uint8)
+
+
+def __dct_matrix(n: int):
+    """
+    生成n阶DCT-II变换矩阵。
+    """
+    k = numpy.arange(n).reshape((n, 1))
+    i = numpy.arange(n).reshape((1, n))
+    m = numpy.cos(numpy.pi * (2 * i + 1) * k / (2 * n)) * numpy.sqrt(2 / n)
+    m[0, :] = numpy.sqrt(1 / n)
+    return m
+
+
+__DCT_32 = __dct_matrix(32)
+
+
+def __pack_bits(bits) -> int:
+    return int.from_bytes(numpy.packbits(bits.flatten()).tobytes(), "big")
+
+
+def compute_dhash(image: Image.Image) -> int:
+    """
+    计算图像的64位差异哈希(dHash)。将图像缩放为9x8灰度图，比较每行相邻像素的明暗。
+    """
+    pixels = numpy.asarray(image.resize((9, 8), Image.BILINEAR), dtype=numpy.int16)
+    return __pack_bits(pixels[:, 1:] > pixels[:, :-1])
+
+
+def compute_phash(image: Image.Image) -> int:
+    """
+    计算图像的64位感知哈希(pHash)。将图像缩放为32x32灰度图后做二维DCT，取左上角8x8低频分量与其中位数比较。
+    """
+    pixels = numpy.asarray(image.resize((32, 32), Image.BILINEAR), dtype=numpy.float64)
+    low = (__DCT_32 @ pixels @ __DCT_32.T)[:8, :8]
+    return __pack_bits(low > numpy.median(low.flatten()[1:]))
+
+
+def hash_file(path: str):
+    """
+    计算一个图像文件的dHash和pHash。JPEG会借助draft模式在解码阶段直接缩小，以减少解码开销。
+    :return: (int, int) or None 无法解码时返回None
+    """
+    try:
+        with Image.open(path) as image:
+            image.draft("L", (64, 64))
+            image = image.convert("L")
+            return compute_dhash(image), compute_phash(image)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def __hash_file_item(item):
+    folder, filename, path, size, mtime = item
+    return folder, filename, size, mtime, hash_file(path)
+
+
+def hamming_distance(a: int, b: int):
+    return bin(a ^ b).count("1")
+
+
+def to_signed(h: int):
+    """
+    SQLite的INTEGER是有符号64位整数，将无符号哈希值转换后存储。
+    """
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+def to_unsigned(h: int):
+    return h & __HASH_MASK
+
+
+def scan_hash_files(archive_dir: str, folders: list[str], extensions: list[str] or None, cached: dict[(str, str), (int, int)]):
+    """
+    扫描归档目录中的图像文件，与已缓存的哈希记录对比，找出新增或已变化的文件，以及已不存在的文件。
+    :param cached: 已存储的哈希记录，{(folder, filename): (size, mtime)}
+    :return: list[(str, str, str, int, int)], list[(str, str)] 需要计算哈希的(folder, filename, path, size, mtime)列表，和已失效的记录列表
+    """
+    extensions = [e for e in hashable_extensions if extensions is None or e in extensions]
+    changed, existing = [], set()
+    for folder in folders:
+        for entry in os.scandir(os.path.join(archive_dir, folder)):
+            p = entry.name.rfind('.')
+            if p < 0 or entry.name[p + 1:].lower() not in extensions or not entry.is_file():
+                continue
+            stat = entry.stat()
+            key = (folder, entry.name)
+            existing.add(key)
+            if cached.get(key) != (stat.st_size, stat.st_mtime_ns):
+                changed.append((folder, entry.name, entry.path, stat.st_size, stat.st_mtime_ns))
+    expired = [key for key in cached.keys() if key not in existing]
+    return changed, expired
+
+
+def compute_hashes(files: list[(str, str, str, int, int)], processes: int or None = None):
+    """
+    使用进程池并行计算文件列表的哈希值。
+    :param files: scan_hash_files给出的待计算列表
+    :param processes: 进程数。不指定时使用CPU核心数
+    :return: generator of (folder, filename, size, mtime, (dhash, phash) or None)
+    """
+    if len(files) <= 0:
+        return
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        yield from executor.map(__hash_file_item, files, chunksize=64)
+
+
+def __popcount(values):
+    return __POPCOUNT_TABLE[values.view(numpy.uint8).reshape(-1, 8)].sum(axis=1, dtype=numpy.int64)
+
+
+def find_near_duplicates(hashes: list[(any, int, int)], distance: int):
+    """
+    使用多索引汉明搜索，查找pHash距离不超过distance的全部图像对。
+    将64位哈希切分为distance+1段，根据鸽巢原理，任意距离不超过distance的两个哈希至少有一段完全相同。
+    因此只需要比较每段取值相同的图像，而不需要两两比较全部图像。
+    每段按取值排序后，同值的图像彼此相邻，以步长k逐步比较相隔k位的元素，全部比较都以numpy向量化完成。
+    :param hashes: (key, dhash, phash)列表
+    :param distance: 最大汉明距离
+    :return: list[(any, any, int, int)] (key_a, key_b, pHash距离, dHash距离)的列表，按距离升序
+    """
+    count = len(hashes)
+    if count <= 1:
+        return []
+    dhashes = numpy.array([d for (_, d, _) in hashes], dtype=numpy.uint64)
+    phashes = numpy.array([p for (_, _, p) in hashes], dtype=numpy.uint64)
+
+    segments = distance + 1
+    widths = [64 // segments + (1 if i < 64 % segments else 0) for i in range(segments)]
+    offsets = [sum(widths[:i]) for i in range(segments)]
+
+    found = []
+    for s in range(segments):
+        values = (phashes >> numpy.uint64(offsets[s])) & numpy.uint64((1 << widths[s]) - 1)
+        order = numpy.argsort(values, kind="stable")
+        values = values[order]
+        # 排序后，若位置i与i+k取值不同，则与更远的位置也一定不同，因此候选集合随k增大单调收缩
+        candidates = numpy.arange(count - 1)
+        k = 1
+        while candidates.size > 0:
+            candidates = candidates[candidates + k < count]
+            candidates = candidates[values[candidates] == values[candidates + k]]
+            a, b = order[candidates], order[candidates + k]
+            d = __popcount(phashes[a] ^ phashes[b])
+            hit = d <= distance
+            found.append(numpy.stack((numpy.minimum(a, b)[hit], numpy.maximum(a, b)[hit], d[hit])))
+            k += 1
+
+    found = numpy.concatenate(found, axis=1)
+    _, unique_index = numpy.unique(found[0] * count + found[1], return_index=True)
+    a, b, phash_distances = found[:, unique_index]
+    dhash_distances = __popcount(dhashes[a] ^ dhashes[b])
+    order = numpy.lexsort((dhash_distances, phash_distances))
+
+    return [(hashes[a[i]][0], hashes[b[i]][0], int(phash_distances[i]), int(dhash_distances[i])) for i in order]
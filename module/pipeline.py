@@ -0,0 +1,61 @@
+import time
+
+
+class StageMeter:
+    """
+    流水线阶段计量。为串联的生成器阶段计时并计数，报告每个阶段自身的耗时和吞吐量。
+    由于下游阶段拉取数据时会同时驱动上游阶段，每个阶段测得的是包含上游的总耗时，报告时再减去上游阶段的耗时。
+    """
+    def __init__(self):
+        # [name, count, 包含上游的耗时]
+        self.__stages: list[list] = []
+
+    def stage(self, name: str, iterable, count=None):
+        """
+        包装一个阶段。阶段应按从上游到下游的顺序依次包装。
+        :param name: 阶段名称
+        :param iterable: 阶段的生成器
+        :param count: 计算每个产出项代表的项数。批次阶段可以传入len
+        """
+        record = [name, 0, 0.0]
+        self.__stages.append(record)
+        return self.__iter(record, iter(iterable), count)
+
+    @staticmethod
+    def __iter(record: list, iterator, count):
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                record[2] += time.perf_counter() - start
+                return
+            record[2] += time.perf_counter() - start
+            record[1] += count(item) if count is not None else 1
+            yield item
+
+    def report(self):
+        """
+        :return: list[(str, int, float, float)] 每个阶段的(名称, 项数, 自身耗时, 每秒项数)
+        """
+        ret = []
+        upstream = 0.0
+        for (name, count, inclusive) in self.__stages:
+            cost = max(inclusive - upstream, 0.0)
+            ret.append((name, count, cost, count / cost if cost > 0 else 0.0))
+            upstream = inclusive
+        return ret
+
+
+def chunked(iterable, size: int):
+    """
+    将可迭代对象按size切分为列表批次。
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
@@ -0,0 +1,112 @@
+import os
+import json
+from datetime import datetime
+
+PLAN_VERSION = 1
+
+
+def fingerprint(path: str):
+    """
+    文件的状态指纹。
+    :return: [int, int] or None (文件大小, 修改时间纳秒)。文件不存在时为None
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class Plan:
+    """
+    试运行计算出的执行计划。计划包括与日志计划相同的移动列表、数据库记录和删除列表，另外还有待标记为已删除的记录。
+    计划涉及的每个路径在生成时都记录了状态指纹(文件大小和修改时间，或不存在)，执行前只需对这些路径逐个stat，
+    指纹全部一致即可认为计划仍然有效，而不必重新扫描目录和查询数据库。
+    依据数据库生成的计划还记录了生成前的行版本号，数据库在此之后被修改过时计划同样失效。
+    """
+    def __init__(self, command: str, db_path: str, row_version: int or None = None):
+        self.command = command
+        self.db_path = db_path
+        self.row_version = row_version
+        self.moves: list[(str, str)] = []
+        self.records: list[(str, str, str, str, dict[str, str])] = []
+        self.deletes: list[str] = []
+        self.marks: list[(str, str)] = []
+        self.fingerprints: dict[str, list or None] = dict()
+
+    def __check(self, path: str):
+        if path not in self.fingerprints:
+            self.fingerprints[path] = fingerprint(path)
+
+    def add_moves(self, moves: list[(str, str)]):
+        for (src, dst) in moves:
+            self.__check(src)
+            self.__check(dst)
+        self.moves += moves
+
+    def add_records(self, records: list[(str, str, str, str, dict[str, str])], archive_dir: str):
+        """
+        :param records: (source, pid, folder, filename, metadata)列表。记录对应的存档文件也会被记录指纹
+        :param archive_dir: 存档目录
+        """
+        for (_, _, folder, filename, _) in records:
+            self.__check(os.path.join(archive_dir, folder, filename))
+        self.records += records
+
+    def add_deletes(self, deletes: list[str]):
+        for path in deletes:
+            self.__check(path)
+        self.deletes += deletes
+
+    def add_marks(self, marks: list[(str, str)], archive_dir: str):
+        """
+        :param marks: 待标记为已删除的(folder, filename)列表。执行时这些文件必须仍然不存在
+        :param archive_dir: 存档目录
+        """
+        for (folder, filename) in marks:
+            self.__check(os.path.join(archive_dir, folder, filename))
+        self.marks += marks
+
+    def is_empty(self):
+        return len(self.moves) <= 0 and len(self.records) <= 0 and len(self.deletes) <= 0 and len(self.marks) <= 0
+
+    def validate(self):
+        """
+        校验计划涉及的文件是否仍与生成时一致。
+        :return: list[(str, list or None, list or None)] 发生变化的(路径, 生成时的指纹, 当前的指纹)列表
+        """
+        changed = []
+        for (path, expected) in self.fingerprints.items():
+            actual = fingerprint(path)
+            if actual != expected:
+                changed.append((path, expected, actual))
+        return changed
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({
+                "version": PLAN_VERSION,
+                "command": self.command,
+                "create_time": datetime.now().isoformat(timespec="seconds"),
+                "db_path": self.db_path,
+                "row_version": self.row_version,
+                "moves": self.moves,
+                "records": self.records,
+                "deletes": self.deletes,
+                "marks": self.marks,
+                "fingerprints": self.fingerprints
+            }, f, ensure_ascii=False)
+
+    @staticmethod
+    def load(path: str):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if data.get("version") != PLAN_VERSION:
+            raise ValueError("Unsupported plan version %s." % (data.get("version"),))
+        plan = Plan(data["command"], data["db_path"], data.get("row_version"))
+        plan.moves = [tuple(m) for m in data["moves"]]
+        plan.records = [tuple(r) for r in data["records"]]
+        plan.deletes = data["deletes"]
+        plan.marks = [tuple(m) for m in data["marks"]]
+        plan.fingerprints = data["fingerprints"]
+        return plan
@@ -0,0 +1,181 @@
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+
+__JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+__EBML_SEGMENT = 0x18538067
+__EBML_TRACKS = 0x1654AE6B
+__EBML_TRACK_ENTRY = 0xAE
+__EBML_VIDEO = 0xE0
+__EBML_PIXEL_WIDTH = 0xB0
+__EBML_PIXEL_HEIGHT = 0xBA
+__EBML_CLUSTER = 0x1F43B675
+
+
+def probe_file(path: str):
+    """
+    只读取文件头部，解析图像/视频的格式和尺寸。中间的大块数据(EXIF、mdat等)通过seek跳过，不会被读取。
+    :return: (str or None, int or None, int or None, int) (格式, 宽度, 高度, 文件字节数)。无法识别的格式只给出文件字节数
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        try:
+            if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+                width, height = struct.unpack('>II', head[16:24])
+                return 'png', width, height, size
+            if head[:6] in (b'GIF87a', b'GIF89a'):
+                width, height = struct.unpack('<HH', head[6:10])
+                return 'gif', width, height, size
+            if head.startswith(b'\xff\xd8'):
+                return ('jpeg', *__probe_jpeg(f), size)
+            if head[4:8] == b'ftyp':
+                return ('mp4', *__probe_mp4(f, size), size)
+            if head.startswith(b'\x1a\x45\xdf\xa3'):
+                return ('webm', *__probe_ebml(f, size), size)
+        except (struct.error, ValueError, IndexError):
+            # 被截断或损坏的文件头只给出文件字节数
+            pass
+    return None, None, None, size
+
+
+def __read(f, n: int):
+    """
+    读取恰好n个字节。文件提前结束时抛出ValueError，被截断的文件不会在解析中途引发其他异常。
+    """
+    data = f.read(n)
+    if len(data) < n:
+        raise ValueError("unexpected end of file")
+    return data
+
+
+def __probe_jpeg(f):
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None, None
+        # 标记之间允许存在填充的0xFF
+        while marker[1] == 0xFF:
+            marker = marker[1:] + __read(f, 1)
+        if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+            continue
+        length, = struct.unpack('>H', __read(f, 2))
+        if marker[1] in __JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack('>BHH', __read(f, 5))
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def __probe_mp4(f, file_size: int):
+    """
+    逐层遍历box，在moov/trak中查找第一个带有尺寸的tkhd。mdat等大box直接跳过。
+    """
+    def walk(start: int, end: int):
+        offset = start
+        while offset + 8 <= end:
+            f.seek(offset)
+            box_size, box_type = struct.unpack('>I4s', __read(f, 8))
+            header = 8
+            if box_size == 1:
+                box_size, = struct.unpack('>Q', __read(f, 8))
+                header = 16
+            elif box_size == 0:
+                box_size = end - offset
+            if box_size < header:
+                return None
+            if box_type in (b'moov', b'trak'):
+                r = walk(offset + header, offset + box_size)
+                if r is not None:
+                    return r
+            elif box_type == b'tkhd':
+                version = __read(f, 1)[0]
+                f.seek(3 + (32 if version == 1 else 20) + 52, os.SEEK_CUR)
+                width, height = struct.unpack('>II', __read(f, 8))
+                if width > 0 and height > 0:
+                    return width >> 16, height >> 16
+            offset += box_size
+        return None
+
+    return walk(0, file_size) or (None, None)
+
+
+def __read_vint(f, keep_marker: bool):
+    first = f.read(1)
+    if len(first) < 1:
+        raise ValueError("unexpected end of file")
+    b = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not b & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError("invalid vint")
+    value = b if keep_marker else b & (mask - 1)
+    all_ones = (b & (mask - 1)) == mask - 1
+    for c in __read(f, length - 1):
+        value = (value << 8) | c
+        all_ones = all_ones and c == 0xFF
+    # 长度字段全部为1表示未知长度
+    return None if all_ones and not keep_marker else value
+
+
+def __probe_ebml(f, file_size: int):
+    """
+    遍历EBML元素，依次进入Segment -> Tracks -> TrackEntry -> Video，读取PixelWidth和PixelHeight。遇到Cluster即停止。
+    """
+    width, height = None, None
+    masters = {__EBML_SEGMENT, __EBML_TRACKS, __EBML_TRACK_ENTRY, __EBML_VIDEO}
+    f.seek(0)
+    while f.tell() < file_size:
+        element_id = __read_vint(f, True)
+        element_size = __read_vint(f, False)
+        if element_id == __EBML_CLUSTER:
+            break
+        if element_id in masters:
+            continue
+        if element_size is None:
+            break
+        if element_id in (__EBML_PIXEL_WIDTH, __EBML_PIXEL_HEIGHT):
+            value = int.from_bytes(__read(f, element_size), 'big')
+            if element_id == __EBML_PIXEL_WIDTH:
+                width = value
+            else:
+                height = value
+            if width is not None and height is not None:
+                break
+        else:
+            f.seek(element_size, os.SEEK_CUR)
+    # 文件在两个尺寸之间被截断时，不给出只有一半的尺寸
+    if width is None or height is None:
+        return None, None
+    return width, height
+
+
+def probe_records(archive_dir: str, records: list[(str, str, str, str)], threads: int = 8):
+    """
+    使用线程池并行探测一批记录对应的文件。文件读取主要是IO等待，因此使用线程而不是进程。
+    :param records: (source, pid, folder, filename)列表
+    :return: list[(str, int, int, int, str, str)] 可直接写入数据库的(format, width, height, file_size, source, pid)列表。
+        已不存在的文件会被跳过；解析失败的文件只给出文件字节数，单个文件不会中断整批探测
+    """
+    def probe(record):
+        source, pid, folder, filename = record
+        path = os.path.join(archive_dir, folder, filename)
+        try:
+            return (*probe_file(path), source, pid)
+        except OSError:
+            return None
+        except Exception:
+            try:
+                return None, None, None, os.path.getsize(path), source, pid
+            except OSError:
+                return None
+
+    if len(records) <= 0:
+        return []
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return [r for r in executor.map(probe, records) if r is not None]
@@ -0,0 +1,139 @@
+import sys
+import time
+import sqlite3
+from contextlib import contextmanager
+
+
+class PhaseTimer:
+    """
+    按阶段累计耗时的轻量计时器。未启用时phase只有一次属性检查的开销，因此可以常驻在扫描、匹配和文件操作的代码中。
+    数据库阶段由TimedConnection自动计时，语句数由SQLite的trace回调计数。
+    阶段之间可以嵌套(例如扫描过程中的数据库查询)，报告中的耗时均包含嵌套阶段。
+    """
+    def __init__(self):
+        self.enabled = False
+        # 阶段名称 -> [耗时, 次数]
+        self.__phases: dict[str, list] = dict()
+        self.__statements = 0
+        self.__start = 0.0
+
+    def start(self):
+        self.__phases.clear()
+        self.__statements = 0
+        self.__start = time.perf_counter()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+        return time.perf_counter() - self.__start
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float, count: int = 1):
+        record = self.__phases.get(name)
+        if record is None:
+            self.__phases[name] = [seconds, count]
+        else:
+            record[0] += seconds
+            record[1] += count
+
+    def trace_statement(self, statement: str):
+        """
+        SQLite的trace回调，每执行一条语句调用一次。
+        """
+        if self.enabled:
+            self.__statements += 1
+
+    def report(self, total: float, file=None):
+        """
+        打印各阶段的耗时汇总表。
+        """
+        file = file or sys.stderr
+        print(file=file)
+        print("\033[1;34m-- timing --\033[0m", file=file)
+        print("%-12s %10s %8s %10s" % ("phase", "seconds", "%", "calls"), file=file)
+        for (name, (seconds, count)) in sorted(self.__phases.items(), key=lambda item: -item[1][0]):
+            print("%-12s %10.3f %7.1f%% %10d" % (name, seconds, seconds * 100 / total if total > 0 else 0, count), file=file)
+        print("%-12s %10s %8s %10d" % ("statements", "", "", self.__statements), file=file)
+        print("%-12s %10.3f" % ("total", total), file=file)
+
+
+timer = PhaseTimer()
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    为执行和取回结果计时的游标。只在计时启用时由TimedConnection创建。
+    """
+    def execute(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            timer.add("db", time.perf_counter() - start)
+
+    def executemany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            timer.add("db", time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            timer.add("db", time.perf_counter() - start, 0)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            timer.add("db", time.perf_counter() - start, 0)
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return super().__next__()
+        finally:
+            timer.add("db", time.perf_counter() - start, 0)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            timer.add("db", time.perf_counter() - start, 0)
+
+
+def connect(path: str):
+    """
+    打开数据库连接。计时启用时使用计时的连接，并注册语句计数的trace回调。
+    """
+    if not timer.enabled:
+        return sqlite3.connect(path)
+    conn = sqlite3.connect(path, factory=TimedConnection)
+    conn.set_trace_callback(timer.trace_statement)
+    return conn
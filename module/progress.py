@@ -0,0 +1,109 @@
+import os
+import sys
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class ProgressReporter:
+    """
+    以JSON Lines向指定的流输出机器可读的进度事件，供调度系统读取而不必解析终端输出。
+    事件:
+        {"event": "phase_start", "phase": 名称, "total": 总数或null}
+        {"event": "progress", "phase": 名称, "done": 已完成数, "total": 总数, "rate": 每秒项数, "eta": 剩余秒数或null}
+        {"event": "error", "phase": 名称, "message": 错误信息, ...}
+        {"event": "phase_end", "phase": 名称, "done": 已完成数, "elapsed": 耗时, "rate": 平均每秒项数}
+    每个事件都带有time字段(UNIX时间戳)。
+    progress事件最多每interval秒输出一次，advance在两次输出之间只做计数和一次时钟读取，因此每秒数万项时开销也可以忽略。
+    速率和剩余时间以最近window秒内的采样计算，能反映处理速度的变化。
+    未启用时所有方法都直接返回。
+    """
+    def __init__(self):
+        self.enabled = False
+        self.__stream = None
+        self.__interval = 0.5
+        self.__window = 10.0
+        self.__phase = None
+        self.__total = None
+        self.__done = 0
+        self.__start = 0.0
+        self.__next_emit = 0.0
+        self.__samples: deque = deque()
+
+    def open(self, fd: int or None = None, interval: float = 0.5, window: float = 10.0):
+        """
+        启用进度事件输出。
+        :param fd: 输出事件的文件描述符。不指定时输出到标准错误
+        :param interval: progress事件的最小间隔秒数
+        :param window: 计算速率的滑动窗口秒数
+        """
+        self.__stream = sys.stderr if fd is None else os.fdopen(os.dup(fd), "w", buffering=1, encoding="utf-8")
+        self.__interval = interval
+        self.__window = window
+        self.enabled = True
+
+    def close(self):
+        if self.enabled:
+            self.enabled = False
+            if self.__stream is not sys.stderr:
+                self.__stream.close()
+            self.__stream = None
+
+    def __emit(self, event: str, **fields):
+        self.__stream.write(json.dumps({"event": event, "time": round(time.time(), 3), **fields}, ensure_ascii=False) + "\n")
+        self.__stream.flush()
+
+    def start(self, phase: str, total: int or None = None):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        self.__phase, self.__total, self.__done = phase, total, 0
+        self.__start, self.__next_emit = now, now + self.__interval
+        self.__samples.clear()
+        self.__samples.append((now, 0))
+        self.__emit("phase_start", phase=phase, total=total)
+
+    def advance(self, count: int = 1):
+        if not self.enabled:
+            return
+        self.__done += count
+        now = time.monotonic()
+        if now >= self.__next_emit:
+            self.__next_emit = now + self.__interval
+            self.__emit_progress(now)
+
+    def __emit_progress(self, now: float):
+        samples = self.__samples
+        samples.append((now, self.__done))
+        while len(samples) > 2 and now - samples[0][0] > self.__window:
+            samples.popleft()
+        (first_time, first_done) = samples[0]
+        rate = (self.__done - first_done) / (now - first_time) if now > first_time else 0.0
+        eta = (self.__total - self.__done) / rate if self.__total is not None and rate > 0 else None
+        self.__emit("progress", phase=self.__phase, done=self.__done, total=self.__total,
+                    rate=round(rate, 2), eta=round(eta, 1) if eta is not None else None)
+
+    def error(self, message: str, **fields):
+        if not self.enabled:
+            return
+        self.__emit("error", phase=self.__phase, message=message, **fields)
+
+    def end(self):
+        if not self.enabled or self.__phase is None:
+            return
+        elapsed = time.monotonic() - self.__start
+        self.__emit("phase_end", phase=self.__phase, done=self.__done, elapsed=round(elapsed, 3),
+                    rate=round(self.__done / elapsed, 2) if elapsed > 0 else 0.0)
+        self.__phase = None
+
+    @contextmanager
+    def phase(self, phase: str, total: int or None = None):
+        self.start(phase, total)
+        try:
+            yield self
+        finally:
+            self.end()
+
+
+progress = ProgressReporter()
@@ -0,0 +1,325 @@
+import re
+import json
+import base64
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+__TOKEN = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+
+keywords = {'AND', 'OR', 'NOT'}
+
+__STATUS = {'not-analysed': 0, 'analysed': 1, 'error': 2}
+
+# 允许排序的列: 名称 -> (SQL列, 是否可为NULL)
+sortable_columns = {
+    'id': ('meta.id', False),
+    'create-time': ('meta.create_time', False),
+    'analyse-time': ('meta.analyse_time', True),
+    'folder': ('meta.folder', True),
+    'filename': ('meta.filename', False),
+    'source': ('meta.source', False),
+    'pid': ('meta.pid', False),
+    'status': ('meta.status', False)
+}
+
+
+def tokenize(expression: str):
+    """
+    将查询表达式切分为token。
+    :return: list[(str, str)] (kind, value)列表。kind为"(", ")", "word"或"quoted"
+    """
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = __TOKEN.match(expression, position)
+        if match is None or match.end() == position:
+            raise QuerySyntaxError("unexpected character at %d: %s" % (position, expression[position:]))
+        position = match.end()
+        if match.group(1):
+            tokens.append(("(", "("))
+        elif match.group(2):
+            tokens.append((")", ")"))
+        elif match.group(3) is not None:
+            if match.group(3) == "":
+                raise QuerySyntaxError("empty term at %d" % (match.start(3) - 1,))
+            tokens.append(("quoted", re.sub(r'\\(.)', r'\1', match.group(3))))
+        else:
+            word = match.group(4)
+            # 带引号的值可以紧跟在key:之后，例如artist:"a b"
+            if word.endswith(':') and position < len(expression) and expression[position] == '"':
+                quoted = __TOKEN.match(expression, position)
+                if quoted is None or quoted.group(3) is None:
+                    raise QuerySyntaxError("unterminated quote at %d: %s" % (position, expression[position:]))
+                if quoted.group(3) == "":
+                    raise QuerySyntaxError("empty term at %d" % (position,))
+                position = quoted.end()
+                word += re.sub(r'\\(.)', r'\1', quoted.group(3))
+            tokens.append(("word", word))
+    return tokens
+
+
+class Parser:
+    """
+    递归下降解析查询表达式，产出语法树。
+    表达式语法:
+        expr   := and ("OR" and)*
+        and    := not (["AND"] not)*
+        not    := ("NOT" | "-") not | atom
+        atom   := "(" expr ")" | term
+        term   := [key ":"] value
+    """
+    def __init__(self, expression: str):
+        self.__tokens = tokenize(expression)
+        self.__position = 0
+
+    def parse(self):
+        if len(self.__tokens) == 0:
+            raise QuerySyntaxError("empty expression")
+        node = self.__or()
+        if self.__position < len(self.__tokens):
+            raise QuerySyntaxError("unexpected token: %s" % (self.__tokens[self.__position][1],))
+        return node
+
+    def __peek(self):
+        return self.__tokens[self.__position] if self.__position < len(self.__tokens) else (None, None)
+
+    def __next(self):
+        token = self.__peek()
+        self.__position += 1
+        return token
+
+    def __or(self):
+        nodes = [self.__and()]
+        while self.__peek() == ("word", "OR"):
+            self.__next()
+            nodes.append(self.__and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def __and(self):
+        nodes = [self.__not()]
+        while True:
+            kind, value = self.__peek()
+            if (kind, value) == ("word", "AND"):
+                self.__next()
+                nodes.append(self.__not())
+            elif kind is not None and kind != ")" and (kind, value) != ("word", "OR"):
+                nodes.append(self.__not())
+            else:
+                break
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def __not(self):
+        kind, value = self.__peek()
+        if (kind, value) in (("word", "NOT"), ("word", "-")):
+            # 单独的-与NOT相同，例如-(a OR b)
+            self.__next()
+            return "not", self.__not()
+        if kind == "word" and value.startswith('-') and len(value) > 1:
+            self.__tokens[self.__position] = ("word", value[1:])
+            return "not", self.__not()
+        return self.__atom()
+
+    def __atom(self):
+        kind, value = self.__next()
+        if kind == "(":
+            node = self.__or()
+            if self.__next()[0] != ")":
+                raise QuerySyntaxError("missing ')'")
+            return node
+        if kind == "quoted":
+            return "term", None, value
+        if kind == "word" and value not in keywords:
+            key, sep, v = value.partition(':')
+            if sep and key and v:
+                return "term", key.lower(), v
+            return "term", None, value
+        raise QuerySyntaxError("unexpected token: %s" % (value or "end of expression",))
+
+
+def __tag_condition(tag_type: str or None, name: str):
+    """
+    tag项编译为meta_tag上的IN子查询。子查询先经tag(type, name)唯一索引找到tag id，再经meta_tag主键取出记录id。
+    名称中的*作为通配符，使用GLOB匹配。
+    """
+    name_op = 'GLOB' if '*' in name or '?' in name else '='
+    if tag_type is None:
+        return 'meta.id IN (SELECT meta_tag.meta_id FROM tag JOIN meta_tag ON meta_tag.tag_id = tag.id WHERE tag.name %s ?)' % (name_op,), [name]
+    return 'meta.id IN (SELECT meta_tag.meta_id FROM tag JOIN meta_tag ON meta_tag.tag_id = tag.id WHERE tag.type = ? AND tag.name %s ?)' % (name_op,), [tag_type, name]
+
+
+def __range_condition(column: str, value: str):
+    """
+    编译a..b形式的闭区间，两端均可省略。上界以前缀匹配，因此folder:..2022-01-31包含分割存档2022-01-31.2。
+    """
+    low, _, high = value.partition('..')
+    conditions, parameters = [], []
+    if low:
+        conditions.append('%s >= ?' % (column,))
+        parameters.append(low)
+    if high:
+        conditions.append('%s < ?' % (column,))
+        parameters.append(high + '\U0010ffff')
+    if len(conditions) == 0:
+        return '%s IS NOT NULL' % (column,), []
+    return ' AND '.join(conditions), parameters
+
+
+def __term_condition(key: str or None, value: str):
+    if key is None:
+        return __tag_condition(None, value)
+    if key == 'source':
+        return 'meta.source = ?', [value]
+    if key == 'pid':
+        return 'meta.pid = ?', [value]
+    if key == 'folder':
+        if '..' in value:
+            return __range_condition('meta.folder', value)
+        return ('meta.folder GLOB ?' if '*' in value else 'meta.folder = ?'), [value]
+    if key == 'status':
+        if value not in __STATUS:
+            raise QuerySyntaxError("unknown status: %s" % (value,))
+        return 'meta.status = ?', [__STATUS[value]]
+    if key == 'format':
+        return 'meta.format = ?', [value]
+    if key == 'rating':
+        return 'json_extract(meta.meta, \'$.rating\') = ?', [value]
+    if key == 'md5':
+        return 'json_extract(meta.meta, \'$.md5\') = ?', [value.lower()]
+    return __tag_condition(key, value)
+
+
+def __compile_node(node):
+    if node[0] == "term":
+        return __term_condition(node[1], node[2])
+    if node[0] == "not":
+        sql, parameters = __compile_node(node[1])
+        return 'NOT (%s)' % (sql,), parameters
+    parts, parameters = [], []
+    for child in node[1]:
+        sql, p = __compile_node(child)
+        parts.append('(%s)' % (sql,))
+        parameters += p
+    return (' AND ' if node[0] == "and" else ' OR ').join(parts), parameters
+
+
+def compile_expression(expression: str):
+    """
+    将查询表达式编译为meta表上的SQL条件。
+    支持的项:
+        name / type:name       tag，名称可以使用*通配符；不带type时匹配任意type
+        source:x / pid:x       来源类型 / pid
+        folder:x / folder:a..b 存档文件夹，或文件夹的闭区间，两端均可省略
+        status:x               analysed, not-analysed或error
+        format:x               文件格式
+        rating:x / md5:x       元数据中的rating / md5
+    项之间以AND(或空格)、OR、NOT(或-前缀)和括号组合。
+    :return: (str, list) SQL条件和参数列表
+    """
+    return __compile_node(Parser(expression).parse())
+
+
+def fts_terms(text: str):
+    """
+    拆分用户输入的检索文本。"..."保留为短语，以*结尾的词表示前缀匹配。
+    :return: list[(str, bool)] (词, 是否前缀匹配)列表
+    """
+    terms = []
+    for match in re.finditer(r'"([^"]*)"(\*?)|(\S+)', text):
+        if match.group(3) is not None:
+            word = match.group(3)
+            star = word.endswith('*')
+            word = word.rstrip('*')
+        else:
+            word, star = match.group(1), match.group(2) == '*'
+        if word != '':
+            terms.append((word, star))
+    if len(terms) == 0:
+        raise QuerySyntaxError("empty search text")
+    return terms
+
+
+def fts_query(terms: list[(str, bool)]):
+    """
+    将检索词转换为FTS5查询。每个词都被引用为短语，以免其中的-、:等字符被解释为FTS5语法；各项之间为AND。
+    """
+    return ' AND '.join('"%s"%s' % (word.replace('"', '""'), '*' if star else '') for (word, star) in terms)
+
+
+def like_pattern(word: str):
+    """
+    :return: str 匹配包含word的文本的LIKE模式，以\\转义
+    """
+    return '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def compile_order(order: list[str]):
+    """
+    按白名单校验排序项，并在末尾补充id作为唯一的次序键，使分页位置总是确定的。
+    可为NULL的列之前补充一个"列 IS NULL"项，使NULL值无论升降序都排在最后，并把是否为NULL一并编入续页token。
+    :param order: 排序项列表，例如["-create-time"]。前缀-表示降序
+    :return: list[(str, bool, bool)] (SQL列, 是否降序, 是否可为NULL)列表
+    """
+    keys = []
+    for o in order:
+        descending = o.startswith('-')
+        name = o.lstrip('-').replace('_', '-')
+        if name not in sortable_columns:
+            raise QuerySyntaxError("unsupported order column: %s. Available: %s" % (name, ", ".join(sortable_columns.keys())))
+        column, nullable = sortable_columns[name]
+        if nullable:
+            keys.append(('(%s IS NULL)' % (column,), False, False))
+        keys.append((column, descending, nullable))
+    if len(keys) == 0:
+        keys.append(('meta.id', True, False))
+    elif all(column != 'meta.id' for (column, _, _) in keys):
+        keys.append(('meta.id', keys[-1][1], False))
+    return keys
+
+
+def encode_token(order: list[str], values: list):
+    """
+    将一页最后一条记录的排序键编码为续页token。
+    """
+    data = json.dumps({"order": order, "values": values}, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_token(token: str, order: list[str]):
+    """
+    解码续页token。token必须由相同的排序项生成。
+    :return: list 上一页最后一条记录的排序键
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode())
+        values = data["values"]
+    except (ValueError, KeyError, TypeError):
+        raise QuerySyntaxError("invalid page token")
+    if data.get("order") != order:
+        raise QuerySyntaxError("page token was created with a different order")
+    return values
+
+
+def compile_keyset(keys: list[(str, bool, bool)], values: list):
+    """
+    编译"排在给定排序键之后"的条件。所有项方向一致且不可为NULL时使用行值比较，SQLite可以直接在索引上定位；
+    否则展开为 (a > ?) OR (a = ? AND b > ?) ... 的形式。可为NULL的列以IS比较相等；
+    上一条记录在该列上为NULL时，同为NULL的记录在该列上相等，因此不产生该列的严格比较项。
+    :return: (str, list) SQL条件和参数列表
+    """
+    if len(values) != len(keys):
+        raise QuerySyntaxError("invalid page token")
+    if all(descending == keys[0][1] and not nullable for (_, descending, nullable) in keys):
+        return '(%s) %s (%s)' % (', '.join(column for (column, _, _) in keys), '<' if keys[0][1] else '>',
+                                 ', '.join(['?'] * len(keys))), list(values)
+    alternatives, parameters = [], []
+    for i, (column, descending, _) in enumerate(keys):
+        if values[i] is None:
+            continue
+        conditions = ['%s %s ?' % (c, 'IS' if n else '=') for (c, _, n) in keys[:i]] + ['%s %s ?' % (column, '<' if descending else '>')]
+        alternatives.append('(%s)' % (' AND '.join(conditions),))
+        parameters += list(values[:i + 1])
+    return '(%s)' % (' OR '.join(alternatives),), parameters
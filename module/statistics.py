@@ -0,0 +1,102 @@
+import time
+from module.database import Database
+
+
+class TagInterner:
+    """
+    将(type, name)驻留为连续的整数id。每个tag的名称、类型和标题只保存一份，聚合器之间只传递id。
+    """
+    def __init__(self):
+        self.__ids: dict[(str, str), int] = dict()
+        self.types: list[str] = []
+        self.names: list[str] = []
+        self.titles: list[str or None] = []
+
+    def intern(self, tag: dict):
+        key = (tag["type"], tag["name"])
+        tag_id = self.__ids.get(key)
+        if tag_id is None:
+            tag_id = len(self.names)
+            self.__ids[key] = tag_id
+            self.types.append(tag["type"])
+            self.names.append(tag["name"])
+            self.titles.append(tag.get("title"))
+        elif self.titles[tag_id] is None and tag.get("title") is not None:
+            self.titles[tag_id] = tag["title"]
+        return tag_id
+
+
+class TagTypeAggregator:
+    """
+    统计每种tag type下各有多少个不同的tag。
+    """
+    def __init__(self):
+        self.__seen: set[int] = set()
+
+    def feed(self, tag_ids: list[int], interner: TagInterner):
+        self.__seen.update(tag_ids)
+
+    def result(self, interner: TagInterner):
+        """
+        :return: list[(str, int)] (type, 不同tag数)列表，按数量降序
+        """
+        type_count: dict[str, int] = dict()
+        for tag_id in self.__seen:
+            tp = interner.types[tag_id]
+            type_count[tp] = type_count.get(tp, 0) + 1
+        return sorted(type_count.items(), key=lambda t: -t[1])
+
+
+class TagCountAggregator:
+    """
+    统计指定tag type下每个tag出现的记录数，以及没有任何此类型tag的记录数。
+    """
+    def __init__(self, tag_type: str):
+        self.tag_type = tag_type
+        self.__count: dict[int, int] = dict()
+        self.__absent = 0
+
+    def feed(self, tag_ids: list[int], interner: TagInterner):
+        types = interner.types
+        found = False
+        for tag_id in tag_ids:
+            if types[tag_id] == self.tag_type:
+                self.__count[tag_id] = self.__count.get(tag_id, 0) + 1
+                found = True
+        if not found:
+            self.__absent += 1
+
+    def result(self, interner: TagInterner):
+        """
+        :return: list[(str, int, str or None)], int (name, count, title)列表，按count升序；以及没有此类型tag的记录数
+        """
+        items = [(interner.names[i], c, interner.titles[i]) for (i, c) in self.__count.items()]
+        items.sort(key=lambda t: (t[1], t[0]))
+        return items, self.__absent
+
+
+def run_statistics(db: Database, aggregators: list, source: str or None = None):
+    """
+    单次流式扫描全部未删除记录的tags，驱动全部聚合器。
+    记录中存储的是tag字典表的id，每个字典id只在第一次出现时驻留一次，之后的记录不再构造任何tag对象。
+    :return: (TagInterner, int, float) 驻留表、扫描的记录数、耗时秒数
+    """
+    interner = TagInterner()
+    dictionary = db.tag_dictionary
+    mapping: dict[int, int] = dict()
+
+    start = time.perf_counter()
+    rows = 0
+    for ids in db.iter_tag_ids(source):
+        rows += 1
+        tag_ids = []
+        for i in ids:
+            tag_id = mapping.get(i)
+            if tag_id is None:
+                tp, name, title = dictionary.get(i)
+                tag_id = mapping[i] = interner.intern({"type": tp, "name": name, "title": title})
+            tag_ids.append(tag_id)
+        for aggregator in aggregators:
+            aggregator.feed(tag_ids, interner)
+
+    return interner, rows, time.perf_counter() - start
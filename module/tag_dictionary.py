@@ -0,0 +1,143 @@
+import sys
+import json
+from array import array
+
+
+# 来源没有给出类型的tag(例如complex中未收录在tag_types里的class)统一归入此类型
+UNKNOWN_TYPE = "unknown"
+
+
+def normalize_tags(tags: list[dict] or None):
+    """
+    将没有类型的tag归入UNKNOWN_TYPE。tag字典和tag统计以type为键，不允许为空。
+    :return: list[dict] or None 没有需要修改的tag时返回原列表
+    """
+    if tags is None or all(tag.get("type") is not None for tag in tags):
+        return tags
+    return [tag if tag.get("type") is not None else {**tag, "type": UNKNOWN_TYPE} for tag in tags]
+
+
+def pack_tag_ids(ids: list[int]):
+    """
+    将tag id列表打包为小端序的uint32字节串。
+    """
+    packed = array('I', ids)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_tag_ids(blob: bytes):
+    """
+    解包pack_tag_ids产生的字节串。
+    :return: array('I')
+    """
+    ids = array('I')
+    ids.frombytes(blob)
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids
+
+
+class TagDictionary:
+    """
+    tag字典表在内存中的副本，负责tag列表与紧凑存储格式之间的编解码。
+    紧凑格式中，每条记录的tags存储为两列: tag_ids是引用tag字典表的id数组；tag_counts是与之一一对应的count列表(JSON)，
+    count是每次抓取时的易变数据，因此不放入字典。type、name和title只在字典表中存储一份。
+    字典只会追加，其他进程新增的tag在解码遇到未知id时重新加载。
+    """
+    def __init__(self, conn):
+        self.__conn = conn
+        self.__tags: dict[int, (str, str, str or None)] = dict()
+        self.__ids: dict[(str, str), int] = dict()
+        self.__loaded = False
+
+    def __load(self):
+        cursor = self.__conn.cursor()
+        try:
+            for (tag_id, tp, name, title) in cursor.execute('SELECT id, type, name, title FROM tag'):
+                self.__tags[tag_id] = (tp, name, title)
+                self.__ids[(tp, name)] = tag_id
+            self.__loaded = True
+        finally:
+            cursor.close()
+
+    def reset(self):
+        self.__tags.clear()
+        self.__ids.clear()
+        self.__loaded = False
+
+    def get(self, tag_id: int):
+        """
+        :return: (str, str, str or None) (type, name, title)
+        """
+        if not self.__loaded:
+            self.__load()
+        tag = self.__tags.get(tag_id)
+        if tag is None:
+            self.__load()
+            tag = self.__tags[tag_id]
+        return tag
+
+    def intern(self, cursor, tags: list[dict]):
+        """
+        查找tag列表中每个tag的id，不存在的tag写入字典表。已存在的tag只在没有标题时补充标题。
+        同一条记录中重复的tag只保留第一次出现的位置。
+        :return: (list[int], list[dict]) id列表，和去重后与之对应的tag列表
+        """
+        if not self.__loaded:
+            self.__load()
+        ids, unique = [], []
+        seen = set()
+        for tag in normalize_tags(tags):
+            key = (tag["type"], tag["name"])
+            tag_id = self.__ids.get(key)
+            title = tag.get("title")
+            if tag_id is None or (title is not None and self.__tags[tag_id][2] is None):
+                (tag_id,) = cursor.execute('INSERT INTO tag(type, name, title) VALUES (?, ?, ?) '
+                                           'ON CONFLICT(type, name) DO UPDATE SET title = COALESCE(title, excluded.title) RETURNING id',
+                                           (tag["type"], tag["name"], title)).fetchone()
+                old = self.__tags.get(tag_id)
+                self.__tags[tag_id] = (tag["type"], tag["name"], old[2] if old is not None and old[2] is not None else title)
+                self.__ids[key] = tag_id
+            if tag_id not in seen:
+                seen.add(tag_id)
+                ids.append(tag_id)
+                unique.append(tag)
+        return ids, unique
+
+    def encode(self, cursor, tags: list[dict] or None):
+        """
+        :return: (list[int], bytes or None, str or None) tag id列表，以及写入tag_ids和tag_counts列的值
+        """
+        if tags is None:
+            return [], None, None
+        ids, unique = self.intern(cursor, tags)
+        counts = [tag.get("count") for tag in unique]
+        return ids, pack_tag_ids(ids), json.dumps(counts, separators=(',', ':')) if any(c is not None for c in counts) else None
+
+    def decode(self, tag_ids: bytes or None, tag_counts: str or None, tags_json: str or None = None):
+        """
+        将一条记录存储的tags还原为tag列表。尚未迁移到紧凑格式的记录仍从tags列的JSON解码。
+        :return: list[dict] or None
+        """
+        if tag_ids is None:
+            return normalize_tags(json.loads(tags_json)) if tags_json is not None and tags_json != '' else None
+        ids = unpack_tag_ids(tag_ids)
+        counts = json.loads(tag_counts) if tag_counts is not None else [None] * len(ids)
+        ret = []
+        for (tag_id, count) in zip(ids, counts):
+            tp, name, title = self.get(tag_id)
+            ret.append({"type": tp, "name": name, "title": title, "count": count})
+        return ret
+
+    def ids(self, cursor, tag_ids: bytes or None, tags_json: str or None = None):
+        """
+        取得一条记录的tag id列表，不构造tag字典。尚未迁移的记录通过字典查找id。
+        :return: list[int] or array('I')
+        """
+        if tag_ids is not None:
+            return unpack_tag_ids(tag_ids)
+        if tags_json is None or tags_json == '':
+            return []
+        return self.intern(cursor, json.loads(tags_json))[0]
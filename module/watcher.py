@@ -0,0 +1,147 @@
+import os
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+inotify_event_header = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """
+    基于inotify的目录监视器。仅在Linux下可用，监视目录下文件的写入完成、创建和移入事件。
+    """
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.__fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(self.__fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd < 0:
+            os.close(self.__fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+        self.__directory = directory
+
+    def poll(self, timeout: float):
+        """
+        等待至多timeout秒，返回期间发生变化的文件名列表。
+        当内核事件队列溢出时，退化为一次完整的目录扫描。
+        """
+        readable, _, _ = select.select([self.__fd], [], [], timeout)
+        if not readable:
+            return []
+        names, overflow = [], False
+        while True:
+            try:
+                data = os.read(self.__fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = inotify_event_header.unpack_from(data, offset)
+                offset += inotify_event_header.size
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif not mask & IN_ISDIR and length > 0:
+                    names.append(os.fsdecode(data[offset:offset + length].rstrip(b"\0")))
+                offset += length
+        if overflow:
+            return [f.name for f in os.scandir(self.__directory) if f.is_file()]
+        return names
+
+    def close(self):
+        os.close(self.__fd)
+
+
+class PollingWatcher:
+    """
+    基于定时扫描的目录监视器。在不支持inotify的平台上使用，比较前后两次扫描的文件大小和修改时间来发现变化。
+    """
+    def __init__(self, directory: str, interval: float):
+        self.__directory = directory
+        self.__interval = interval
+        self.__known = self.__scan()
+
+    def __scan(self):
+        result = dict()
+        for f in os.scandir(self.__directory):
+            try:
+                if f.is_file():
+                    stat = f.stat()
+                    result[f.name] = (stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                # 文件在列出目录和读取属性之间被删除
+                continue
+        return result
+
+    def poll(self, timeout: float):
+        time.sleep(min(timeout, self.__interval))
+        current = self.__scan()
+        names = [name for (name, stat) in current.items() if self.__known.get(name) != stat]
+        self.__known = current
+        return names
+
+    def close(self):
+        pass
+
+
+def create_watcher(directory: str, interval: float, polling: bool = False):
+    """
+    为指定目录创建监视器。优先使用inotify，不可用时回退至定时扫描。
+    :return: (watcher, str) 监视器，和它的类型名称
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(directory), "inotify"
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(directory, interval), "polling"
+
+
+class Debouncer:
+    """
+    对正在写入的文件做防抖。文件的大小和修改时间在debounce秒内保持不变，才视作写入完成。
+    """
+    def __init__(self, directory: str, debounce: float):
+        self.__directory = directory
+        self.__debounce = debounce
+        # name -> ((size, mtime), 最后一次观察到变化的时间)
+        self.__pending: dict[str, ((int, int), float)] = dict()
+
+    def add(self, names: list[str]):
+        now = time.monotonic()
+        for name in names:
+            self.__pending[name] = (None, now)
+
+    def has_pending(self):
+        return len(self.__pending) > 0
+
+    def ready(self):
+        """
+        返回已写入完成的文件名列表，并将它们移出等待队列。已消失的文件会被直接丢弃。
+        """
+        now = time.monotonic()
+        ready = []
+        for name, (last_stat, last_change) in list(self.__pending.items()):
+            try:
+                stat = os.stat(os.path.join(self.__directory, name))
+            except FileNotFoundError:
+                del self.__pending[name]
+                continue
+            current_stat = (stat.st_size, stat.st_mtime_ns)
+            if current_stat != last_stat:
+                self.__pending[name] = (current_stat, now)
+            elif now - last_change >= self.__debounce:
+                del self.__pending[name]
+                ready.append(name)
+        return ready
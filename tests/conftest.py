@@ -0,0 +1,24 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from module.database import Database
+
+
+def make_tags(*names):
+    return [{"type": "general", "name": name, "title": None, "count": "1"} for name in names]
+
+
+@pytest.fixture
+def database(tmp_path):
+    """
+    带有少量已解析记录的临时数据库。
+    """
+    db = Database(str(tmp_path / "data.db"))
+    db.insert_many([("complex", str(pid), "folder_%d" % (pid % 3,), "%d.jpg" % (pid,), None) for pid in range(1, 21)])
+    for pid in range(1, 21):
+        db.write_metadata("complex", str(pid), make_tags("common", "tag_%d" % (pid % 4,)),
+                          {"parent": [], "children": [], "pools": []}, {"md5": "%032d" % (pid,)})
+    return db
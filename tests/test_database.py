@@ -0,0 +1,80 @@
+from module.query import encode_token
+from conftest import make_tags
+
+
+def plan(db, **arguments):
+    return "\n".join(db.explain_list(limit=50, **arguments)[1])
+
+
+def test_id_order_uses_rowid(database):
+    lines = plan(database)
+    assert "USING INDEX" not in lines
+    assert "TEMP B-TREE" not in lines
+    assert "INTEGER PRIMARY KEY (rowid<?)" in plan(database, after=encode_token([], [10]))
+
+
+def test_time_orders_use_live_indexes(database):
+    for order, index in [(["-create-time"], "meta_live_create_time"), (["create-time"], "meta_live_create_time"),
+                         (["-analyse-time"], "meta_live_analyse_time_desc"), (["analyse-time"], "meta_live_analyse_time")]:
+        lines = plan(database, order=order)
+        assert "USING INDEX %s\n" % (index,) in lines + "\n", (order, lines)
+        assert "TEMP B-TREE" not in lines, (order, lines)
+    assert "meta_live_create_time (create_time<?)" in plan(database, order=["-create-time"], after=encode_token(["-create-time"], ["2020-01-01", 10]))
+
+
+def test_tag_expression_looks_up_rowids(database):
+    lines = plan(database, expression="tag_1")
+    assert "SEARCH meta USING INTEGER PRIMARY KEY (rowid=?)" in lines
+    assert "TEMP B-TREE" not in lines
+
+
+def test_pagination_matches_full_list(database):
+    database.mark_deleted("folder_1", "4.jpg")
+    for order in [[], ["-create-time"], ["analyse-time"], ["-analyse-time"]]:
+        expected = [record.pid for record in database.query_list(order=order)]
+        pages, after = [], None
+        while True:
+            records, after = database.query_page(order=order, limit=7, after=after)
+            pages += [record.pid for record in records]
+            if after is None:
+                break
+        assert pages == expected
+        assert "4" not in pages
+
+
+def test_fingerprint_follows_deletes_and_tag_edits(database):
+    fingerprints = [database.query_fingerprint()]
+    database.mark_deleted("folder_1", "4.jpg")
+    fingerprints.append(database.query_fingerprint())
+    database.insert("complex", "4", "folder_1", "4.jpg")
+    fingerprints.append(database.query_fingerprint())
+    database.write_metadata("complex", "5", make_tags("edited"), {"parent": [], "children": [], "pools": []}, None)
+    fingerprints.append(database.query_fingerprint())
+    assert len(set(fingerprints)) == len(fingerprints)
+
+
+def test_compact_tags_migration_keeps_row_versions(database, tmp_path):
+    import json
+    import sqlite3
+    connection = sqlite3.connect(str(tmp_path / "data.db"))
+    connection.execute("UPDATE meta SET tags = ?, tag_ids = NULL, tag_counts = NULL", (json.dumps(make_tags("legacy")),))
+    connection.commit()
+    versions = connection.execute("SELECT id, row_version FROM meta ORDER BY id").fetchall()
+    assert database.migrate_compact_tags() == 20
+    assert connection.execute("SELECT id, row_version FROM meta ORDER BY id").fetchall() == versions
+    connection.close()
+    assert [tag["name"] for tag in database.query_one("complex", "1").tags] == ["legacy"]
+
+
+def test_tombstones_for_rows_leaving_the_filter(database):
+    version_range = (database.query_row_version(), None)
+    database.insert("complex", "3", "folder_1", "3.jpg")
+    database.write_error_status("complex", "6")
+    database.mark_deleted("folder_0", "9.jpg")
+    database.write_metadata("complex", "12", make_tags("edited"), {"parent": [], "children": [], "pools": []}, None)
+    version_range = (version_range[0], database.query_row_version())
+    tombstones = set(pid for (_, pid) in database.iter_tombstones(version_range, folder="folder_0", status_in=["analysed"]))
+    exported = set(record.pid for record in database.iter_list(folder="folder_0", status_in=["analysed"], version_range=version_range))
+    # 3移到了folder_1，6解析失败，9被删除，12仍在folder_0中
+    assert tombstones == {"3", "6", "9"}
+    assert exported == {"12"}
@@ -0,0 +1,29 @@
+import json
+import command.export as export_module
+from module.database import Database
+
+
+def test_sql_and_python_paths_match(tmp_path, monkeypatch, capsys):
+    db_path = str(tmp_path / "data.db")
+    db = Database(db_path)
+    db.insert_many([("complex", str(pid), "archive", "%d.jpg" % (pid,), None) for pid in range(1, 6)])
+    for pid in range(1, 6):
+        tags = [{"type": "general", "name": "zebra_%d" % (pid,), "title": None, "count": "3"},
+                {"type": "artist", "name": "artist_%d" % (pid,), "title": "アーティスト", "count": "2"},
+                {"type": "general", "name": "apple", "title": None, "count": "1"},
+                {"type": None, "name": "untyped", "title": None, "count": "1"}]
+        relations = {"parent": [str(pid + 100)], "children": [], "pools": [{"id": 7, "name": "pool"}]}
+        db.write_metadata("complex", str(pid), tags, relations, None)
+    db.write_metadata("complex", "5", None, {"parent": [], "children": [], "pools": []}, None)
+    monkeypatch.setattr(export_module, "load_conf", lambda: {"work_path": {"db_path": db_path}})
+
+    outputs = []
+    for python_mapping in (False, True):
+        output = str(tmp_path / ("%s.jsonl" % (python_mapping,)))
+        export_module.export("archive", None, output, None, python_mapping)
+        with open(output) as f:
+            outputs.append([json.loads(line) for line in f])
+    assert len(outputs[0]) == 5
+    assert outputs[0] == outputs[1]
+    assert [t["name"] for t in outputs[0][0]["tags"]] == ["artist_1", "apple", "zebra_1", "untyped"]
+    assert outputs[0][4]["tags"] == []
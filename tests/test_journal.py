@@ -0,0 +1,67 @@
+import os
+import pytest
+from module.database import Database
+from module.journal import Journal, apply_plan, recover_journal
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.fixture
+def layout(tmp_path):
+    (tmp_path / "work").mkdir()
+    (tmp_path / "archive").mkdir()
+    (tmp_path / "work" / "1.jpg").write_bytes(b"1")
+    db = Database(str(tmp_path / "data.db"))
+    journal = Journal(str(tmp_path / "file-journal.json"))
+    plan = dict(moves=[(str(tmp_path / "work" / "1.jpg"), str(tmp_path / "archive" / "1.jpg"))],
+                records=[("complex", "1", "archive", "1.jpg", None)])
+    return tmp_path, db, journal, plan
+
+
+def crash_on_write(monkeypatch, count: int):
+    """
+    使第count次写日志时中断。
+    """
+    original, calls = Journal.write, []
+
+    def write(self, plan):
+        calls.append(plan)
+        if len(calls) == count:
+            raise Crash()
+        original(self, plan)
+
+    monkeypatch.setattr(Journal, "write", write)
+
+
+def test_rollback_before_database_commit(layout, monkeypatch):
+    tmp_path, db, journal, plan = layout
+    def insert_many(*args, **kwargs):
+        raise Crash()
+
+    monkeypatch.setattr(Database, "insert_many", insert_many)
+    with pytest.raises(Crash):
+        apply_plan(db, journal, **plan)
+    monkeypatch.undo()
+    assert recover_journal(db, journal, rollback=True)[0] == "rollback"
+    assert (tmp_path / "work" / "1.jpg").exists()
+    assert db.query_one("complex", "1") is None
+
+
+def test_no_rollback_after_database_commit(layout, monkeypatch):
+    tmp_path, db, journal, plan = layout
+    # 第一次写入计划，第二次标记提交: 在数据库提交之后、标记提交之前中断
+    crash_on_write(monkeypatch, 2)
+    with pytest.raises(Crash):
+        apply_plan(db, journal, **plan)
+    monkeypatch.undo()
+    pending = journal.load()
+    assert not pending["committed"]
+    assert db.query_plan_applied(pending["id"])
+    assert recover_journal(db, journal, rollback=True)[0] == "replay"
+    assert (tmp_path / "archive" / "1.jpg").exists()
+    assert not (tmp_path / "work" / "1.jpg").exists()
+    assert db.query_one("complex", "1").folder == "archive"
+    assert not journal.exists()
+    assert not db.query_plan_applied(pending["id"])
@@ -0,0 +1,57 @@
+import struct
+import pytest
+from module.probe import probe_file, probe_records
+
+
+def png():
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I4sII', 13, b'IHDR', 640, 480) + b'\x08\x02\x00\x00\x00'
+
+
+def jpeg():
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + bytes(9)
+    sof = b'\xff\xff\xc0' + struct.pack('>HBHH', 17, 8, 480, 640) + bytes(10)
+    return b'\xff\xd8' + app0 + sof
+
+
+def box(box_type: bytes, payload: bytes):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def mp4():
+    tkhd = box(b'tkhd', bytes(4 + 20 + 52) + struct.pack('>II', 640 << 16, 480 << 16))
+    return box(b'ftyp', b'isom' + bytes(4)) + box(b'moov', box(b'trak', tkhd))
+
+
+def element(element_id: bytes, payload: bytes):
+    return element_id + bytes([0x80 | len(payload)]) + payload
+
+
+def webm():
+    video = element(b'\xe0', element(b'\xb0', struct.pack('>H', 640)) + element(b'\xba', struct.pack('>H', 480)))
+    tracks = element(b'\x16\x54\xae\x6b', element(b'\xae', video))
+    return element(b'\x1a\x45\xdf\xa3', b'') + element(b'\x18\x53\x80\x67', tracks)
+
+
+@pytest.mark.parametrize("fmt, content", [("png", png()), ("jpeg", jpeg()), ("mp4", mp4()), ("webm", webm())])
+def test_probe_complete_header(tmp_path, fmt, content):
+    path = tmp_path / "file"
+    path.write_bytes(content)
+    assert probe_file(str(path)) == (fmt, 640, 480, len(content))
+
+
+@pytest.mark.parametrize("content", [png(), jpeg(), mp4(), webm(), b'\xff\xd8\xff\xff'])
+def test_probe_truncated_header(tmp_path, content):
+    path = tmp_path / "file"
+    for end in range(len(content)):
+        path.write_bytes(content[:end])
+        fmt, width, height, size = probe_file(str(path))
+        assert size == end
+        assert (width, height) in ((None, None), (640, 480))
+
+
+def test_probe_records_keeps_going(tmp_path):
+    (tmp_path / "folder").mkdir()
+    (tmp_path / "folder" / "a.jpg").write_bytes(b'\xff\xd8\xff\xff')
+    (tmp_path / "folder" / "b.png").write_bytes(png())
+    result = probe_records(str(tmp_path), [("complex", "1", "folder", "a.jpg"), ("complex", "2", "folder", "b.png"), ("complex", "3", "folder", "c.png")])
+    assert result == [(None, None, None, 4, "complex", "1"), ("png", 640, 480, len(png()), "complex", "2")]
@@ -0,0 +1,49 @@
+import pytest
+from module.query import Parser, QuerySyntaxError, tokenize, compile_expression, compile_order
+
+
+def parse(expression):
+    return Parser(expression).parse()
+
+
+def test_tokenize_quoted_value_after_key():
+    assert tokenize('artist:"a b" c') == [("word", "artist:a b"), ("word", "c")]
+    assert tokenize(r'"say \"hi\""') == [("quoted", 'say "hi"')]
+
+
+def test_and_or_precedence():
+    assert parse("a b OR c") == ("or", [("and", [("term", None, "a"), ("term", None, "b")]), ("term", None, "c")])
+    assert parse("a AND (b OR c)") == ("and", [("term", None, "a"), ("or", [("term", None, "b"), ("term", None, "c")])])
+
+
+def test_key_terms():
+    assert parse("Artist:foo") == ("term", "artist", "foo")
+    assert parse("foo:") == ("term", None, "foo:")
+    assert parse('"OR"') == ("term", None, "OR")
+
+
+def test_negation():
+    assert parse("NOT a") == ("not", ("term", None, "a"))
+    assert parse("-a") == ("not", ("term", None, "a"))
+    assert parse("-(a OR b)") == ("not", ("or", [("term", None, "a"), ("term", None, "b")]))
+    assert parse("x - b") == ("and", [("term", None, "x"), ("not", ("term", None, "b"))])
+    assert parse('-"a b"') == ("not", ("term", None, "a b"))
+    assert parse("--a") == ("not", ("not", ("term", None, "a")))
+
+
+@pytest.mark.parametrize("expression", ['artist:"abc', '"abc', '""', 'artist:""', "-", "a -", "(a", "a)", "a OR", "", "NOT", "AND"])
+def test_syntax_errors(expression):
+    with pytest.raises(QuerySyntaxError):
+        parse(expression)
+
+
+def test_compile_negated_group():
+    condition, parameters = compile_expression("-(a OR b)")
+    assert condition.startswith("NOT ((meta.id IN ")
+    assert parameters == ["a", "b"]
+
+
+def test_compile_order_rejects_unknown_column():
+    with pytest.raises(QuerySyntaxError):
+        compile_order(["-size"])
+    assert compile_order([]) == [("meta.id", True, False)]
@@ -0,0 +1,67 @@
+import os
+import command.watch as watch_module
+from module.watcher import Debouncer, PollingWatcher
+
+
+def test_debouncer_drops_file_deleted_mid_debounce(tmp_path):
+    (tmp_path / "a.jpg").write_bytes(b"a")
+    (tmp_path / "b.jpg").write_bytes(b"b")
+    debouncer = Debouncer(str(tmp_path), 0)
+    debouncer.add(["a.jpg", "b.jpg"])
+    assert debouncer.ready() == []
+    os.remove(tmp_path / "a.jpg")
+    assert debouncer.ready() == ["b.jpg"]
+    assert not debouncer.has_pending()
+
+
+def test_polling_watcher_skips_file_deleted_during_scan(tmp_path, monkeypatch):
+    watcher = PollingWatcher(str(tmp_path), 0)
+    (tmp_path / "a.jpg").write_bytes(b"a")
+    (tmp_path / "b.jpg").write_bytes(b"b")
+    entries = list(os.scandir(tmp_path))
+    os.remove(tmp_path / "a.jpg")
+    monkeypatch.setattr(os, "scandir", lambda directory: iter(entries))
+    assert watcher.poll(0) == ["b.jpg"]
+
+
+def test_watch_keeps_running_after_failed_batch(tmp_path, monkeypatch, capsys):
+    (tmp_path / "work").mkdir()
+    polls = [["a.jpg"], ["b.jpg"]]
+    processed = []
+
+    class Watcher:
+        def poll(self, timeout):
+            if len(polls) == 0:
+                raise KeyboardInterrupt()
+            return polls.pop(0)
+
+        def close(self):
+            pass
+
+    class ImmediateDebouncer:
+        def __init__(self, directory, debounce):
+            self.pending = []
+
+        def add(self, names):
+            self.pending += names
+
+        def has_pending(self):
+            return len(self.pending) > 0
+
+        def ready(self):
+            ready, self.pending = self.pending, []
+            return ready
+
+    def process(conf, db, journal, work_dir, archive, filenames):
+        processed.append(filenames)
+        if filenames == ["a.jpg"]:
+            raise FileNotFoundError("a.jpg")
+
+    conf = {"work_path": {"default_work_dir": str(tmp_path / "work"), "db_path": str(tmp_path / "data.db")}}
+    monkeypatch.setattr(watch_module, "load_conf", lambda: conf)
+    monkeypatch.setattr(watch_module, "create_watcher", lambda directory, interval, polling: (Watcher(), "test"))
+    monkeypatch.setattr(watch_module, "Debouncer", ImmediateDebouncer)
+    monkeypatch.setattr(watch_module, "__process", process)
+    watch_module.watch(None, "archive", None, 0, 0, True)
+    assert processed == [["a.jpg"], ["b.jpg"]]
+    assert "FileNotFoundError" in capsys.readouterr().out